@@ -0,0 +1,190 @@
+# asset_delivery.py
+"""
+練習画面などの配信を軽くする（静的アセットのバージョン付き配信と、HTML / JSON 応答の圧縮）。
+
+静的アセット（StaticAssets）:
+- static/ のファイルを /assets/<内容の sha256 先頭12桁>/<name> で配信する。内容が変われば URL が変わるので
+  Cache-Control: public, max-age=31536000, immutable を付けられる（テンプレートでは asset_url('practice.js')）
+- gzip（と brotli モジュールがあれば br）を初回アクセス時に作ってメモリに持つ。リクエストごとには圧縮しない
+- 古いバージョンの URL に来たときは今の内容を no-cache で返す（古い内容を長期キャッシュさせない）
+- ファイルの mtime が変わったら作り直す（開発中の編集がそのまま反映される）
+
+応答の圧縮（ResponseCompressor）:
+- text/html / application/json で min_bytes 以上の応答を、Accept-Encoding に応じて br / gzip で圧縮する
+- ストリーミング応答・Content-Encoding 付き・304 などはそのまま
+"""
+from __future__ import annotations
+from typing import Optional, Dict, Any, Tuple
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli はオプション
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+COMPRESSIBLE_MIMETYPES = ("text/html", "application/json")
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Accept-Encoding から使う圧縮方式（"br" / "gzip" / None）"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    wildcard = accepted.get("*", 0.0)
+    if brotli is not None and accepted.get("br", wildcard) > 0:
+        return "br"
+    if accepted.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+def _compress(data: bytes, encoding: str, gzip_level: int, brotli_quality: int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=brotli_quality)
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+
+
+class _Asset:
+    __slots__ = ("mtime", "version", "mimetype", "bodies")
+
+    def __init__(self, mtime: float, version: str, mimetype: str, bodies: Dict[Optional[str], bytes]):
+        self.mtime = mtime
+        self.version = version
+        self.mimetype = mimetype
+        self.bodies = bodies
+
+
+class StaticAssets:
+    def __init__(self, folder: str, url_prefix: str = "/assets"):
+        self.folder = os.path.abspath(folder)
+        self.url_prefix = url_prefix.rstrip("/")
+        self._assets: Dict[str, _Asset] = {}
+        self._lock = threading.Lock()
+        self.stats_counters: Dict[str, int] = {"served": 0, "not_modified": 0, "stale_version": 0}
+
+    def _path(self, name: str) -> Optional[str]:
+        path = os.path.abspath(os.path.join(self.folder, name))
+        if not path.startswith(self.folder + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def _get(self, name: str) -> Optional[_Asset]:
+        path = self._path(name)
+        if path is None:
+            return None
+        mtime = os.stat(path).st_mtime
+        asset = self._assets.get(name)
+        if asset is not None and asset.mtime == mtime:
+            return asset
+        with open(path, "rb") as f:
+            raw = f.read()
+        bodies: Dict[Optional[str], bytes] = {None: raw, "gzip": _compress(raw, "gzip", 9, 11)}
+        if brotli is not None:
+            bodies["br"] = _compress(raw, "br", 9, 11)
+        mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if mimetype.startswith("text/") or mimetype in ("application/javascript", "text/javascript"):
+            mimetype += "; charset=utf-8"
+        asset = _Asset(mtime, hashlib.sha256(raw).hexdigest()[:12], mimetype, bodies)
+        with self._lock:
+            self._assets[name] = asset
+        return asset
+
+    def url(self, name: str) -> str:
+        """テンプレート用: バージョン付きの URL（ファイルが無ければ例外）"""
+        asset = self._get(name)
+        if asset is None:
+            raise FileNotFoundError(f"static asset not found: {name}")
+        return f"{self.url_prefix}/{asset.version}/{name}"
+
+    def respond(self, name: str, version: str, accept_encoding: Optional[str],
+                if_none_match: Optional[str] = None) -> Optional[Tuple[int, bytes, Dict[str, str]]]:
+        """
+        return: (status, body, headers)。ファイルが無ければ None
+        """
+        asset = self._get(name)
+        if asset is None:
+            return None
+        encoding = negotiate_encoding(accept_encoding)
+        if encoding not in asset.bodies:
+            encoding = None
+        etag = f'"{asset.version}-{encoding or "identity"}"'
+        current = version == asset.version
+        headers = {
+            "Content-Type": asset.mimetype,
+            "Cache-Control": IMMUTABLE if current else "no-cache",
+            "ETag": etag,
+            "Vary": "Accept-Encoding",
+        }
+        with self._lock:
+            if not current:
+                self.stats_counters["stale_version"] += 1
+            if if_none_match and etag in if_none_match:
+                self.stats_counters["not_modified"] += 1
+                return 304, b"", headers
+            self.stats_counters["served"] += 1
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return 200, asset.bodies[encoding], headers
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            assets = {name: {"version": a.version, **{k or "identity": len(v) for k, v in a.bodies.items()}}
+                      for name, a in self._assets.items()}
+            return {"assets": assets, "brotli": brotli is not None, **self.stats_counters}
+
+
+class ResponseCompressor:
+    def __init__(self, min_bytes: int = 1024, gzip_level: int = 6, brotli_quality: int = 5,
+                 mimetypes_: Tuple[str, ...] = COMPRESSIBLE_MIMETYPES):
+        self.min_bytes = int(min_bytes)
+        self.gzip_level = int(gzip_level)
+        self.brotli_quality = int(brotli_quality)
+        self.mimetypes = mimetypes_
+        self._lock = threading.Lock()
+        self.stats_counters: Dict[str, int] = {"compressed": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def __call__(self, response, accept_encoding: Optional[str]):
+        """Flask の after_request から呼ぶ（圧縮しない応答はそのまま返す）"""
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough or response.is_streamed
+                or "Content-Encoding" in response.headers
+                or response.mimetype not in self.mimetypes):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = negotiate_encoding(accept_encoding)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_bytes:
+            return response
+        body = _compress(data, encoding, self.gzip_level, self.brotli_quality)
+        response.set_data(body)
+        response.headers["Content-Encoding"] = encoding
+        with self._lock:
+            self.stats_counters["compressed"] += 1
+            self.stats_counters["bytes_in"] += len(data)
+            self.stats_counters["bytes_out"] += len(body)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self.stats_counters)
+        out["ratio"] = round(out["bytes_out"] / out["bytes_in"], 3) if out["bytes_in"] else None
+        out["min_bytes"] = self.min_bytes
+        out["brotli"] = brotli is not None
+        return out
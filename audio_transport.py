@@ -0,0 +1,133 @@
+# audio_transport.py
+"""
+LEGACY Socket.IO 経路の音声のやり取り（ブラウザ ⇔ サーバー）の形式。
+
+- base64 : 従来どおり {"audio": "<base64>"}（既定・フォールバック）
+- binary : {"audio": <bytes>, "seq": n}。Socket.IO のバイナリ添付で送るので base64 の +33% と変換CPUが無い
+
+クライアントは接続後に 'audio_transport' イベントで希望を送り、ack で確定した形式を受け取る。
+  → {"transport": "binary", "format": "pcm16", "sample_rate": 24000, "channels": 1, "output": "wav"}
+  ← {"ok": true, "transport": "binary", "format": "pcm16", "sample_rate": 24000, "channels": 1, "output": "wav"}
+入力の形式は OpenAI Realtime の input_audio_format（pcm16 / 24kHz / mono）に固定。
+違う形式を希望された場合は ok=false と必要な形式を返し、形式は変えない。
+（OpenAI への転送は API の仕様上 JSON + base64 のまま）
+"""
+from __future__ import annotations
+from typing import Optional, Dict, Any, Tuple
+import base64
+import time
+
+TRANSPORTS = ("base64", "binary")
+OUTPUTS = ("wav", "pcm16")
+INPUT_FORMAT = {"format": "pcm16", "sample_rate": 24000, "channels": 1}
+
+
+class AudioTransport:
+    """1クライアントにつき1つ。形式の交渉・入出力の変換・計測を受け持つ"""
+    def __init__(self, allow_binary: bool = True):
+        self.allow_binary = allow_binary
+        self.transport = "base64"
+        self.output = "wav"
+        self._seq_in: Optional[int] = None
+        self._seq_out = 0
+        self.counters: Dict[str, float] = {
+            "chunks_in": 0, "wire_bytes_in": 0, "pcm_bytes_in": 0,
+            "seq_gaps": 0, "seq_reordered": 0,
+            "chunks_out": 0, "wire_bytes_out": 0, "audio_bytes_out": 0,
+            "codec_ms": 0.0,
+        }
+
+    def negotiate(self, req: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        req = req or {}
+        for k, v in INPUT_FORMAT.items():
+            if k in req and str(req[k]) != str(v):
+                return {"ok": False, "error": f"unsupported input {k}: {req[k]}", "required": dict(INPUT_FORMAT),
+                        "transport": self.transport, "output": self.output}
+        want = req.get("transport") or self.transport
+        self.transport = want if want in TRANSPORTS and (want != "binary" or self.allow_binary) else "base64"
+        out = req.get("output") or self.output
+        self.output = out if out in OUTPUTS else "wav"
+        self._seq_in = None
+        return {"ok": True, "transport": self.transport, "output": self.output, **INPUT_FORMAT}
+
+    # ---- client -> server ----
+    def decode_in(self, data: Any) -> Optional[bytes]:
+        """audio_data イベントの payload から PCM を取り出す（bytes でも base64 でも受ける）"""
+        if not isinstance(data, dict):
+            return None
+        audio = data.get("audio")
+        if not audio:
+            return None
+        self._note_seq(data.get("seq"))
+        if isinstance(audio, (bytes, bytearray, memoryview)):
+            pcm = bytes(audio)
+            wire = len(pcm)
+        else:
+            t0 = time.perf_counter()
+            pcm = base64.b64decode(audio)
+            self.counters["codec_ms"] += (time.perf_counter() - t0) * 1000.0
+            wire = len(audio)
+        self.counters["chunks_in"] += 1
+        self.counters["wire_bytes_in"] += wire
+        self.counters["pcm_bytes_in"] += len(pcm)
+        return pcm
+
+    def _note_seq(self, seq: Any) -> None:
+        if not isinstance(seq, int):
+            return
+        if self._seq_in is not None:
+            if seq <= self._seq_in:
+                self.counters["seq_reordered"] += 1
+                return
+            if seq > self._seq_in + 1:
+                self.counters["seq_gaps"] += seq - self._seq_in - 1
+        self._seq_in = seq
+
+    # ---- server -> client ----
+    def encode_out(self, pcm: bytes, wav: Optional[bytes] = None) -> Dict[str, Any]:
+        """
+        AI音声を audio_data イベントの payload にする。
+        wav は output=wav のときに使う（未指定なら pcm をそのまま送る）
+        """
+        body = wav if (self.output == "wav" and wav is not None) else pcm
+        fmt = "wav" if body is wav else "pcm16"
+        self._seq_out += 1
+        if self.transport == "binary":
+            payload: Dict[str, Any] = {"audio": body, "seq": self._seq_out, "format": fmt}
+            wire = len(body)
+        else:
+            t0 = time.perf_counter()
+            b64 = base64.b64encode(body).decode("ascii")
+            self.counters["codec_ms"] += (time.perf_counter() - t0) * 1000.0
+            payload = {"audio": b64, "seq": self._seq_out, "format": fmt}
+            wire = len(b64)
+        self.counters["chunks_out"] += 1
+        self.counters["wire_bytes_out"] += wire
+        self.counters["audio_bytes_out"] += len(body)
+        return payload
+
+    def stats(self) -> Dict[str, Any]:
+        c = dict(self.counters)
+        c["codec_ms"] = round(c["codec_ms"], 3)
+        c["transport"] = self.transport
+        c["output"] = self.output
+        return c
+
+
+def pcm_to_wav(pcm_bytes: bytes, sample_rate: int = 24000, channels: int = 1) -> bytes:
+    import io
+    import wave
+    with io.BytesIO() as wav_buffer:
+        with wave.open(wav_buffer, "wb") as wav_file:
+            wav_file.setnchannels(channels)
+            wav_file.setsampwidth(2)  # 16bit
+            wav_file.setframerate(sample_rate)
+            wav_file.writeframes(pcm_bytes)
+        return wav_buffer.getvalue()
+
+
+def wire_overhead(stats: Dict[str, Any]) -> Tuple[float, float]:
+    """(入力, 出力) の「回線上のバイト / 音声バイト」比"""
+    i = stats["wire_bytes_in"] / stats["pcm_bytes_in"] if stats.get("pcm_bytes_in") else 0.0
+    o = stats["wire_bytes_out"] / stats["audio_bytes_out"] if stats.get("audio_bytes_out") else 0.0
+    return round(i, 3), round(o, 3)
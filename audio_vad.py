@@ -0,0 +1,223 @@
+# audio_vad.py
+"""
+LEGACY WebSocket 経路のマイク音声（PCM16 mono / 24kHz）を、OpenAI へ転送する前に整える。
+
+- 小さなチャンクは捨てずに固定長フレーム（frame_ms）へまとめる
+- フレームごとのエネルギー（dBFS）とゼロ交差率で発話 / 無音を判定する
+- 発話の直前 preroll_ms は残し、発話後の無音は keep_silence_ms まで転送してそれ以降は捨てる
+  （server_vad の silence_duration_ms より長くしておくと、ターン検出はそのまま効く）
+- 転送は send_ms 単位にまとめる。まとめ待ちで増えた遅延と、削減できたバイト数を stats() で返す
+
+numpy があればフレーム解析をベクトル化する（無ければ array での逐次計算）。
+設定は環境変数（AUDIO_VAD_*）を既定にし、シナリオの "audio_vad": {...} で上書きできる。
+"""
+from __future__ import annotations
+from array import array
+from collections import deque
+from dataclasses import dataclass, fields, replace
+from typing import Optional, Dict, Any, List, Tuple
+import math
+import os
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:  # numpy が無い環境では逐次計算
+    np = None
+
+_SWAP = sys.byteorder != "little"  # PCM16 はリトルエンディアン
+
+
+@dataclass(frozen=True)
+class VadConfig:
+    enabled: bool = True
+    sample_rate: int = 24000
+    frame_ms: int = 20
+    energy_threshold_db: float = -45.0  # これ以上の音量のフレームを発話とみなす
+    zcr_max: float = 0.4                # ゼロ交差率がこれを超える弱い音はノイズとみなす
+    noise_margin_db: float = 10.0       # threshold + margin を超える音は ZCR に関係なく発話
+    preroll_ms: int = 200
+    keep_silence_ms: int = 2200
+    send_ms: int = 100
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.sample_rate * self.frame_ms // 1000 * 2
+
+    @classmethod
+    def from_env(cls) -> "VadConfig":
+        kw: Dict[str, Any] = {}
+        for f in fields(cls):
+            v = os.environ.get(f"AUDIO_VAD_{f.name.upper()}")
+            if v is None or v == "":
+                continue
+            kw[f.name] = _coerce(f.type, v)
+        return cls(**kw)
+
+    def with_overrides(self, overrides: Optional[Dict[str, Any]]) -> "VadConfig":
+        if not isinstance(overrides, dict):
+            return self
+        names = {f.name: f.type for f in fields(self)}
+        kw = {k: _coerce(names[k], v) for k, v in overrides.items() if k in names}
+        return replace(self, **kw) if kw else self
+
+
+def _coerce(type_name, v):
+    t = type_name if isinstance(type_name, str) else getattr(type_name, "__name__", "")
+    if t == "bool":
+        return v if isinstance(v, bool) else str(v).lower() in ("1", "true", "yes", "on")
+    if t == "int":
+        return int(v)
+    if t == "float":
+        return float(v)
+    return v
+
+
+def config_for_scenario(scenario: Optional[Dict[str, Any]], base: Optional[VadConfig] = None) -> VadConfig:
+    base = base or VadConfig.from_env()
+    return base.with_overrides((scenario or {}).get("audio_vad"))
+
+
+def analyze_frames(pcm: bytes, frame_bytes: int) -> List[Tuple[float, float]]:
+    """
+    len(pcm) は frame_bytes の倍数であること。
+    return: フレームごとの (エネルギー dBFS, ゼロ交差率)
+    """
+    n_frames = len(pcm) // frame_bytes
+    if n_frames == 0:
+        return []
+    per = frame_bytes // 2
+    if np is not None:
+        x = np.frombuffer(pcm, dtype="<i2", count=n_frames * per).reshape(n_frames, per).astype(np.float32)
+        rms = np.sqrt(np.mean(x * x, axis=1))
+        db = 20.0 * np.log10(np.maximum(rms, 1.0) / 32768.0)
+        signs = np.signbit(x)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / float(per - 1)
+        return list(zip(db.tolist(), zcr.tolist()))
+
+    samples = array("h")
+    samples.frombytes(pcm[: n_frames * frame_bytes])
+    if _SWAP:
+        samples.byteswap()
+    out = []
+    for i in range(n_frames):
+        frame = samples[i * per:(i + 1) * per]
+        energy = 0
+        crossings = 0
+        prev_neg = frame[0] < 0
+        for s in frame:
+            energy += s * s
+            neg = s < 0
+            if neg != prev_neg:
+                crossings += 1
+            prev_neg = neg
+        rms = math.sqrt(energy / per)
+        out.append((20.0 * math.log10(max(rms, 1.0) / 32768.0), crossings / float(per - 1)))
+    return out
+
+
+class AudioPreprocessor:
+    """
+    1クライアント（1マイクストリーム）ごとに1つ。push() した PCM から、転送すべきチャンクを返す。
+    """
+    def __init__(self, config: Optional[VadConfig] = None):
+        self.config = config or VadConfig.from_env()
+        c = self.config
+        self._frame_bytes = c.frame_bytes
+        self._remainder = b""
+        self._preroll: deque = deque(maxlen=max(0, c.preroll_ms // c.frame_ms))
+        self._send_frames = max(1, c.send_ms // c.frame_ms)
+        self._keep_silence_frames = max(0, c.keep_silence_ms // c.frame_ms)
+        self._silence_run = self._keep_silence_frames  # 開始時は「無音が続いている」扱い
+        self._pending: List[bytes] = []
+        self._pending_since: Optional[float] = None
+        self.counters: Dict[str, float] = {
+            "bytes_in": 0, "bytes_out": 0, "frames_speech": 0, "frames_silence": 0,
+            "frames_dropped": 0, "chunks_in": 0, "chunks_out": 0,
+            "latency_ms_total": 0.0, "latency_ms_max": 0.0,
+        }
+
+    def _is_speech(self, db: float, zcr: float) -> bool:
+        c = self.config
+        if db >= c.energy_threshold_db + c.noise_margin_db:
+            return True
+        return db >= c.energy_threshold_db and zcr <= c.zcr_max
+
+    def push(self, pcm: bytes, now: Optional[float] = None) -> List[bytes]:
+        now = time.monotonic() if now is None else now
+        self.counters["chunks_in"] += 1
+        self.counters["bytes_in"] += len(pcm)
+        if not self.config.enabled:
+            return self._emit([pcm], now, force=True)
+
+        data = self._remainder + pcm
+        usable = len(data) - len(data) % self._frame_bytes
+        self._remainder = data[usable:]
+        fb = self._frame_bytes
+        keep: List[bytes] = []
+        for i, (db, zcr) in enumerate(analyze_frames(data[:usable], fb)):
+            frame = data[i * fb:(i + 1) * fb]
+            if self._is_speech(db, zcr):
+                self.counters["frames_speech"] += 1
+                if self._silence_run >= self._keep_silence_frames and self._preroll:
+                    keep.extend(self._preroll)  # 発話の立ち上がりを欠かさない
+                self._preroll.clear()
+                self._silence_run = 0
+                keep.append(frame)
+            else:
+                self.counters["frames_silence"] += 1
+                self._silence_run += 1
+                if self._silence_run <= self._keep_silence_frames:
+                    keep.append(frame)
+                else:
+                    # preroll から押し出されるフレーム（maxlen=0 なら自分自身）は捨てる
+                    if len(self._preroll) == self._preroll.maxlen:
+                        self.counters["frames_dropped"] += 1
+                    self._preroll.append(frame)
+        return self._emit(keep, now)
+
+    def _emit(self, frames: List[bytes], now: float, force: bool = False) -> List[bytes]:
+        if frames:
+            if self._pending_since is None:
+                self._pending_since = now
+            self._pending.extend(frames)
+        # 無音を捨て始めたら、まとめ待ちせずに送る（発話末尾を待たせない）
+        if not self._pending:
+            return []
+        if not force and len(self._pending) < self._send_frames and self._silence_run <= self._keep_silence_frames:
+            return []
+        return [self._take(now)]
+
+    def _take(self, now: float) -> bytes:
+        chunk = b"".join(self._pending)
+        waited = (now - self._pending_since) * 1000.0 if self._pending_since is not None else 0.0
+        self._pending = []
+        self._pending_since = None
+        self.counters["chunks_out"] += 1
+        self.counters["bytes_out"] += len(chunk)
+        self.counters["latency_ms_total"] += waited
+        self.counters["latency_ms_max"] = max(self.counters["latency_ms_max"], waited)
+        return chunk
+
+    def flush(self, now: Optional[float] = None) -> List[bytes]:
+        """commit の直前に呼ぶ。まとめ待ちのフレームと端数をすべて返す"""
+        now = time.monotonic() if now is None else now
+        if self._remainder and self._silence_run <= self._keep_silence_frames:
+            if self._pending_since is None:
+                self._pending_since = now
+            self._pending.append(self._remainder)
+        self._remainder = b""
+        if not self._pending:
+            return []
+        return [self._take(now)]
+
+    def stats(self) -> Dict[str, Any]:
+        c = dict(self.counters)
+        c["bytes_saved"] = max(0, int(c["bytes_in"] - c["bytes_out"]))
+        c["saved_ratio"] = round(c["bytes_saved"] / c["bytes_in"], 3) if c["bytes_in"] else 0.0
+        c["latency_ms_avg"] = round(c["latency_ms_total"] / c["chunks_out"], 1) if c["chunks_out"] else 0.0
+        c["latency_ms_max"] = round(c["latency_ms_max"], 1)
+        del c["latency_ms_total"]
+        c["vectorized"] = np is not None
+        return c
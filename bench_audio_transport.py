@@ -0,0 +1,109 @@
+# bench_audio_transport.py
+"""
+LEGACY Socket.IO 経路の音声形式（base64 / binary）を、1セッション分の通信で比較する。
+
+  python bench_audio_transport.py --minutes 5 --chunk-ms 100
+
+- 上り: マイクPCM（pcm16/24kHz）を chunk-ms ごとに audio_data で送る想定
+- 下り: AI音声（WAV）を responses 回、1回 response-sec 秒ぶん送る想定
+- 回線上のバイト: Socket.IO パケット（テキスト部 + バイナリ添付）の合計
+- サーバーCPU: 上りのパケット復元 + PCM取り出し、下りの payload 作成 + パケット化（time.process_time）
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from socketio import packet
+
+from audio_transport import AudioTransport, pcm_to_wav
+
+SAMPLE_RATE = 24000
+
+
+def _wire_len(encoded) -> int:
+    parts = encoded if isinstance(encoded, list) else [encoded]
+    return sum(len(p.encode("utf-8")) if isinstance(p, str) else len(p) for p in parts)
+
+
+def _client_packets(mode: str, chunks):
+    """クライアントが送る audio_data パケット（エンコード済み）"""
+    import base64
+    out = []
+    for seq, pcm in enumerate(chunks, 1):
+        audio = pcm if mode == "binary" else base64.b64encode(pcm).decode("ascii")
+        out.append(packet.Packet(packet.EVENT, data=["audio_data", {"audio": audio, "seq": seq}]).encode())
+    return out
+
+
+def _decode_packet(encoded):
+    if isinstance(encoded, list):
+        pkt = packet.Packet(encoded_packet=encoded[0])
+        for att in encoded[1:]:
+            pkt.add_attachment(att)
+    else:
+        pkt = packet.Packet(encoded_packet=encoded)
+    return pkt.data[1]
+
+
+def run(mode: str, minutes: float, chunk_ms: int, responses: int, response_sec: float):
+    chunk = bytes(SAMPLE_RATE * chunk_ms // 1000 * 2)
+    n_chunks = int(minutes * 60 * 1000 / chunk_ms)
+    ai_pcm = bytes(int(SAMPLE_RATE * response_sec) * 2)
+    inbound = _client_packets(mode, [chunk] * n_chunks)  # クライアント側の作業は計測外
+
+    tr = AudioTransport()
+    tr.negotiate({"transport": mode, "output": "wav"})
+    wire_in = sum(_wire_len(p) for p in inbound)
+
+    cpu0 = time.process_time()
+    for p in inbound:
+        tr.decode_in(_decode_packet(p))
+    cpu_in = time.process_time() - cpu0
+
+    wire_out = 0
+    cpu0 = time.process_time()
+    for _ in range(responses):
+        payload = tr.encode_out(ai_pcm, pcm_to_wav(ai_pcm))
+        wire_out += _wire_len(packet.Packet(packet.EVENT, data=["audio_data", payload]).encode())
+    cpu_out = time.process_time() - cpu0
+
+    st = tr.stats()
+    return {
+        "mode": mode,
+        "wire_in_kb": round(wire_in / 1024, 1),
+        "wire_out_kb": round(wire_out / 1024, 1),
+        "audio_kb": round((st["pcm_bytes_in"] + st["audio_bytes_out"]) / 1024, 1),
+        "cpu_in_ms": round(cpu_in * 1000, 1),
+        "cpu_out_ms": round(cpu_out * 1000, 1),
+        "codec_ms": st["codec_ms"],
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="base64 / binary 音声形式の比較（1セッションあたり）")
+    parser.add_argument("--minutes", type=float, default=5)
+    parser.add_argument("--chunk-ms", type=int, default=100)
+    parser.add_argument("--responses", type=int, default=30)
+    parser.add_argument("--response-sec", type=float, default=4)
+    args = parser.parse_args(argv)
+
+    rows = [run(m, args.minutes, args.chunk_ms, args.responses, args.response_sec) for m in ("base64", "binary")]
+    for r in rows:
+        print(json.dumps(r, ensure_ascii=False))
+    b64, binr = rows
+    total_b64 = b64["wire_in_kb"] + b64["wire_out_kb"]
+    total_bin = binr["wire_in_kb"] + binr["wire_out_kb"]
+    print(json.dumps({
+        "wire_saved_ratio": round(1 - total_bin / total_b64, 3) if total_b64 else None,
+        "cpu_saved_ms": round(b64["cpu_in_ms"] + b64["cpu_out_ms"] - binr["cpu_in_ms"] - binr["cpu_out_ms"], 1),
+    }, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
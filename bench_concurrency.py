@@ -0,0 +1,227 @@
+# bench_concurrency.py
+"""
+並行処理の方式（APP_CONCURRENCY=eventlet / gevent / threading）ごとに、同じ負荷をかけて比較する。
+
+  python bench_concurrency.py --modes eventlet,gevent,threading --seconds 10 --http-clients 16 --sio-clients 16
+
+方式ごとに test_OpenAI_WebUI.py を別プロセスで起動し（APP_CONCURRENCY と PORT を指定）、
+NDJSON インポートで sessions を用意してから、以下を同時に流す。
+- HTTP: GET /api/session/<id>/feedback（DB読み）70% / POST /api/session/<id>/transcript（DB書き）20% /
+        GET /api/stats（集計）10%
+- Socket.IO: 接続したクライアントが audio_transport を ack 付きで送り続ける（往復時間）
+計測: HTTP の req/s と p50/p99、Socket.IO の ack/s と p50/p99、接続失敗・エラー数、
+サーバーの RSS（終了時）と最大 RSS（VmHWM）。負荷をかける側も同じマシンで動く点に注意。
+"""
+from __future__ import annotations
+import argparse
+import gzip
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _percentile(arr, p):
+    if not arr:
+        return 0.0
+    return arr[min(len(arr) - 1, int(len(arr) * p))]
+
+
+def _proc_mem_kb(pid: int):
+    out = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    k, v = line.split(":", 1)
+                    out[k] = int(v.split()[0])
+    except OSError:
+        pass
+    return out.get("VmRSS"), out.get("VmHWM")
+
+
+def _transcript(turns: int):
+    lines = []
+    for i in range(turns):
+        role = "user" if i % 2 else "assistant"
+        lines.append({"role": role, "text": "結論から申し上げます。進捗は予定どおりで、課題は一点です。", "ts": i})
+    return {"transcript": lines}
+
+
+def _seed_ndjson(n: int) -> bytes:
+    now = int(time.time())
+    rows = []
+    for i in range(n):
+        rows.append(json.dumps({
+            "session": {"session_id": f"bench-{i:05d}", "scenario_id": "free_talk", "mode": "basic",
+                        "title": "bench", "instructions": "", "created_at": now - i},
+            "transcript": _transcript(20),
+            "feedback": {"score": 60 + i % 40, "summary": "ベンチ用"},
+        }, ensure_ascii=False))
+    return gzip.compress(("\n".join(rows) + "\n").encode("utf-8"))
+
+
+def _wait_ready(base: str, proc, timeout: float = 30.0) -> bool:
+    import requests
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            return False
+        try:
+            if requests.get(base + "/api/startup", timeout=1).ok:
+                return True
+        except Exception:
+            time.sleep(0.2)
+    return False
+
+
+def _http_worker(base, ids, stop, out, lock):
+    import requests
+    s = requests.Session()
+    lat, errors = [], 0
+    rnd = random.Random()
+    body = _transcript(20)
+    while not stop.is_set():
+        sid = rnd.choice(ids)
+        r = rnd.random()
+        t0 = time.perf_counter()
+        try:
+            if r < 0.7:
+                res = s.get(f"{base}/api/session/{sid}/feedback", timeout=10)
+            elif r < 0.9:
+                res = s.post(f"{base}/api/session/{sid}/transcript", json=body, timeout=10)
+            else:
+                res = s.get(f"{base}/api/stats", timeout=10)
+            if res.status_code >= 400:
+                errors += 1
+        except Exception:
+            errors += 1
+            continue
+        lat.append(time.perf_counter() - t0)
+    with lock:
+        out["http_lat"].extend(lat)
+        out["http_errors"] += errors
+
+
+def _sio_worker(base, stop, out, lock):
+    import socketio
+    lat, errors = [], 0
+    client = socketio.Client(reconnection=False)
+    try:
+        client.connect(base, transports=["websocket"], wait_timeout=10)
+    except Exception:
+        with lock:
+            out["sio_connect_errors"] += 1
+        return
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        try:
+            client.call("audio_transport", {"transport": "binary"}, timeout=10)
+        except Exception:
+            errors += 1
+            continue
+        lat.append(time.perf_counter() - t0)
+    client.disconnect()
+    with lock:
+        out["sio_lat"].extend(lat)
+        out["sio_errors"] += errors
+
+
+def run_mode(mode: str, port: int, seconds: float, http_clients: int, sio_clients: int, sessions: int):
+    import requests
+
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, APP_CONCURRENCY=mode, PORT=str(port), SQLITE_PATH=os.path.join(workdir, "bench.db"),
+               ENABLE_LEGACY_OPENAI_WS="0", FEEDBACK_PREGENERATE="0")
+    env.pop("APP_PIN", None)
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, "test_OpenAI_WebUI.py")], cwd=HERE, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+    base = f"http://127.0.0.1:{port}"
+    row = {"mode": mode}
+    try:
+        if not _wait_ready(base, proc):
+            row["error"] = f"server did not start (see {log.name})"
+            return row
+        row["server"] = requests.get(base + "/api/startup").json()
+        requests.post(base + "/api/import", data=_seed_ndjson(sessions),
+                      headers={"Content-Encoding": "gzip", "Content-Type": "application/x-ndjson"}).raise_for_status()
+        ids = [f"bench-{i:05d}" for i in range(sessions)]
+        _, hwm_before = _proc_mem_kb(proc.pid)
+
+        out = {"http_lat": [], "http_errors": 0, "sio_lat": [], "sio_errors": 0, "sio_connect_errors": 0}
+        lock = threading.Lock()
+        stop = threading.Event()
+        threads = [threading.Thread(target=_sio_worker, args=(base, stop, out, lock)) for _ in range(sio_clients)]
+        threads += [threading.Thread(target=_http_worker, args=(base, ids, stop, out, lock))
+                    for _ in range(http_clients)]
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join(30)
+        rss, hwm = _proc_mem_kb(proc.pid)
+
+        http_lat = sorted(out["http_lat"])
+        sio_lat = sorted(out["sio_lat"])
+        row.update({
+            "http_rps": round(len(http_lat) / seconds, 1),
+            "http_p50_ms": round(_percentile(http_lat, 0.50) * 1000, 1),
+            "http_p99_ms": round(_percentile(http_lat, 0.99) * 1000, 1),
+            "http_errors": out["http_errors"],
+            "sio_acks_per_sec": round(len(sio_lat) / seconds, 1),
+            "sio_p50_ms": round(_percentile(sio_lat, 0.50) * 1000, 1),
+            "sio_p99_ms": round(_percentile(sio_lat, 0.99) * 1000, 1),
+            "sio_errors": out["sio_errors"] + out["sio_connect_errors"],
+            "rss_mb": round((rss or 0) / 1024, 1),
+            "peak_rss_mb": round((hwm or 0) / 1024, 1),
+            "idle_peak_rss_mb": round((hwm_before or 0) / 1024, 1),
+        })
+        return row
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        log.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="APP_CONCURRENCY ごとの HTTP / Socket.IO 負荷比較")
+    parser.add_argument("--modes", default="eventlet,gevent,threading")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--http-clients", type=int, default=16)
+    parser.add_argument("--sio-clients", type=int, default=16)
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--port", type=int, default=5310)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    rows = []
+    for i, mode in enumerate(args.modes.split(",")):
+        rows.append(run_mode(mode.strip(), args.port + i, args.seconds, args.http_clients, args.sio_clients,
+                             args.sessions))
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return 0
+    cols = ("mode", "http_rps", "http_p50_ms", "http_p99_ms", "http_errors",
+            "sio_acks_per_sec", "sio_p50_ms", "sio_p99_ms", "sio_errors", "rss_mb", "peak_rss_mb")
+    print(" ".join(f"{c:>16}" for c in cols))
+    for r in rows:
+        if r.get("error"):
+            print(f"{r['mode']:>16} {r['error']}")
+            continue
+        print(" ".join(f"{r.get(c, ''):>16}" for c in cols))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+# bench_emit_bus.py
+"""
+emit bus（emit_bus.py の Unix ソケット broker）の、ワーカー数に対するスループットと遅延を測る。
+
+  python bench_emit_bus.py --workers 1,2,4,8 --messages 5000 --rate 1000
+
+- ワーカー数 N ごとに、送信プロセス N 個（feedback ジョブ・relay 想定）と受信プロセス N 個（Web ワーカー想定）を起動
+- 送信側は emitter(url).emit(...)（Socket.IO の emit と同じ経路で JSON 化して publish）
+- 受信側は全メッセージ（N × messages）を受け取り、送信時刻からの遅延を記録
+- 受信側の Socket.IO クライアントへの配送（room の参照・パケット化）は含まない
+- rate は送信プロセスあたりの毎秒メッセージ数（0 で上限なし）
+"""
+from __future__ import annotations
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from emit_bus import UnixSocketBroker, UnixSocketManager, emitter, session_room, _recv_frame
+
+
+def _percentile(arr, p):
+    if not arr:
+        return 0.0
+    return arr[min(len(arr) - 1, int(len(arr) * p))]
+
+
+def _publisher(url, worker, messages, rate, payload_chars, start_at):
+    bus = emitter(url)
+    text = "結論から申し上げます。" * max(1, payload_chars // 10)
+    interval = 1.0 / rate if rate > 0 else 0.0
+    while time.time() < start_at:
+        time.sleep(0.001)
+    t0 = time.perf_counter()
+    for i in range(messages):
+        if interval:
+            delay = t0 + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        bus.emit("bench", {"t": time.time(), "w": worker, "i": i, "text": text}, room=session_room(f"s{i % 100}"),
+                 namespace="/")
+
+
+def _listener(url, expected, ready, out, timeout):
+    import socket
+    mgr = UnixSocketManager(url, write_only=True)
+    sock = mgr._connect(listen=True)  # Web ワーカーの受信スレッドと同じ接続・フレーム
+    sock.settimeout(5.0)
+    ready.set()
+    lat = []
+    first = last = None
+    deadline = time.time() + timeout
+    try:
+        while len(lat) < expected and time.time() < deadline:
+            payload = _recv_frame(sock)
+            if payload is None:
+                break
+            now = time.time()
+            msg = json.loads(payload)
+            lat.append(now - msg["data"][0]["t"])
+            first = first or now
+            last = now
+    except socket.timeout:
+        pass  # 取りこぼし（delivered < expected で分かる）
+    out.put({"received": len(lat), "lat": sorted(lat), "span": (last - first) if first else 0.0})
+
+
+def run(workers, messages, rate, payload_chars, timeout=120.0):
+    sock = os.path.join(tempfile.mkdtemp(), "bus.sock")
+    url = f"unix://{sock}"
+    broker = UnixSocketBroker(sock)
+    broker.start_in_thread()
+
+    out = mp.Queue()
+    listeners = []
+    for _ in range(workers):
+        ready = mp.Event()
+        p = mp.Process(target=_listener, args=(url, workers * messages, ready, out, timeout))
+        p.start()
+        ready.wait(10)
+        listeners.append(p)
+    time.sleep(0.3)  # listener の接続が broker に登録されるまで待つ
+
+    start_at = time.time() + 0.5
+    pubs = [mp.Process(target=_publisher, args=(url, w, messages, rate, payload_chars, start_at))
+            for w in range(workers)]
+    for p in pubs:
+        p.start()
+    results = [out.get(timeout=timeout + 10) for _ in listeners]
+    for p in pubs + listeners:
+        p.join(5)
+    broker.shutdown()
+
+    lat = sorted(x for r in results for x in r["lat"])
+    received = sum(r["received"] for r in results)
+    span = max(r["span"] for r in results) or 1e-9
+    return {
+        "workers": workers,
+        "published": workers * messages,
+        "delivered": received,
+        "expected": workers * workers * messages,
+        "delivered_per_sec": round(received / span),
+        "lat_ms_p50": round(_percentile(lat, 0.50) * 1000, 2),
+        "lat_ms_p99": round(_percentile(lat, 0.99) * 1000, 2),
+        "lat_ms_max": round(lat[-1] * 1000, 2) if lat else 0.0,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="emit bus のスループット・遅延（ワーカー数ごと）")
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--messages", type=int, default=5000, help="送信プロセスあたりの件数")
+    parser.add_argument("--rate", type=float, default=1000, help="送信プロセスあたり msg/s（0で上限なし）")
+    parser.add_argument("--payload-chars", type=int, default=200)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    rows = [run(int(w), args.messages, args.rate, args.payload_chars) for w in args.workers.split(",")]
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return 0
+    print(f"{'workers':>7} {'delivered':>11} {'msg/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for r in rows:
+        print(f"{r['workers']:>7} {r['delivered']:>5}/{r['expected']:<5} {r['delivered_per_sec']:>9} "
+              f"{r['lat_ms_p50']:>8} {r['lat_ms_p99']:>8} {r['lat_ms_max']:>8}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
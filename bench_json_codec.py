@@ -0,0 +1,123 @@
+# bench_json_codec.py
+"""
+JSON codec（json_codec.py）のバックエンドごとの速度を、日本語の実データ相当の payload で比べる。
+
+  python bench_json_codec.py --turns 20,200 --repeat 2000
+
+payload（すべて日本語の発話・フィードバック文）:
+- transcript_<N>     : ストアに保存する transcript（N ターン）          … dumps（保存）/ loads（読み出し）
+- feedback           : フィードバック（summary / good_points / improvements など）
+- delta_frame        : Realtime の response.audio_transcript.delta 1フレーム … on_message の loads
+- audio_append_frame : input_audio_buffer.append（base64 の 100ms 音声）   … 中継の dumps
+比較: stdlib（json.dumps(ensure_ascii=False, separators=(",", ":")) / json.loads）と
+orjson（インストールされていれば）。1回あたり µs と、出力が同じ JSON 値になるか（round-trip 一致）。
+"""
+from __future__ import annotations
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+PHRASES = [
+    "結論から申し上げます。リリースは予定より三日遅れる見込みです。",
+    "原因は外部APIの仕様変更で、認証まわりの改修が追加で必要になりました。",
+    "影響範囲は決済画面のみで、既存のお客様データには影響ありません。",
+    "ご判断いただきたいのは、段階リリースにするか全体を延期するかの二点です。",
+    "承知しました。段階リリースの場合のリスクをもう少し詳しく教えてください。",
+    "再発防止として、結合テストに外部APIの契約テストを追加します。",
+]
+
+
+def _transcript(turns: int):
+    return {"transcript": [
+        {"role": "user" if i % 2 else "assistant", "text": PHRASES[i % len(PHRASES)], "ts": 1760000000 + i}
+        for i in range(turns)
+    ]}
+
+
+def _feedback():
+    return {
+        "score": 72,
+        "summary": "結論を先に述べられており、影響範囲の説明も簡潔でした。判断材料の比較がやや不足しています。",
+        "good_points": ["冒頭で結論と遅延日数を明示できた", "影響範囲を限定して説明できた"],
+        "improvements": ["選択肢ごとのコストとリスクを数字で比較する", "相手の懸念を先に確認してから提案する"],
+        "alt_phrasings": ["結論から申し上げますと、三日の遅延が見込まれます。"],
+        "next_drill": "二択の判断材料を30秒で説明する",
+        "next_actions": ["比較表のテンプレートを用意する"],
+    }
+
+
+def payloads(turn_counts):
+    out = {f"transcript_{n}": _transcript(n) for n in turn_counts}
+    out["feedback"] = _feedback()
+    out["delta_frame"] = {"type": "response.audio_transcript.delta", "event_id": "event_AbC123",
+                          "response_id": "resp_XyZ789", "item_id": "item_001", "output_index": 0,
+                          "content_index": 0, "delta": "承知しました。段階リリースの"}
+    out["audio_append_frame"] = {"type": "input_audio_buffer.append",
+                                 "audio": base64.b64encode(os.urandom(4800)).decode("ascii")}
+    return out
+
+
+def _codecs():
+    out = {"stdlib": (lambda o: json.dumps(o, ensure_ascii=False, separators=(",", ":")), json.loads)}
+    try:
+        import orjson
+        from json_codec import _BASE_OPTS
+        out["orjson"] = (lambda o: orjson.dumps(o, option=_BASE_OPTS).decode("utf-8"), orjson.loads)
+    except ImportError:
+        pass
+    return out
+
+
+def _time_us(fn, arg, repeat: int) -> float:
+    for _ in range(min(50, repeat)):
+        fn(arg)
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn(arg)
+    return (time.perf_counter() - t0) / repeat * 1e6
+
+
+def run(turn_counts, repeat: int):
+    rows = []
+    codecs = _codecs()
+    for name, obj in payloads(turn_counts).items():
+        row = {"payload": name, "bytes": len(codecs["stdlib"][0](obj).encode("utf-8"))}
+        for cname, (dumps, loads) in codecs.items():
+            text = dumps(obj)
+            row[f"{cname}_dumps_us"] = round(_time_us(dumps, obj, repeat), 2)
+            row[f"{cname}_loads_us"] = round(_time_us(loads, text, repeat), 2)
+            row[f"{cname}_roundtrip_ok"] = loads(text) == obj and json.loads(text) == obj
+        rows.append(row)
+    return rows, list(codecs)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="JSON codec のバックエンド比較（日本語 payload）")
+    parser.add_argument("--turns", default="20,200", help="transcript のターン数（カンマ区切り）")
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    rows, names = run([int(x) for x in args.turns.split(",")], args.repeat)
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return 0
+    cols = ["payload", "bytes"] + [f"{n}_{op}_us" for n in names for op in ("dumps", "loads")]
+    print(" ".join(f"{c:>20}" for c in cols) + "  round-trip")
+    for r in rows:
+        ok = all(r[f"{n}_roundtrip_ok"] for n in names)
+        print(" ".join(f"{r[c]:>20}" for c in cols) + f"  {'ok' if ok else 'MISMATCH'}")
+    if "orjson" in names:
+        for r in rows:
+            print(f"{r['payload']:>20}: dumps x{r['stdlib_dumps_us'] / r['orjson_dumps_us']:.1f}, "
+                  f"loads x{r['stdlib_loads_us'] / r['orjson_loads_us']:.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
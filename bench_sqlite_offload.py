@@ -0,0 +1,87 @@
+# bench_sqlite_offload.py
+"""
+SQLite の書き込み負荷中に、eventlet の hub（= Socket.IO イベント処理）がどれだけ止まるかを測る。
+
+  python bench_sqlite_offload.py --writers 8 --seconds 5
+
+5ms ごとに起きる ticker greenlet の「予定からの遅れ」を記録する。
+Socket.IO のイベントハンドラも同じ hub 上で動くため、この遅れがそのままイベント遅延になる。
+executor=inline（従来）と executor=tpool を順に測って比較する。
+"""
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from session_store import SQLiteSessionStore
+
+
+def _percentile(arr, p):
+    if not arr:
+        return 0.0
+    arr = sorted(arr)
+    return arr[min(len(arr) - 1, int(len(arr) * p))]
+
+
+def run(mode: str, writers: int, seconds: float, payload_kb: int, synchronous: str) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    store = SQLiteSessionStore(path, executor=mode)
+    store._conn.execute(f"PRAGMA synchronous={synchronous}")
+    sessions = [store.create_session().session_id for _ in range(writers)]
+    text = "結論から申し上げると、来週のリリースは予定どおりです。" * (payload_kb * 1024 // 80 + 1)
+    payload = {"ended_at": 0, "transcript": [{"role": "user", "text": text, "ts": 0}]}
+
+    stop = time.monotonic() + seconds
+    lags = []
+    writes = [0]
+
+    def ticker():
+        interval = 0.005
+        while time.monotonic() < stop:
+            t0 = time.perf_counter()
+            eventlet.sleep(interval)
+            lags.append((time.perf_counter() - t0 - interval) * 1000)
+
+    def writer(sid):
+        while time.monotonic() < stop:
+            store.save_transcript(sid, payload)
+            store.save_feedback(sid, {"score": writes[0] % 100})
+            writes[0] += 2
+            eventlet.sleep(0)
+
+    pool = eventlet.GreenPool()
+    pool.spawn(ticker)
+    for sid in sessions:
+        pool.spawn(writer, sid)
+    pool.waitall()
+    return {
+        "mode": mode,
+        "writes_per_sec": round(writes[0] / seconds, 1),
+        "tick_lag_ms_p50": round(_percentile(lags, 0.50), 2),
+        "tick_lag_ms_p99": round(_percentile(lags, 0.99), 2),
+        "tick_lag_ms_max": round(max(lags) if lags else 0.0, 2),
+        "ticks": len(lags),
+        "executor": store.executor_stats(),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="SQLite offload benchmark (eventlet hub lag)")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--payload-kb", type=int, default=32)
+    parser.add_argument("--synchronous", default="FULL", choices=["OFF", "NORMAL", "FULL"])
+    parser.add_argument("--modes", default="inline,tpool")
+    args = parser.parse_args(argv)
+    for mode in args.modes.split(","):
+        print(json.dumps(run(mode, args.writers, args.seconds, args.payload_kb, args.synchronous), ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
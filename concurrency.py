@@ -0,0 +1,145 @@
+# concurrency.py
+"""
+並行処理の方式（APP_CONCURRENCY）の選択と、方式ごとの差を吸収する小さな層。
+
+  APP_CONCURRENCY=eventlet   # 既定（従来どおり）。eventlet.monkey_patch() + async_mode='eventlet'
+  APP_CONCURRENCY=gevent     # gevent.monkey.patch_all() + async_mode='gevent'（pip install gevent）
+  APP_CONCURRENCY=threading  # monkey patch なし。本物のスレッド + async_mode='threading'
+
+monkey patch は import では行わない。起動スクリプトの先頭で patch() を呼ぶ
+（python test_OpenAI_WebUI.py で直接起動したときは app 側で呼ぶ）。
+gunicorn の -k eventlet / -k gevent のように起動側が patch 済みなら、APP_CONCURRENCY 未指定でもそれに合わせる。
+
+- async_mode()   : Flask-SocketIO に渡す async_mode
+- original(name) : patch 前のモジュール（ネイティブスレッドから触るロック等に使う）
+- run_options()  : socketio.run() に渡す方式ごとの引数
+"""
+from __future__ import annotations
+from typing import Optional
+import importlib
+import os
+import sys
+
+BACKENDS = ("eventlet", "gevent", "threading")
+
+_patched: Optional[str] = None
+
+
+def _detect_patched() -> Optional[str]:
+    """起動側（gunicorn のワーカーなど）が patch 済みならその方式"""
+    if "eventlet" in sys.modules:
+        try:
+            from eventlet import patcher
+            if patcher.is_monkey_patched("socket"):
+                return "eventlet"
+        except Exception:
+            pass
+    if "gevent" in sys.modules:
+        try:
+            from gevent import monkey
+            if monkey.is_module_patched("socket"):
+                return "gevent"
+        except Exception:
+            pass
+    return None
+
+
+def selected() -> str:
+    """APP_CONCURRENCY（未指定なら patch 済みの方式、どちらでもなければ eventlet）"""
+    name = (os.environ.get("APP_CONCURRENCY") or "").strip().lower()
+    if name:
+        if name not in BACKENDS:
+            raise ValueError(f"APP_CONCURRENCY must be one of {BACKENDS}: {name}")
+        return name
+    return _patched or _detect_patched() or "eventlet"
+
+
+def patch(backend: Optional[str] = None) -> str:
+    """
+    選んだ方式で monkey patch する（他の import より先に呼ぶ）。2回目以降は何もしない。
+    return: 方式名
+    """
+    global _patched
+    if _patched is not None:
+        return _patched
+    backend = backend or selected()
+    if backend == "eventlet":
+        import eventlet
+        eventlet.monkey_patch()
+    elif backend == "gevent":
+        from gevent import monkey
+        monkey.patch_all()
+    elif backend != "threading":
+        raise ValueError(f"backend must be one of {BACKENDS}: {backend}")
+    _patched = backend
+    return backend
+
+
+def active() -> str:
+    """実際に動いている方式（patch されていなければ threading）"""
+    return _patched or _detect_patched() or "threading"
+
+
+def async_mode() -> str:
+    """
+    Flask-SocketIO の async_mode。
+    patch されていないのに eventlet / gevent を選んでいる場合は threading にする
+    （green でないソケットで eventlet サーバーを動かすと hub が止まるため）
+    """
+    want = selected()
+    return want if active() == want else "threading"
+
+
+class _GeventOriginal:
+    """gevent.monkey.get_original のモジュール風ラッパー"""
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, item):
+        from gevent import monkey
+        return monkey.get_original(self._name, item)
+
+
+def original(name: str):
+    """patch 前のモジュール（patch されていなければ通常のモジュール）"""
+    backend = _detect_patched()
+    if backend == "eventlet":
+        from eventlet import patcher
+        return patcher.original(name)
+    if backend == "gevent":
+        return _GeventOriginal(name)
+    return importlib.import_module(name)
+
+
+def run_options(mode: str) -> dict:
+    """
+    socketio.run() に渡す方式ごとの追加引数。
+    - threading: Werkzeug のサーバーを本番相当で使うことを許可する
+    - gevent   : pywsgi はヘッダと本文を別々に送るため、keep-alive だと Nagle + 遅延ACK で
+                 1リクエストあたり約40ms待たされる。受け付けたソケットに TCP_NODELAY を付ける
+    """
+    if mode == "threading":
+        return {"allow_unsafe_werkzeug": True}
+    if mode == "gevent":
+        return {"handler_class": _gevent_nodelay_handler()}
+    return {}
+
+
+def _gevent_nodelay_handler():
+    import socket
+    from gevent import pywsgi
+
+    class _NoDelayHandler(pywsgi.WSGIHandler):
+        def handle(self):
+            try:
+                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except (OSError, AttributeError):
+                pass
+            return super().handle()
+
+    return _NoDelayHandler
+
+
+def default_db_executor() -> str:
+    """SQLiteSessionStore の executor の既定値（patch 済みならネイティブスレッドへ逃がす）"""
+    return "native" if _detect_patched() else "inline"
@@ -0,0 +1,260 @@
+# db_backup.py
+"""
+app.db のオンラインバックアップ（アプリを止めずに一貫したスナップショットを取る）。
+
+- SQLite の backup API（sqlite3.Connection.backup）で pages ページずつコピーし、
+  ステップの合間に pause_sec 休んで書き込み側に譲る
+- コピー元は専用の読み取り接続で、最初に読み取りトランザクションを張って WAL のスナップショットを固定する
+  （固定しないと、別接続からの書き込みのたびにバックアップが最初からやり直しになり、書き込みが続くと終わらない）
+- SQLiteSessionStore のロックは一切取らない（書き込みは止まらない。WAL の checkpoint だけ終わるまで先送り）
+- コピーは <name>.partial に書き、integrity_check と件数確認を通ったものだけを rename して残す
+- BackupManager で定期実行・世代管理（keep）・進捗と所要時間の計測
+
+  python db_backup.py app.db backups/            # 1回だけ取る
+  python db_backup.py --verify backups/app-20260101-000000.db
+"""
+from __future__ import annotations
+from datetime import datetime
+from typing import Optional, Dict, Any, Callable, List
+import os
+import sqlite3
+import sys
+import time
+
+import concurrency
+
+SNAPSHOT_PREFIX = "app-"
+SNAPSHOT_SUFFIX = ".db"
+COUNT_TABLES = ("sessions", "transcripts", "feedback")
+
+Progress = Callable[[int, int], None]  # (remaining, pagecount)
+
+
+def _original(name: str):
+    """monkey patch 前のモジュール（スケジューラはネイティブスレッドで動かす）"""
+    return concurrency.original(name)
+
+
+def verify_snapshot(path: str) -> Dict[str, Any]:
+    """integrity_check と主要テーブルの件数。{"ok": bool, "integrity": str, "counts": {...}}"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        counts = {}
+        for table in COUNT_TABLES:
+            try:
+                counts[table] = int(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0])
+            except sqlite3.DatabaseError:
+                counts[table] = None
+        user_version = int(conn.execute("PRAGMA user_version").fetchone()[0])
+    finally:
+        conn.close()
+    ok = integrity == "ok" and counts.get("sessions") is not None
+    return {"ok": ok, "integrity": integrity, "counts": counts, "user_version": user_version}
+
+
+def online_backup(db_path: str, dest_path: str, pages: int = 64, pause_sec: float = 0.005,
+                  progress: Optional[Progress] = None, verify: bool = True,
+                  sleep: Callable[[float], None] = time.sleep) -> Dict[str, Any]:
+    """
+    db_path を dest_path にコピーする（検証に失敗したら dest_path は作らない）。
+    return: {"ok", "path", "pages", "steps", "bytes", "copy_ms", "verify_ms", "duration_ms", "max_step_ms", ...}
+    """
+    started = time.perf_counter()
+    partial = dest_path + ".partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    result: Dict[str, Any] = {"ok": False, "path": dest_path, "pages": 0, "steps": 0}
+    max_step = [0.0]
+    last = [time.perf_counter()]
+
+    def _on_step(status, remaining, pagecount):
+        now = time.perf_counter()
+        max_step[0] = max(max_step[0], now - last[0])
+        result["steps"] += 1
+        result["pages"] = pagecount
+        if progress:
+            progress(remaining, pagecount)
+        if remaining and pause_sec > 0:
+            sleep(pause_sec)
+        last[0] = time.perf_counter()
+
+    src = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, isolation_level=None, check_same_thread=False)
+    dst = sqlite3.connect(partial, check_same_thread=False)
+    try:
+        # 読み取りトランザクションで WAL のスナップショットを固定（コピー中の書き込みは次回分）
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        src.backup(dst, pages=max(1, int(pages)), progress=_on_step)
+        src.execute("COMMIT")
+        dst.execute("PRAGMA journal_mode=DELETE")
+    except Exception:
+        dst.close()
+        src.close()
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    dst.close()
+    src.close()
+    copied = time.perf_counter()
+    result["copy_ms"] = round((copied - started) * 1000, 1)
+    result["max_step_ms"] = round(max_step[0] * 1000, 2)
+    result["bytes"] = os.path.getsize(partial)
+
+    if verify:
+        check = verify_snapshot(partial)
+        result["verify_ms"] = round((time.perf_counter() - copied) * 1000, 1)
+        result.update(integrity=check["integrity"], counts=check["counts"], user_version=check["user_version"])
+        if not check["ok"]:
+            os.remove(partial)
+            result["error"] = f"verification failed: {check['integrity']}"
+            result["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            return result
+    os.replace(partial, dest_path)
+    result["ok"] = True
+    result["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+class BackupManager:
+    """
+    backup_dir に app-YYYYmmdd-HHMMSS.db を作り、新しい順に keep 世代だけ残す。
+    interval_sec > 0 で start() すると、ネイティブスレッドで定期的に run_once() する。
+    """
+    def __init__(self, db_path: str, backup_dir: str, keep: int = 7, pages: int = 64,
+                 pause_sec: float = 0.005, interval_sec: float = 0):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.keep = max(1, int(keep))
+        self.pages = max(1, int(pages))
+        self.pause_sec = max(0.0, float(pause_sec))
+        self.interval_sec = float(interval_sec)
+        threading = _original("threading")
+        self._sleep = _original("time").sleep
+        self._run_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._progress: Dict[str, Any] = {}
+        self._stats: Dict[str, Any] = {"runs": 0, "ok": 0, "failed": 0, "skipped_busy": 0,
+                                       "last": None, "last_ok_at": None, "durations_ms": []}
+
+    def _on_progress(self, remaining: int, pagecount: int) -> None:
+        with self._lock:
+            self._progress.update(remaining=remaining, pagecount=pagecount,
+                                  percent=round(100.0 * (pagecount - remaining) / pagecount, 1) if pagecount else 100.0)
+
+    def run_once(self) -> Dict[str, Any]:
+        """1回取る（実行中なら待たずに {"ok": False, "error": "backup already running"}）"""
+        if not self._run_lock.acquire(blocking=False):
+            with self._lock:
+                self._stats["skipped_busy"] += 1
+            return {"ok": False, "error": "backup already running"}
+        try:
+            os.makedirs(self.backup_dir, exist_ok=True)
+            name = f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}{SNAPSHOT_SUFFIX}"
+            dest = os.path.join(self.backup_dir, name)
+            with self._lock:
+                self._progress = {"running": True, "path": dest, "started_at": int(time.time()),
+                                  "remaining": None, "pagecount": None, "percent": 0.0}
+            try:
+                result = online_backup(self.db_path, dest, self.pages, self.pause_sec,
+                                       progress=self._on_progress, sleep=self._sleep)
+            except Exception as e:
+                result = {"ok": False, "path": dest, "error": str(e)}
+            if result.get("ok"):
+                self._prune()
+            with self._lock:
+                st = self._stats
+                st["runs"] += 1
+                st["ok" if result.get("ok") else "failed"] += 1
+                st["last"] = result
+                if result.get("ok"):
+                    st["last_ok_at"] = int(time.time())
+                    st["durations_ms"] = (st["durations_ms"] + [result["duration_ms"]])[-50:]
+                self._progress = {"running": False}
+            if not result.get("ok"):
+                print(f"DB backup failed: {result.get('error')}")
+            return result
+        finally:
+            self._run_lock.release()
+
+    def trigger(self) -> bool:
+        """バックグラウンド（ネイティブスレッド）で1回取る。実行中なら False"""
+        if self._run_lock.locked():
+            return False
+        _original("threading").Thread(target=self.run_once, name="db-backup-once", daemon=True).start()
+        return True
+
+    def snapshots(self) -> List[str]:
+        """新しい順"""
+        try:
+            names = os.listdir(self.backup_dir)
+        except FileNotFoundError:
+            return []
+        return sorted((n for n in names if n.startswith(SNAPSHOT_PREFIX) and n.endswith(SNAPSHOT_SUFFIX)),
+                      reverse=True)
+
+    def _prune(self) -> None:
+        for name in self.snapshots()[self.keep:]:
+            try:
+                os.remove(os.path.join(self.backup_dir, name))
+            except OSError as e:
+                print(f"DB backup prune error: {e}")
+
+    # ---- 定期実行 ----
+    def start(self) -> bool:
+        if self.interval_sec <= 0 or self._thread is not None:
+            return False
+        threading = _original("threading")
+        self._thread = threading.Thread(target=self._loop, name="db-backup", daemon=True)
+        self._thread.start()
+        return True
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval_sec):
+            self.run_once()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            st = dict(self._stats)
+            progress = dict(self._progress) or {"running": False}
+        durations = sorted(st.pop("durations_ms"))
+        st["duration_ms_p50"] = durations[len(durations) // 2] if durations else None
+        st["duration_ms_max"] = durations[-1] if durations else None
+        st["progress"] = progress
+        st["interval_sec"] = self.interval_sec
+        st["keep"] = self.keep
+        st["snapshots"] = self.snapshots()
+        return st
+
+
+def main(argv=None) -> int:
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="app.db のオンラインバックアップ")
+    parser.add_argument("paths", nargs="+", help="<db> <backup_dir>、または --verify <snapshot>")
+    parser.add_argument("--verify", action="store_true", help="スナップショットを検証するだけ")
+    parser.add_argument("--keep", type=int, default=7)
+    parser.add_argument("--pages", type=int, default=64, help="1ステップでコピーするページ数")
+    parser.add_argument("--pause-ms", type=float, default=5.0, help="ステップ間の休み（書き込みに譲る）")
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        results = {p: verify_snapshot(p) for p in args.paths}
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return 0 if all(r["ok"] for r in results.values()) else 1
+    if len(args.paths) != 2:
+        parser.error("<db> <backup_dir> を指定してください")
+    manager = BackupManager(args.paths[0], args.paths[1], args.keep, args.pages, args.pause_ms / 1000.0)
+    result = manager.run_once()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0 if result.get("ok") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
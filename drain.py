@@ -0,0 +1,240 @@
+# drain.py
+"""
+再起動・入れ替え前のグレースフルドレイン（新しい接続や仕事を断り、進行中のものを期限内に片付けて止まる）。
+
+  controller = DrainController(deadline_sec=25, checkpoint_path="drain_checkpoint.json")
+  controller.add_phase("feedback", wait_feedback)               # fn(deadline) -> dict（報告に載せる詳細）
+  controller.add_phase("writes", flush_writes, reserve_sec=3)  # 後ろのフェーズの持ち時間は前のフェーズに使わせない
+  with controller.job("feedback", session_id):                 # 進行中の仕事として数える
+      ...
+  report = controller.run("SIGTERM")
+
+- begin() 以降 draining が True になる。受け付け側（接続・API）はこれを見て断る
+- フェーズは登録順に1回ずつ実行する。各フェーズの期限は「全体の期限 − 後ろのフェーズの reserve_sec」
+  （差し引くのは全体の半分まで）
+- 期限までに終わらなかった job と defer() で預けた仕事は checkpoint_path に書き出し、
+  次の起動で take_checkpoint() から取り出して再開する（import 時ではなくサーバーの起動処理で呼ぶこと）
+- 報告（フェーズごとの所要時間・期限超過・書き出した件数）は run() の戻り値と stats() で見られる
+"""
+from __future__ import annotations
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+import json
+import os
+import threading
+import time
+
+
+def wait_until(predicate: Callable[[], bool], deadline: float, interval: float = 0.05) -> bool:
+    """predicate() が真になるか deadline（time.monotonic）を過ぎるまで待つ。return: 真になったか"""
+    while True:
+        if predicate():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))  # eventlet / gevent では patch 済みの sleep で hub に譲る
+
+
+def _read_items(path: str) -> Dict[str, List[str]]:
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"drain checkpoint read error: {path}: {e}")
+        return {}
+    items = data.get("items") if isinstance(data, dict) else None
+    return {k: [str(x) for x in v] for k, v in (items or {}).items() if isinstance(v, list)}
+
+
+def take_checkpoint(path: str) -> Dict[str, List[str]]:
+    """
+    前回のドレインで書き出した仕事を読み出して、ファイルは消す（無ければ空）。
+    先に rename で自分専用の名前にしてから読むので、複数プロセスが同時に呼んでも取り出すのは1つだけ
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    taken = f"{path}.{os.getpid()}.taken"
+    try:
+        os.rename(path, taken)
+    except OSError:
+        return {}  # 別のプロセスが先に取り出した
+    items = _read_items(taken)
+    try:
+        os.remove(taken)
+    except OSError:
+        pass
+    return items
+
+
+class _Phase:
+    __slots__ = ("name", "fn", "reserve_sec")
+
+    def __init__(self, name: str, fn: Callable[[float], Optional[Dict[str, Any]]], reserve_sec: float):
+        self.name = name
+        self.fn = fn
+        self.reserve_sec = float(reserve_sec)
+
+
+class DrainController:
+    def __init__(self, deadline_sec: float = 25.0, checkpoint_path: str = ""):
+        self.deadline_sec = float(deadline_sec)
+        self.checkpoint_path = checkpoint_path
+        self._phases: List[_Phase] = []
+        self._jobs: Dict[str, Dict[str, int]] = {}
+        self._deferred: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._running = False
+        self._started: Optional[float] = None
+        self._ends_at: Optional[float] = None
+        self._reason = ""
+        self._report: Optional[Dict[str, Any]] = None
+
+    # ---- 状態 ----
+    @property
+    def draining(self) -> bool:
+        return self._started is not None
+
+    def remaining(self) -> float:
+        """期限までの残り秒数（ドレイン前は deadline_sec）"""
+        if self._ends_at is None:
+            return self.deadline_sec
+        return max(0.0, self._ends_at - time.monotonic())
+
+    def add_phase(self, name: str, fn: Callable[[float], Optional[Dict[str, Any]]], reserve_sec: float = 0.0) -> None:
+        self._phases.append(_Phase(name, fn, reserve_sec))
+
+    # ---- 進行中の仕事 ----
+    @contextmanager
+    def job(self, kind: str, key: str):
+        """with の間は進行中として数える（同じ key の多重実行も数える）"""
+        with self._lock:
+            running = self._jobs.setdefault(kind, {})
+            running[key] = running.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                running = self._jobs[kind]
+                running[key] -= 1
+                if running[key] <= 0:
+                    del running[key]
+
+    def in_flight(self, kind: Optional[str] = None) -> int:
+        with self._lock:
+            if kind is not None:
+                return len(self._jobs.get(kind) or {})
+            return sum(len(v) for v in self._jobs.values())
+
+    def defer(self, kind: str, key: str) -> None:
+        """ドレイン中で始められなかった仕事を次の起動に回す"""
+        with self._lock:
+            keys = self._deferred.setdefault(kind, [])
+            if key not in keys:
+                keys.append(key)
+        if self._done.is_set():
+            self._write_checkpoint()  # ドレインを終えた後（終了までの間）に来た分も残す
+
+    # ---- 実行 ----
+    def begin(self, reason: str = "") -> bool:
+        """受け付けを止める（2回目以降は False）"""
+        with self._lock:
+            if self._started is not None:
+                return False
+            self._started = time.monotonic()
+            self._ends_at = self._started + self.deadline_sec
+            self._reason = reason
+            return True
+
+    def run(self, reason: str = "") -> Dict[str, Any]:
+        """
+        ドレインを最後まで行って報告を返す。
+        begin() だけ先に呼んでおいてもよい。既に別の呼び出しが実行中なら、その完了（最長で期限まで）を待って
+        同じ報告を返す
+        """
+        self.begin(reason)
+        with self._lock:
+            owner = not self._running
+            self._running = True
+        if not owner:
+            self._done.wait(self.remaining() + 1.0)
+            return self._report or self.stats()
+        phases = []
+        for i, phase in enumerate(self._phases):
+            # 期限が短いときでも前のフェーズに半分は残す
+            reserve = min(sum(p.reserve_sec for p in self._phases[i + 1:]), self.deadline_sec / 2)
+            deadline = max(time.monotonic(), self._ends_at - reserve)
+            t0 = time.monotonic()
+            entry: Dict[str, Any] = {"name": phase.name}
+            try:
+                entry.update(phase.fn(deadline) or {})
+            except Exception as e:
+                print(f"drain phase error: {phase.name}: {e}")
+                entry["error"] = str(e)
+            entry["ms"] = round((time.monotonic() - t0) * 1000, 1)
+            entry["late"] = time.monotonic() > deadline
+            phases.append(entry)
+        checkpointed = self._write_checkpoint()
+        total = time.monotonic() - self._started
+        self._report = {
+            "reason": self._reason,
+            "total_ms": round(total * 1000, 1),
+            "deadline_sec": self.deadline_sec,
+            "deadline_exceeded": total > self.deadline_sec,
+            "phases": phases,
+            "checkpointed": checkpointed,
+        }
+        self._done.set()
+        print(f"drain: {json.dumps(self._report, ensure_ascii=False)}")
+        return self._report
+
+    def _write_checkpoint(self) -> Dict[str, int]:
+        """終わらなかった job と defer() の分を書き出す。return: kind ごとの件数"""
+        with self._lock:
+            items = {kind: list(keys) for kind, keys in self._deferred.items()}
+            for kind, running in self._jobs.items():
+                keys = items.setdefault(kind, [])
+                keys.extend(k for k in running if k not in keys)
+        items = {k: v for k, v in items.items() if v}
+        if not items:
+            return {}
+        if self.checkpoint_path:
+            # 同じパスを使う別ワーカーがまだ取り出されていない分を書いていれば合わせて残す
+            previous = _read_items(self.checkpoint_path)
+            for kind, keys in previous.items():
+                items.setdefault(kind, [])
+                items[kind].extend(k for k in keys if k not in items[kind])
+            tmp = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"created_at": int(time.time()), "reason": self._reason, "items": items},
+                          f, ensure_ascii=False)
+            os.replace(tmp, self.checkpoint_path)
+        else:
+            print(f"drain: checkpoint path is not set, dropping {items}")
+        return {k: len(v) for k, v in items.items()}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            jobs = {k: len(v) for k, v in self._jobs.items() if v}
+            deferred = {k: len(v) for k, v in self._deferred.items() if v}
+        if self._started is None:
+            state = "serving"
+        else:
+            state = "drained" if self._done.is_set() else "draining"
+        out: Dict[str, Any] = {
+            "state": state,
+            "deadline_sec": self.deadline_sec,
+            "phases": [p.name for p in self._phases],
+            "jobs": jobs,
+            "deferred": deferred,
+        }
+        if self._started is not None:
+            out["reason"] = self._reason
+            out["elapsed_ms"] = round((time.monotonic() - self._started) * 1000, 1)
+            out["remaining_sec"] = round(self.remaining(), 1)
+        if self._report is not None:
+            out["report"] = self._report
+        return out
@@ -0,0 +1,349 @@
+# emit_bus.py
+"""
+プロセスをまたいだ Socket.IO の emit（複数ワーカー構成用）。
+
+Flask-SocketIO の client_manager（python-socketio の PubSubManager）として差し込むので、
+socketio.emit(..., room=sid) はどのプロセスから呼んでも、そのクライアントを持つプロセスに届く。
+
+  SOCKETIO_MESSAGE_QUEUE=unix:///tmp/socketio-bus.sock   # このファイルの broker（ローカル・検証用）
+  SOCKETIO_MESSAGE_QUEUE=local://                          # 同一プロセス内（テスト用）
+  SOCKETIO_MESSAGE_QUEUE=redis://localhost:6379/0          # それ以外は Flask-SocketIO の message_queue に渡す
+
+  python emit_bus.py broker --path /tmp/socketio-bus.sock
+
+Web ワーカー以外（feedback_batch.py など）からは emitter(url).emit(...) で送る（書き込み専用）。
+broker は長さ付きフレーム（4byte big-endian + JSON）を、同じ channel を listen している
+他の接続すべてに配る。
+"""
+from __future__ import annotations
+from typing import Optional, Dict, Any, List
+import json
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+
+from socketio import PubSubManager
+
+_HEADER = struct.Struct(">I")
+MAX_FRAME = 64 * 1024 * 1024
+DEFAULT_CHANNEL = "flask-socketio"
+
+
+def session_room(session_id: str) -> str:
+    """セッション単位の room 名（接続時に session_id を渡したクライアントが入る）"""
+    return f"session:{session_id}"
+
+
+def _send_frame(sock: socket.socket, payload: bytes) -> None:
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exact(sock: socket.socket, n: int) -> Optional[bytes]:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return bytes(buf)
+
+
+def _recv_frame(sock: socket.socket) -> Optional[bytes]:
+    head = _recv_exact(sock, _HEADER.size)
+    if head is None:
+        return None
+    (n,) = _HEADER.unpack(head)
+    if n > MAX_FRAME:
+        raise ValueError(f"frame too large: {n}")
+    return _recv_exact(sock, n)
+
+
+def _unix_path(url: str) -> str:
+    return url[len("unix://"):] if url.startswith("unix://") else url
+
+
+# ============================================================
+# broker（Unix ドメインソケット）
+# ============================================================
+class _BrokerConn:
+    __slots__ = ("sock", "channel", "listen", "outbox")
+
+    def __init__(self, sock: socket.socket, max_backlog: int):
+        self.sock = sock
+        self.channel: Optional[str] = None
+        self.listen = False
+        self.outbox: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=max_backlog)
+
+
+class UnixSocketBroker:
+    """
+    最初のフレームで {"channel": ..., "listen": bool} を受け、以降のフレームを同じ channel の listener に配る。
+    listener ごとに送信キュー（max_backlog フレーム）と送信スレッドを持ち、溢れた listener は切断する
+    （詰まった1ワーカーで全体を止めない）。
+    """
+    def __init__(self, path: str, max_backlog: int = 10000):
+        self.path = path
+        self.max_backlog = max(1, int(max_backlog))
+        self._conns: List[_BrokerConn] = []
+        self._lock = threading.Lock()
+        self._server: Optional[socket.socket] = None
+        self.stats: Dict[str, int] = {"connections": 0, "frames_in": 0, "frames_out": 0, "dropped_conns": 0}
+
+    def serve_forever(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        srv.bind(self.path)
+        srv.listen(128)
+        self._server = srv
+        while True:
+            try:
+                sock, _ = srv.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve_conn, args=(_BrokerConn(sock, self.max_backlog),),
+                             daemon=True).start()
+
+    def start_in_thread(self) -> threading.Thread:
+        t = threading.Thread(target=self.serve_forever, name="emit-bus-broker", daemon=True)
+        t.start()
+        for _ in range(200):
+            if self._server is not None:
+                break
+            time.sleep(0.005)
+        return t
+
+    def shutdown(self) -> None:
+        if self._server is not None:
+            self._server.close()
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for c in conns:
+            c.sock.close()
+
+    def _serve_conn(self, conn: _BrokerConn) -> None:
+        try:
+            hello = _recv_frame(conn.sock)
+            if hello is None:
+                return
+            h = json.loads(hello)
+            conn.channel = str(h.get("channel") or DEFAULT_CHANNEL)
+            conn.listen = bool(h.get("listen"))
+            if conn.listen:
+                threading.Thread(target=self._writer, args=(conn,), daemon=True).start()
+            with self._lock:
+                self._conns.append(conn)
+                self.stats["connections"] += 1
+            while True:
+                payload = _recv_frame(conn.sock)
+                if payload is None:
+                    return
+                self._fan_out(conn, payload)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._drop(conn)
+
+    def _fan_out(self, sender: _BrokerConn, payload: bytes) -> None:
+        with self._lock:
+            self.stats["frames_in"] += 1
+            targets = [c for c in self._conns if c.listen and c is not sender and c.channel == sender.channel]
+        frame = _HEADER.pack(len(payload)) + payload
+        for c in targets:
+            try:
+                c.outbox.put_nowait(frame)
+            except queue.Full:
+                self._drop(c)
+
+    def _writer(self, conn: _BrokerConn) -> None:
+        while True:
+            frame = conn.outbox.get()
+            if frame is None:
+                return
+            try:
+                conn.sock.sendall(frame)
+            except OSError:
+                self._drop(conn)
+                return
+            with self._lock:
+                self.stats["frames_out"] += 1
+
+    def _drop(self, conn: _BrokerConn) -> None:
+        with self._lock:
+            if conn in self._conns:
+                self._conns.remove(conn)
+                self.stats["dropped_conns"] += 1
+        if conn.listen:
+            try:
+                conn.outbox.put_nowait(None)
+            except queue.Full:
+                pass  # 送信スレッドは sendall の失敗で抜ける
+        try:
+            conn.sock.close()
+        except OSError:
+            pass
+
+
+# ============================================================
+# client manager（Flask-SocketIO に差し込む）
+# ============================================================
+class _BusStatsMixin:
+    def _init_bus_stats(self) -> None:
+        self._bus_lock = threading.Lock()
+        self._bus_stats: Dict[str, int] = {"published": 0, "publish_errors": 0, "received": 0, "reconnects": 0}
+
+    def _bus_count(self, key: str, n: int = 1) -> None:
+        with self._bus_lock:
+            self._bus_stats[key] += n
+
+    def bus_stats(self) -> Dict[str, Any]:
+        with self._bus_lock:
+            out: Dict[str, Any] = dict(self._bus_stats)
+        out["backend"] = self.name
+        out["channel"] = self.channel
+        out["host_id"] = self.host_id
+        return out
+
+
+class UnixSocketManager(_BusStatsMixin, PubSubManager):
+    """UnixSocketBroker 経由の PubSubManager（送信用と受信用に接続を1本ずつ持つ）"""
+    name = "unix"
+
+    def __init__(self, url: str = "unix:///tmp/socketio-bus.sock", channel: str = DEFAULT_CHANNEL,
+                 write_only: bool = False, logger=None, json=None, reconnect_sec: float = 1.0):
+        self.path = _unix_path(url)
+        self.reconnect_sec = float(reconnect_sec)
+        self._pub_sock: Optional[socket.socket] = None
+        self._pub_lock = threading.Lock()
+        self._init_bus_stats()
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+
+    def _connect(self, listen: bool) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        _send_frame(sock, self.json.dumps({"channel": self.channel, "listen": listen}).encode("utf-8"))
+        return sock
+
+    def _publish(self, data):
+        payload = self.json.dumps(data)
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        with self._pub_lock:
+            for _ in range(2):  # 切れていたら1回だけ張り直す
+                try:
+                    if self._pub_sock is None:
+                        self._pub_sock = self._connect(listen=False)
+                    _send_frame(self._pub_sock, payload)
+                    self._bus_count("published")
+                    return
+                except OSError:
+                    if self._pub_sock is not None:
+                        self._pub_sock.close()
+                        self._pub_sock = None
+                    self._bus_count("reconnects")
+        self._bus_count("publish_errors")
+        self._get_logger().error("emit bus: publish failed (broker unreachable: %s)", self.path)
+
+    def _listen(self):
+        while True:
+            try:
+                sock = self._connect(listen=True)
+            except OSError:
+                self._bus_count("reconnects")
+                time.sleep(self.reconnect_sec)
+                continue
+            try:
+                while True:
+                    payload = _recv_frame(sock)
+                    if payload is None:
+                        break
+                    self._bus_count("received")
+                    yield payload
+            except (OSError, ValueError):
+                pass
+            finally:
+                sock.close()
+            self._bus_count("reconnects")
+            time.sleep(self.reconnect_sec)
+
+
+_local_channels: Dict[str, List["queue.Queue"]] = {}
+_local_lock = threading.Lock()
+
+
+class LocalManager(_BusStatsMixin, PubSubManager):
+    """同一プロセス内の複数 SocketIO サーバーをつなぐ（テスト・検証用）"""
+    name = "local"
+
+    def __init__(self, url: str = "local://", channel: str = DEFAULT_CHANNEL, write_only: bool = False,
+                 logger=None, json=None):
+        self._queue: Optional[queue.Queue] = None
+        self._init_bus_stats()
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+
+    def _publish(self, data):
+        payload = self.json.dumps(data)
+        with _local_lock:
+            targets = [q for q in _local_channels.get(self.channel, []) if q is not self._queue]
+        for q in targets:
+            q.put(payload)
+        self._bus_count("published")
+
+    def _listen(self):
+        self._queue = queue.Queue()
+        with _local_lock:
+            _local_channels.setdefault(self.channel, []).append(self._queue)
+        while True:
+            payload = self._queue.get()
+            self._bus_count("received")
+            yield payload
+
+
+def make_client_manager(url: str, channel: str = DEFAULT_CHANNEL, write_only: bool = False):
+    """unix:// / local:// ならこのモジュールの manager、それ以外は None（message_queue に渡す）"""
+    if url.startswith("unix://"):
+        return UnixSocketManager(url, channel=channel, write_only=write_only)
+    if url.startswith("local://"):
+        return LocalManager(url, channel=channel, write_only=write_only)
+    return None
+
+
+def emitter(url: str, channel: str = DEFAULT_CHANNEL):
+    """
+    Web ワーカー以外のプロセスから emit するための書き込み専用 manager。
+      emitter(url).emit("feedback_ready", {...}, room=session_room(session_id), namespace="/")
+    """
+    mgr = make_client_manager(url, channel=channel, write_only=True)
+    if mgr is not None:
+        return mgr
+    from flask_socketio import SocketIO
+    return SocketIO(message_queue=url, channel=channel)
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Socket.IO emit bus（Unix ドメインソケットの broker）")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("broker")
+    p.add_argument("--path", default="/tmp/socketio-bus.sock")
+    args = parser.parse_args(argv)
+
+    broker = UnixSocketBroker(args.path)
+    print(f"emit bus broker: unix://{args.path}")
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.shutdown()
+        print(json.dumps(broker.stats))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+# event_dispatch.py
+"""
+Realtime 受信イベント（"type" ごと）のハンドラ登録と計測。
+
+  realtime_events = EventDispatcher(default=_on_unknown)
+
+  @realtime_events.on("response.done")
+  def _on_response_done(ws, state, sid, data): ...
+
+  realtime_events.dispatch(msg_type, ws, state, sid, data)
+
+- 振り分けは dict 引き（if/elif の連鎖を上から順に比較しない）
+- type ごとに件数・合計/最大処理時間・処理時間ヒストグラム（µs のバケット）を持つ
+- ハンドラは普通の関数なので、state と data を渡せば単体で呼べる
+"""
+from __future__ import annotations
+from bisect import bisect_left
+from typing import Optional, Dict, Any, Callable, List
+import threading
+import time
+
+# 処理時間ヒストグラムの上限（µs）。最後のバケットはそれ以上
+LATENCY_BUCKETS_US = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+Handler = Callable[..., Any]
+
+
+class _TypeStats:
+    __slots__ = ("count", "errors", "total_ns", "max_ns", "hist")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.hist = [0] * (len(LATENCY_BUCKETS_US) + 1)
+
+
+class EventDispatcher:
+    def __init__(self, default: Optional[Handler] = None, timed: bool = True):
+        self._handlers: Dict[str, Handler] = {}
+        self._default = default
+        self.timed = timed
+        self._stats: Dict[str, _TypeStats] = {}
+        self._lock = threading.Lock()
+
+    def on(self, *types: str) -> Callable[[Handler], Handler]:
+        """ハンドラ登録用デコレータ（同じ関数を複数 type に登録できる）"""
+        def deco(fn: Handler) -> Handler:
+            for t in types:
+                if t in self._handlers:
+                    raise ValueError(f"handler already registered: {t}")
+                self._handlers[t] = fn
+            return fn
+        return deco
+
+    def set_default(self, fn: Handler) -> Handler:
+        self._default = fn
+        return fn
+
+    def handler_for(self, msg_type: Optional[str]) -> Optional[Handler]:
+        return self._handlers.get(msg_type, self._default)
+
+    def types(self) -> List[str]:
+        return sorted(self._handlers)
+
+    def dispatch(self, msg_type: Optional[str], *args) -> Any:
+        fn = self._handlers.get(msg_type)
+        key = msg_type
+        if fn is None:
+            fn = self._default
+            key = "(other)"
+            if fn is None:
+                return None
+        if not self.timed:
+            return fn(*args)
+        t0 = time.perf_counter_ns()
+        failed = True
+        try:
+            result = fn(*args)
+            failed = False
+            return result
+        finally:
+            self._observe(key, time.perf_counter_ns() - t0, failed)
+
+    def _observe(self, key: str, ns: int, failed: bool) -> None:
+        # 毎イベント通る経路なのでロックは取らない（スレッド併用時に稀に1件数え落とす程度は許容）
+        st = self._stats.get(key)
+        if st is None:
+            with self._lock:
+                st = self._stats.setdefault(key, _TypeStats())
+        st.count += 1
+        st.total_ns += ns
+        if ns > st.max_ns:
+            st.max_ns = ns
+        if failed:
+            st.errors += 1
+        st.hist[bisect_left(LATENCY_BUCKETS_US, ns // 1000)] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            items = [(k, s.count, s.errors, s.total_ns, s.max_ns, list(s.hist)) for k, s in self._stats.items()]
+        out: Dict[str, Any] = {}
+        labels = [f"<={b}us" for b in LATENCY_BUCKETS_US] + [f">{LATENCY_BUCKETS_US[-1]}us"]
+        for k, count, errors, total_ns, max_ns, hist in sorted(items, key=lambda x: -x[1]):
+            out[k] = {
+                "count": count,
+                "errors": errors,
+                "avg_us": round(total_ns / count / 1000, 1) if count else 0.0,
+                "max_us": round(max_ns / 1000, 1),
+                "hist": {labels[i]: n for i, n in enumerate(hist) if n},
+            }
+        return out
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats.clear()
@@ -0,0 +1,136 @@
+# fake_openai_server.py
+"""
+ローカル検証用の OpenAI 互換スタブサーバー（ネットワーク不要）。
+
+  python fake_openai_server.py --port 8089 --latency-ms 200 --rate-limit-every 10
+  OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPEN_AI_KEY=dummy python feedback_batch.py ...
+
+- POST /v1/chat/completions : 固定のフィードバックJSONを content に入れて返す
+- POST /v1/realtime         : SDP offer に固定の SDP answer を返す（/realtime/sdp-proxy の検証用）
+- --rate-limit-every N      : N 回に1回 429 + Retry-After を返す
+"""
+from __future__ import annotations
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+import itertools
+import json
+import sys
+import threading
+import time
+
+FAKE_FEEDBACK = {
+    "summary": "（スタブ）進捗報告の練習。結論は伝わったが根拠が薄い。",
+    "score": 70,
+    "good_points": ["結論から話し始めた"],
+    "improvements": ["根拠を数字で1つ添える"],
+    "better_questions": ["判断の期限はいつですか？"],
+    "key_moments": [],
+    "model_answer": "",
+    "alt_phrasings": [],
+    "next_actions": ["結論→根拠→次アクションの順で30秒で話す"],
+    "next_drill": "結論先出しで30秒報告",
+}
+
+FAKE_SDP_ANSWER = "v=0\r\no=- 0 0 IN IP4 127.0.0.1\r\ns=fake\r\nt=0 0\r\n"
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server_version = "FakeOpenAI/0.1"
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            sys.stderr.write("fake-openai: " + (fmt % args) + "\n")
+
+    def _send_json(self, status: int, body, headers: Optional[dict] = None) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        n = next(self.server.counter)
+        every = self.server.rate_limit_every
+        if every and n % every == every - 1:
+            self._send_json(429, {"error": {"message": "Rate limit reached (fake)"}},
+                            {"Retry-After": str(self.server.retry_after)})
+            return
+        if self.server.latency_ms:
+            time.sleep(self.server.latency_ms / 1000.0)
+
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            try:
+                req = json.loads(raw or b"{}")
+            except Exception:
+                self._send_json(400, {"error": {"message": "invalid json"}})
+                return
+            self._send_json(200, {
+                "id": f"chatcmpl-fake-{n}",
+                "object": "chat.completion",
+                "model": req.get("model") or "fake",
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": json.dumps(FAKE_FEEDBACK, ensure_ascii=False)},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": len(raw) // 3, "completion_tokens": 200},
+            })
+            return
+        if self.path.split("?", 1)[0].rstrip("/").endswith("/realtime"):
+            answer = FAKE_SDP_ANSWER.encode("utf-8")
+            self.send_response(201)
+            self.send_header("Content-Type", "application/sdp")
+            self.send_header("Content-Length", str(len(answer)))
+            self.end_headers()
+            self.wfile.write(answer)
+            return
+        self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+
+def make_server(host: str = "127.0.0.1", port: int = 0, latency_ms: int = 0,
+                rate_limit_every: int = 0, retry_after: float = 1, verbose: bool = False) -> ThreadingHTTPServer:
+    """
+    port=0 で空きポートを使う。server.server_address[1] で実ポートを取得。
+    """
+    srv = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    srv.daemon_threads = True
+    srv.latency_ms = latency_ms
+    srv.rate_limit_every = rate_limit_every
+    srv.retry_after = retry_after
+    srv.verbose = verbose
+    srv.counter = itertools.count()
+    return srv
+
+
+def start_in_thread(**kwargs) -> ThreadingHTTPServer:
+    srv = make_server(**kwargs)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def main(argv=None) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(description="OpenAI 互換スタブサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=int, default=0)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--retry-after", type=float, default=1)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    srv = make_server(args.host, args.port, args.latency_ms, args.rate_limit_every, args.retry_after, args.verbose)
+    print(f"fake openai listening on http://{args.host}:{srv.server_address[1]}/v1", file=sys.stderr)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
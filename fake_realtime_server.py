@@ -0,0 +1,132 @@
+# fake_realtime_server.py
+"""
+記録（realtime_replay.py の .rec.gz）を配信する OpenAI Realtime 互換のスタブ WebSocket サーバー。
+
+  python fake_realtime_server.py --recording demo.rec.gz --port 8090 --speed 1
+  OPENAI_REALTIME_URL=ws://127.0.0.1:8090/v1/realtime ENABLE_LEGACY_OPENAI_WS=1 python test_OpenAI_WebUI.py
+
+- 接続ごとに、最初のクライアントメッセージ（session.update）を受けてから記録を先頭から配信する
+  （--no-wait で接続直後から配信）
+- クライアントから来たメッセージは読み捨てて種類ごとに数える（--verbose で表示）
+- 配信し終えたら接続は開いたまま（--close-at-end で閉じる）
+"""
+from __future__ import annotations
+from typing import Dict, List
+import json
+import sys
+import threading
+import time
+
+from realtime_replay import Frame, load_recording
+
+
+class FakeRealtimeServer:
+    def __init__(self, frames: List[Frame], speed: float = 1.0, wait_for_client: bool = True,
+                 close_at_end: bool = False, verbose: bool = False):
+        self.frames = frames
+        self.speed = float(speed)
+        self.wait_for_client = wait_for_client
+        self.close_at_end = close_at_end
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self.stats: Dict[str, object] = {"connections": 0, "frames_sent": 0, "client_messages": {}}
+        self._server = None
+
+    def _count_client(self, message) -> None:
+        try:
+            ty = json.loads(message).get("type")
+        except Exception:
+            ty = "(invalid)"
+        with self._lock:
+            counts = self.stats["client_messages"]
+            counts[ty] = counts.get(ty, 0) + 1
+        if self.verbose:
+            sys.stderr.write(f"fake-realtime: <- {ty}\n")
+
+    def handler(self, conn) -> None:
+        from websockets.exceptions import ConnectionClosed
+
+        with self._lock:
+            self.stats["connections"] += 1
+        done = threading.Event()
+
+        def _reader():
+            try:
+                for message in conn:
+                    self._count_client(message)
+            except ConnectionClosed:
+                pass
+            finally:
+                done.set()
+
+        first = None
+        if self.wait_for_client:
+            try:
+                first = conn.recv()
+            except ConnectionClosed:
+                return
+            self._count_client(first)
+        threading.Thread(target=_reader, daemon=True).start()
+
+        start = time.monotonic()
+        try:
+            for t, message in self.frames:
+                if done.is_set():
+                    return
+                if self.speed > 0:
+                    delay = start + t / self.speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                conn.send(message)
+                with self._lock:
+                    self.stats["frames_sent"] += 1
+        except ConnectionClosed:
+            return
+        if self.close_at_end:
+            conn.close()
+        else:
+            done.wait()
+
+    def serve(self, host: str = "127.0.0.1", port: int = 8090):
+        from websockets.sync.server import serve
+        self._server = serve(self.handler, host, port, max_size=None)
+        return self._server
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = 0):
+        server = self.serve(host, port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def shutdown(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="OpenAI Realtime 互換のスタブ WebSocket サーバー（記録を配信）")
+    parser.add_argument("--recording", required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--speed", type=float, default=1.0, help="1=実時間, 10=10倍速, 0=待ち無し")
+    parser.add_argument("--no-wait", action="store_true", help="接続直後から配信する")
+    parser.add_argument("--close-at-end", action="store_true")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    fake = FakeRealtimeServer(load_recording(args.recording), args.speed, not args.no_wait,
+                              args.close_at_end, args.verbose)
+    server = fake.serve(args.host, args.port)
+    print(f"fake realtime server: ws://{args.host}:{args.port}/v1/realtime ({len(fake.frames)} frames)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(fake.stats, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+# feedback_batch.py
+"""
+保存済み transcript に対するフィードバックの一括（再）生成。
+
+  python feedback_batch.py --checkpoint regen.jsonl --concurrency 4 --rpm 120
+  python feedback_batch.py --checkpoint regen.jsonl --only-missing --scenario report_to_boss
+
+- 同時実行数は --concurrency で上限、送信ペースは --rpm で上限（0で無制限）
+- 429 を受けたら Retry-After の間、全ワーカーの送信を止める
+- 結果は1件ごとに save_feedback で保存し、checkpoint(JSONL) に追記する
+  同じ checkpoint で再実行すると、成功済みのセッションはスキップされる（再開）
+- 失敗したセッションの既存フィードバックは上書きしない
+- --emit-bus URL（SOCKETIO_MESSAGE_QUEUE と同じもの）を指定すると、保存のたびに
+  Web ワーカー経由で該当セッションのクライアントへ feedback_ready を送る
+
+ローカル検証は fake_openai_server.py と OPENAI_BASE_URL で行える。
+"""
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Iterator, Set, Tuple
+import json
+import os
+import sys
+import threading
+import time
+
+from session_store import SessionMeta
+import feedback_generator as fg
+
+
+class _RateGate:
+    """
+    全ワーカー共有の送信ゲート。
+    - rpm > 0 なら送信間隔を 60/rpm 秒以上あける
+    - pause(sec) で 429 の Retry-After 分だけ全体を停止
+    """
+    def __init__(self, rpm: float = 0):
+        self._interval = 60.0 / rpm if rpm and rpm > 0 else 0.0
+        self._next_at = 0.0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> float:
+        """送信可能になるまで待つ。return: 待った秒数"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                ready_at = max(self._next_at, self._paused_until)
+                if now >= ready_at:
+                    self._next_at = now + self._interval
+                    return waited
+                delay = ready_at - now
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class FeedbackBatchRunner:
+    def __init__(self, store, concurrency: int = 4, rpm: float = 0,
+                 checkpoint_path: Optional[str] = None, max_attempts: int = 5,
+                 api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 timeout: float = 60, emit_bus: Optional[str] = None):
+        self.store = store
+        self.concurrency = max(1, int(concurrency))
+        self.gate = _RateGate(rpm)
+        self.checkpoint_path = checkpoint_path
+        self.max_attempts = max(1, int(max_attempts))
+        self.api_key = api_key or fg.get_api_key()
+        self.base_url = base_url
+        self.timeout = timeout
+        self._emitter = None
+        if emit_bus:
+            from emit_bus import emitter
+            self._emitter = emitter(emit_bus)
+        self._tls = threading.local()
+        self._ckpt_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats: Dict[str, Any] = {
+            "done": 0, "failed": 0, "skipped": 0, "resumed": 0,
+            "rate_limited": 0, "retries": 0, "wait_sec": 0.0, "elapsed_sec": 0.0,
+        }
+
+    # ---- checkpoint ----
+    def load_checkpoint(self) -> Set[str]:
+        done: Set[str] = set()
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return done
+        with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except Exception:
+                    continue  # 中断時の書きかけ行
+                if rec.get("ok"):
+                    done.add(rec.get("session_id"))
+        return done
+
+    def _write_checkpoint(self, rec: Dict[str, Any]) -> None:
+        if not self.checkpoint_path:
+            return
+        line = json.dumps(rec, ensure_ascii=False) + "\n"
+        with self._ckpt_lock:
+            with open(self.checkpoint_path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def _count(self, key: str, n: float = 1) -> None:
+        with self._stats_lock:
+            self.stats[key] += n
+
+    # ---- targets ----
+    def iter_targets(self, only_missing: bool = False, scenario_id: Optional[str] = None,
+                     limit: Optional[int] = None) -> Iterator[Tuple[Dict[str, Any], str]]:
+        """
+        transcript が保存済みのセッションを (session_dict, transcript_json) でストリーミング。
+        """
+        n = 0
+        for meta, transcript_json, feedback_json in self.store.iter_export_rows():
+            if transcript_json is None:
+                continue
+            if only_missing and feedback_json is not None:
+                continue
+            if scenario_id and meta.get("scenario_id") != scenario_id:
+                continue
+            yield meta, transcript_json
+            n += 1
+            if limit and n >= limit:
+                return
+
+    # ---- per item ----
+    def _http(self):
+        s = getattr(self._tls, "session", None)
+        if s is None:
+            import requests
+            s = self._tls.session = requests.Session()
+        return s
+
+    def process_one(self, meta_dict: Dict[str, Any], transcript_json: str) -> Dict[str, Any]:
+        sid = meta_dict["session_id"]
+        started = time.monotonic()
+        try:
+            log = json.loads(transcript_json)
+        except Exception:
+            log = None
+        transcript = (log or {}).get("transcript") if isinstance(log, dict) else None
+        if not transcript:
+            self._count("skipped")
+            return {"session_id": sid, "ok": True, "skipped": "transcript is empty"}
+
+        meta = SessionMeta(**meta_dict)
+        payload, prompt_metrics = fg.build_feedback_request_with_metrics(meta, transcript)
+        attempts = 0
+        last_err: Optional[Exception] = None
+        while attempts < self.max_attempts:
+            attempts += 1
+            self._count("wait_sec", self.gate.wait())
+            try:
+                data = fg.post_chat_completions(payload, self.api_key, base_url=self.base_url,
+                                                timeout=self.timeout, session=self._http())
+                last_err = None
+                break
+            except fg.RateLimitedError as e:
+                self._count("rate_limited")
+                self.gate.pause(e.retry_after if e.retry_after is not None else min(60.0, 2.0 ** attempts))
+                last_err = e
+            except Exception as e:
+                time.sleep(min(30.0, 0.5 * (2 ** attempts)))
+                last_err = e
+            self._count("retries")
+
+        elapsed_ms = int((time.monotonic() - started) * 1000)
+        if last_err is not None:
+            self._count("failed")
+            return {"session_id": sid, "ok": False, "error": str(last_err), "attempts": attempts, "elapsed_ms": elapsed_ms}
+
+        feedback = fg.parse_feedback_content(data)
+        prompt_metrics["latency_ms"] = elapsed_ms
+        prompt_metrics["usage"] = data.get("usage") if isinstance(data, dict) else None
+        print(f"feedback prompt metrics: {sid}: {json.dumps(prompt_metrics, ensure_ascii=False)}")
+        feedback = fg.normalize_feedback_payload(feedback)
+        if feedback.get("error"):
+            self._count("failed")
+            return {"session_id": sid, "ok": False, "error": feedback["error"], "attempts": attempts, "elapsed_ms": elapsed_ms}
+        ok = self.store.save_feedback(sid, feedback)
+        self._count("done" if ok else "failed")
+        if ok and self._emitter is not None:
+            self._notify_ready(sid)
+        return {"session_id": sid, "ok": bool(ok), "score": feedback.get("score"), "attempts": attempts,
+                "elapsed_ms": elapsed_ms, "prompt_tokens_est": prompt_metrics.get("prompt_tokens_est"),
+                "compacted": prompt_metrics.get("compacted")}
+
+    def _notify_ready(self, sid: str) -> None:
+        from emit_bus import session_room
+        try:
+            self._emitter.emit("feedback_ready", {"session_id": sid}, room=session_room(sid), namespace="/")
+        except Exception as e:
+            print(f"feedback_ready emit error: {sid}: {e}")
+
+    # ---- run ----
+    def run(self, targets) -> Dict[str, Any]:
+        if not self.api_key:
+            raise RuntimeError("OPEN_AI_KEY (or OPENAI_API_KEY) が設定されていません")
+        started = time.monotonic()
+        done_ids = self.load_checkpoint()
+        # 投入済み・未完了の件数を concurrency*2 に抑えて、対象が大量でもメモリを一定に保つ
+        slots = threading.BoundedSemaphore(self.concurrency * 2)
+
+        def _task(meta_dict, transcript_json):
+            try:
+                try:
+                    rec = self.process_one(meta_dict, transcript_json)
+                except Exception as e:
+                    self._count("failed")
+                    rec = {"session_id": meta_dict.get("session_id"), "ok": False, "error": str(e)}
+                self._write_checkpoint(rec)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as ex:
+            for meta_dict, transcript_json in targets:
+                if meta_dict["session_id"] in done_ids:
+                    self._count("resumed")
+                    continue
+                slots.acquire()
+                ex.submit(_task, meta_dict, transcript_json)
+
+        self.stats["elapsed_sec"] = round(time.monotonic() - started, 3)
+        self.stats["wait_sec"] = round(self.stats["wait_sec"], 3)
+        return dict(self.stats)
+
+
+def main(argv=None) -> int:
+    import argparse
+    from session_store import SQLiteSessionStore
+
+    parser = argparse.ArgumentParser(description="保存済み transcript のフィードバック一括生成")
+    parser.add_argument("--db", default=os.environ.get("SQLITE_PATH") or "app.db")
+    parser.add_argument("--checkpoint", default="feedback_batch.jsonl", help="再開用の結果ファイル（JSONL）")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rpm", type=float, default=0, help="1分あたりの最大リクエスト数（0で無制限）")
+    parser.add_argument("--max-attempts", type=int, default=5)
+    parser.add_argument("--only-missing", action="store_true", help="フィードバック未生成のセッションのみ")
+    parser.add_argument("--scenario", default=None)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--base-url", default=None, help="既定は OPENAI_BASE_URL または api.openai.com")
+    parser.add_argument("--emit-bus", default=os.environ.get("SOCKETIO_MESSAGE_QUEUE") or None,
+                        help="保存ごとに feedback_ready を送る emit bus（既定は SOCKETIO_MESSAGE_QUEUE）")
+    args = parser.parse_args(argv)
+
+    store = SQLiteSessionStore(args.db)
+    runner = FeedbackBatchRunner(
+        store,
+        concurrency=args.concurrency,
+        rpm=args.rpm,
+        checkpoint_path=args.checkpoint,
+        max_attempts=args.max_attempts,
+        base_url=args.base_url,
+        emit_bus=args.emit_bus,
+    )
+    stats = runner.run(runner.iter_targets(args.only_missing, args.scenario, args.limit))
+    print(json.dumps(stats, ensure_ascii=False))
+    return 0 if stats["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
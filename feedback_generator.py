@@ -0,0 +1,346 @@
+# feedback_generator.py
+"""
+会話ログから OpenAI でフィードバックを生成する処理。
+Web（test_OpenAI_WebUI.py）とバッチ（feedback_batch.py）の両方から使うため、
+Flask / eventlet に依存しない形で切り出しています。
+"""
+from __future__ import annotations
+from typing import Optional, Dict, Any, List, Tuple
+import json
+import os
+import time
+
+from transcript_compactor import compact_lines, estimate_tokens
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+# 429 を受けたときに呼ぶ関数（app では入場制御の一時停止に使う）
+_rate_limit_listeners: List[Any] = []
+
+
+def add_rate_limit_listener(fn) -> None:
+    """fn(retry_after: Optional[float]) を 429 のたびに呼ぶ"""
+    _rate_limit_listeners.append(fn)
+
+
+def notify_rate_limited(retry_after: Optional[float]) -> None:
+    for fn in list(_rate_limit_listeners):
+        try:
+            fn(retry_after)
+        except Exception as e:
+            print(f"rate limit listener error: {e}")
+
+
+class RateLimitedError(Exception):
+    """429 応答。retry_after は秒（不明なら None）"""
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _parse_retry_after(headers) -> Optional[float]:
+    for k in ("Retry-After", "retry-after-ms", "x-ratelimit-reset-requests"):
+        v = headers.get(k) if headers else None
+        if not v:
+            continue
+        try:
+            if k == "retry-after-ms":
+                return float(v) / 1000.0
+            # x-ratelimit-reset-* は "1s" / "120ms" 形式
+            if v.endswith("ms"):
+                return float(v[:-2]) / 1000.0
+            if v.endswith("s"):
+                return float(v[:-1])
+            return float(v)
+        except Exception:
+            continue
+    return None
+
+
+def _meta_attr(meta, name: str) -> str:
+    try:
+        return getattr(meta, name, "") or ""
+    except Exception:
+        return ""
+
+
+def build_feedback_request(meta, transcript: List[Dict[str, Any]], model: Optional[str] = None,
+                           token_budget: Optional[int] = None) -> Dict[str, Any]:
+    """
+    chat/completions に送る payload を組み立てる。
+    """
+    return build_feedback_request_with_metrics(meta, transcript, model, token_budget)[0]
+
+
+def build_feedback_request_with_metrics(meta, transcript: List[Dict[str, Any]], model: Optional[str] = None,
+                                        token_budget: Optional[int] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    payload と プロンプトサイズの指標（transcript_compactor.compact_lines の metrics +
+    prompt_tokens_est）を返す。会話ログは token_budget（既定は FEEDBACK_PROMPT_TOKEN_BUDGET）に収める。
+    """
+    model = model or os.environ.get("FEEDBACK_MODEL") or "gpt-4o-mini"
+
+    title = _meta_attr(meta, "title")
+    instructions = _meta_attr(meta, "instructions")
+
+    def _clip(s, n=500):
+        s = s or ""
+        return s if len(s) <= n else s[:n] + "…"
+
+    lines = []
+    for t in transcript:
+        role = (t.get("role") or "").strip()
+        text = (t.get("text") or "").strip()
+        if not role or not text:
+            continue
+        if role == "user":
+            lines.append(f"ユーザー: {_clip(text)}")
+        elif role == "assistant":
+            lines.append(f"AI: {_clip(text)}")
+        else:
+            lines.append(f"{role}: {_clip(text)}")
+
+    lines, metrics = compact_lines(lines, budget=token_budget)
+    convo_text = "\n".join(lines)
+    if metrics.get("compacted"):
+        # 途中を省いたログを「全体」と言うと、省いた部分が無かったものとして評価される
+        scope = (
+            "以下の会話ログを読んで、次のJSON形式で返してください。\n"
+            "※会話が長いため、ログの途中の一部は省略・要約しています（「中略」の行）。"
+            "省略された部分は推測で評価せず、残っている会話の流れ全体を対象にしてください。\n"
+        )
+    else:
+        scope = (
+            "以下の会話ログ（全体）を読んで、次のJSON形式で返してください。\n"
+            "※ユーザーの最初の返答だけでなく、会話の流れ全体を対象にしてください。\n"
+        )
+
+    system = (
+        "あなたは会話練習のコーチです。日本語で、短く具体的にフィードバックしてください。"
+        "相手を傷つけないトーンで、改善点は行動に落とせる形で提案してください。"
+    )
+    user = (
+        f"シナリオ: {title}\n"
+        f"追加指示: {instructions}\n\n"
+        f"{scope}"
+        "{\n"
+        "  \"summary\": \"会話の要約（2〜4行。状況/論点/結論が分かるように）\",\n"
+        "  \"score\": 0,\n"
+        "  \"good_points\": [\"良かった点（最大3）\"],\n"
+        "  \"improvements\": [\"改善点（最大3。次回すぐ実行できる具体行動で）\"],\n"
+        "  \"better_questions\": [\"次に確認すべき質問（最大3）\"],\n"
+        "  \"key_moments\": [\n"
+        "    \"【局面】(いつ/何に対して)\\n【狙い】(相手が知りたいこと)\\n【改善】(こう言うと良い)\\n【模範（ユーザー）】(1〜3文)\\n【短い言い換え】(1文)\",\n"
+        "    \"...（2〜5個）\"\n"
+        "  ],\n"
+        "  \"model_answer\": \"模範会話例（2〜4往復。ユーザーと相手の両方を書き、重要局面ではユーザーの返しを示す）\",\n"
+        "  \"alt_phrasings\": [\"言い換え例（柔らかめ）\", \"言い換え例（端的）\"],\n"
+        "  \"next_actions\": [\"次回の練習でやること（最大3）\"],\n"
+        "  \"next_drill\": \"次の1本ノック（次回の練習テーマを1つ。短く）\"\n"
+        "}\n\n"
+        "会話ログ:\n"
+        f"{convo_text}"
+    )
+
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ],
+        "temperature": 0.2,
+    }
+    metrics["prompt_tokens_est"] = estimate_tokens(system) + estimate_tokens(user)
+    return payload, metrics
+
+
+def post_chat_completions(payload: Dict[str, Any], api_key: str, base_url: Optional[str] = None,
+                          timeout: float = 60, session=None) -> Dict[str, Any]:
+    """
+    chat/completions を1回呼ぶ。429 は RateLimitedError、それ以外の失敗は requests の例外を送出。
+    """
+    import requests
+
+    base_url = (base_url or os.environ.get("OPENAI_BASE_URL") or DEFAULT_BASE_URL).rstrip("/")
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+    res = (session or requests).post(f"{base_url}/chat/completions", headers=headers, json=payload, timeout=timeout)
+    if res.status_code == 429:
+        retry_after = _parse_retry_after(res.headers)
+        notify_rate_limited(retry_after)
+        raise RateLimitedError("rate limited (429)", retry_after)
+    res.raise_for_status()
+    return res.json()
+
+
+def parse_feedback_content(data: Any) -> Dict[str, Any]:
+    """
+    chat/completions の応答から JSON フィードバックを取り出す。
+    """
+    content = None
+    try:
+        content = data["choices"][0]["message"]["content"]
+    except Exception:
+        content = None
+
+    if isinstance(content, str) and content.strip():
+        try:
+            parsed = json.loads(content)
+            if isinstance(parsed, dict):
+                return parsed
+            return {"text": content}
+        except Exception:
+            return {"text": content}
+
+    return {"error": "フィードバック生成に失敗しました（contentが空）"}
+
+
+def get_api_key() -> Optional[str]:
+    return os.environ.get("OPEN_AI_KEY") or os.environ.get("OPENAI_API_KEY")
+
+
+def generate_feedback_with_openai(meta, transcript):
+    """
+    transcript（list[dict]）から簡易フィードバックを生成する。
+    - 失敗時は {"error": "..."} を返す
+    - 429 はその場で再送しない（入場制御の一時停止に従う）。{"error", "rate_limited": True, "retry_after"} を返す
+    - 成功時は dict（JSONにできる形）を返す
+    - prompt_metrics（プロンプトサイズ・所要時間）はログに出すだけで、返り値（＝保存されるフィードバック）には含めない
+    """
+    metrics: Dict[str, Any] = {}
+    try:
+        api_key = get_api_key()
+        if not api_key:
+            return {"error": "OPEN_AI_KEY (or OPENAI_API_KEY) が設定されていません"}
+
+        payload, metrics = build_feedback_request_with_metrics(meta, transcript)
+        started = time.monotonic()
+        data = None
+        last_err = None
+        for _ in range(2):
+            try:
+                data = post_chat_completions(payload, api_key)
+                last_err = None
+                break
+            except RateLimitedError:
+                raise
+            except Exception as e:
+                last_err = e
+                data = None
+        metrics["latency_ms"] = int((time.monotonic() - started) * 1000)
+        if last_err is not None:
+            raise last_err
+        try:
+            metrics["usage"] = data.get("usage")
+        except Exception:
+            pass
+        print(f"feedback prompt metrics: {json.dumps(metrics, ensure_ascii=False)}")
+        return parse_feedback_content(data)
+
+    except Exception as e:
+        out = {"error": f"フィードバック生成エラー: {e}"}
+        if isinstance(e, RateLimitedError):
+            out.update(rate_limited=True, retry_after=e.retry_after)
+        if metrics:
+            print(f"feedback prompt metrics: {json.dumps(metrics, ensure_ascii=False)}")
+        return out
+
+
+def normalize_feedback_payload(payload):
+    """
+    OpenAIの返り値（JSON/テキスト/エラー）を templates で扱いやすい形に正規化する。
+    - summary: str
+    - good_points / improvements / next_actions: list[str]
+    - score: int
+    """
+    try:
+        if payload is None:
+            payload = {}
+        if isinstance(payload, str):
+            payload = {"text": payload}
+        elif not isinstance(payload, dict):
+            payload = {"text": str(payload)}
+
+        v = dict(payload)
+
+        def _as_str(x):
+            if x is None:
+                return ""
+            try:
+                return str(x)
+            except Exception:
+                return ""
+
+        def _as_list(x):
+            if x is None:
+                return []
+            if isinstance(x, list):
+                out = []
+                for it in x:
+                    s = _as_str(it).strip()
+                    if s:
+                        out.append(s)
+                return out
+            s = _as_str(x).strip()
+            return [s] if s else []
+
+        if not isinstance(v.get("summary"), str):
+            v["summary"] = _as_str(v.get("summary"))
+
+        if not v.get("summary"):
+            if v.get("error"):
+                v["summary"] = _as_str(v.get("error"))
+            elif v.get("text"):
+                v["summary"] = _as_str(v.get("text"))
+
+        v["good_points"] = _as_list(v.get("good_points"))
+        v["improvements"] = _as_list(v.get("improvements"))
+        v["next_actions"] = _as_list(v.get("next_actions"))
+        v["better_questions"] = _as_list(v.get("better_questions"))
+        v["key_moments"] = _as_list(v.get("key_moments"))
+
+        if not isinstance(v.get("model_answer"), str):
+            v["model_answer"] = _as_str(v.get("model_answer"))
+        v["alt_phrasings"] = _as_list(v.get("alt_phrasings"))
+        if not isinstance(v.get("next_drill"), str):
+            v["next_drill"] = _as_str(v.get("next_drill"))
+
+        score = v.get("score")
+        try:
+            v["score"] = int(score)
+        except Exception:
+            v["score"] = 0
+
+        if "better_questions" not in v:
+            v["better_questions"] = []
+        if "key_moments" not in v:
+            v["key_moments"] = []
+        if "model_answer" not in v:
+            v["model_answer"] = ""
+        if "alt_phrasings" not in v:
+            v["alt_phrasings"] = []
+        if "next_drill" not in v:
+            v["next_drill"] = ""
+
+        if "summary" not in v:
+            v["summary"] = ""
+        if "good_points" not in v:
+            v["good_points"] = []
+        if "improvements" not in v:
+            v["improvements"] = []
+        if "next_actions" not in v:
+            v["next_actions"] = []
+        if "score" not in v:
+            v["score"] = 0
+
+        return v
+    except Exception:
+        return {
+            "summary": "（フィードバックの整形に失敗しました）",
+            "good_points": [],
+            "improvements": [],
+            "next_actions": [],
+            "score": 0
+        }
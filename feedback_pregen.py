@@ -0,0 +1,188 @@
+# feedback_pregen.py
+"""
+transcript 保存直後にフィードバックを先行生成する（FEEDBACK_PREGENERATE=1 で有効）。
+
+- 同じセッションの生成は1本だけ（保存し直されたら古い生成は破棄して作り直す）
+- 同時実行数と1時間あたりの生成数で全体の予算を制限し、超えた分は生成しない
+- 明示的な生成APIは、進行中の先行生成があればそれを待って結果を使う
+- 指標: 先に出来上がっていた割合（hit rate）と、捨てた生成（wasted）
+"""
+from __future__ import annotations
+from collections import OrderedDict, deque
+from typing import Optional, Dict, Any, Callable
+import threading
+import time
+
+PREGENERATED_SOURCE = "pregenerated"
+
+
+class _Job:
+    __slots__ = ("session_id", "done", "cancelled", "committed", "result", "started_at")
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.done = threading.Event()
+        self.cancelled = False
+        self.committed = False  # 保存に進んだ（以降は cancel() で止められない）
+        self.result: Optional[Dict[str, Any]] = None
+        self.started_at = time.time()
+
+
+class FeedbackPregenerator:
+    """
+    generate(session_id) -> 正規化済みフィードバック dict（失敗時は "error" を含む）
+    spawn(fn, *args)     -> バックグラウンド実行（app では socketio.start_background_task）
+    on_saved(session_id, feedback) -> 保存後の通知（任意。app では feedback_ready を emit）
+    """
+    def __init__(self, store, generate: Callable[[str], Dict[str, Any]], spawn: Callable[..., Any],
+                 max_concurrent: int = 2, max_per_hour: int = 200,
+                 on_saved: Optional[Callable[[str, Dict[str, Any]], Any]] = None):
+        self._store = store
+        self._generate = generate
+        self._spawn = spawn
+        self._on_saved = on_saved
+        self._slots = threading.BoundedSemaphore(max(1, int(max_concurrent)))
+        self._max_per_hour = int(max_per_hour)
+        self._recent_starts: deque = deque()
+        self._jobs: Dict[str, _Job] = {}
+        self._viewed: "OrderedDict[str, bool]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {
+            "scheduled": 0, "completed": 0, "failed": 0, "skipped_budget": 0,
+            "superseded": 0, "cancelled": 0, "joined": 0, "overwritten": 0,
+            "hits": 0, "pending": 0, "misses": 0,
+        }
+
+    # ---- schedule ----
+    def _within_budget(self) -> bool:
+        # self._lock 内で呼ぶ
+        now = time.time()
+        while self._recent_starts and now - self._recent_starts[0] > 3600:
+            self._recent_starts.popleft()
+        if self._max_per_hour and len(self._recent_starts) >= self._max_per_hour:
+            return False
+        self._recent_starts.append(now)
+        return True
+
+    def schedule(self, session_id: str) -> bool:
+        """transcript 保存後に呼ぶ。生成を開始したら True"""
+        with self._lock:
+            old = self._jobs.pop(session_id, None)
+            if old is not None and not old.done.is_set():
+                old.cancelled = True  # 保存し直された：古い transcript の結果は使わない
+                self._stats["superseded"] += 1
+            if not self._slots.acquire(blocking=False):
+                self._stats["skipped_budget"] += 1
+                return False
+            if not self._within_budget():
+                self._slots.release()
+                self._stats["skipped_budget"] += 1
+                return False
+            job = _Job(session_id)
+            self._jobs[session_id] = job
+            self._stats["scheduled"] += 1
+        self._spawn(self._run, job)
+        return True
+
+    def cancel(self, session_id: str, timeout: float = 10) -> None:
+        """
+        進行中の生成を取り消す。保存に進んでいた場合は保存が終わるまで待つので、
+        呼び出し元はこの後に削除すればよい（削除したフィードバックが書き戻されない）
+        """
+        with self._lock:
+            job = self._jobs.pop(session_id, None)
+            if job is None or job.done.is_set():
+                return
+            if not job.committed:
+                job.cancelled = True
+                self._stats["cancelled"] += 1
+                return
+        job.done.wait(timeout)
+
+    def _run(self, job: _Job) -> None:
+        try:
+            result = self._generate(job.session_id)
+            if job.cancelled:
+                return
+            if not isinstance(result, dict) or result.get("error"):
+                with self._lock:
+                    self._stats["failed"] += 1
+                return
+            result = dict(result)
+            result["source"] = PREGENERATED_SOURCE
+            with self._lock:
+                if job.cancelled:
+                    return
+                job.committed = True
+            self._store.save_feedback(job.session_id, result)
+            job.result = result
+            with self._lock:
+                self._stats["completed"] += 1
+            if self._on_saved:
+                self._on_saved(job.session_id, result)
+        except Exception as e:
+            print(f"フィードバック先行生成エラー: {job.session_id}: {e}")
+            with self._lock:
+                self._stats["failed"] += 1
+        finally:
+            job.done.set()
+            with self._lock:
+                if self._jobs.get(job.session_id) is job:
+                    del self._jobs[job.session_id]
+            self._slots.release()
+
+    # ---- consumers ----
+    def in_flight(self, session_id: str) -> bool:
+        with self._lock:
+            job = self._jobs.get(session_id)
+            return job is not None and not job.done.is_set()
+
+    def join(self, session_id: str, timeout: float = 90) -> Optional[Dict[str, Any]]:
+        """進行中の先行生成があれば終わるまで待って結果を返す（無ければ None）"""
+        with self._lock:
+            job = self._jobs.get(session_id)
+        if job is None:
+            return None
+        job.done.wait(timeout)
+        if job.result is not None and not job.cancelled:
+            with self._lock:
+                self._stats["joined"] += 1
+            return job.result
+        return None
+
+    def note_regenerated(self, previous: Any) -> None:
+        """明示的な生成で先行生成の結果を上書きした（= 先行生成は無駄になった）"""
+        if isinstance(previous, dict) and previous.get("source") == PREGENERATED_SOURCE:
+            with self._lock:
+                self._stats["overwritten"] += 1
+
+    def note_view(self, session_id: str, feedback: Any) -> str:
+        """
+        フィードバック画面の表示時に呼ぶ（セッションごとに初回のみ集計）。
+        return: "hit" / "pending" / "miss" / "" (集計対象外)
+        """
+        if self.in_flight(session_id):
+            kind = "pending"
+        elif isinstance(feedback, dict) and feedback.get("source") == PREGENERATED_SOURCE:
+            kind = "hit"
+        elif feedback is None or (isinstance(feedback, dict) and feedback.get("provisional")):
+            kind = "miss"
+        else:
+            return ""
+        with self._lock:
+            if session_id in self._viewed:
+                return kind
+            self._viewed[session_id] = True
+            if len(self._viewed) > 10000:
+                self._viewed.popitem(last=False)
+            self._stats[{"hit": "hits", "pending": "pending", "miss": "misses"}[kind]] += 1
+        return kind
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            out["in_flight"] = sum(1 for j in self._jobs.values() if not j.done.is_set())
+        views = out["hits"] + out["pending"] + out["misses"]
+        out["hit_rate"] = round(out["hits"] / views, 3) if views else None
+        out["wasted"] = out["superseded"] + out["cancelled"] + out["overwritten"]
+        return out
@@ -0,0 +1,290 @@
+# heuristic_scorer.py
+"""
+会話ログをローカルのルールだけで採点する（LLM を呼ばない・決定的・1件数ミリ秒）。
+
+- 指標: 結論先出し / ユーザー発言の長さ分布 / 質問率 / フィラー・ヘッジ表現の頻度 / 発話量バランス
+- シナリオの focus タグ（scenarios.json）に応じて、重視する観点の重みを変える
+- 返り値は normalize_feedback_payload と同じ形に provisional=True / source="heuristic" を付けたもの
+  （feedback_score は provisional を集計しないので、スコア集計には混ざらない）
+
+一括採点（分析用）:
+  python heuristic_scorer.py --db app.db --out scores.jsonl
+"""
+from __future__ import annotations
+from typing import Optional, Dict, Any, List, Iterable, Iterator, Tuple
+import json
+import re
+import sys
+import time
+
+HEURISTIC_SOURCE = "heuristic"
+
+# 長いものから並べる（「えーと」を「えー」より先に当てる）
+_FILLER_RE = re.compile(r"えーっと|えーと|ええと|えっと|あのー|あの〜|そのー|えー+|うーん|まあ|なんか")
+_HEDGE_RE = re.compile(r"たぶん|多分|おそらく|かもしれ|と思います|と思う|一応|なんとなく|ちょっと|気がします")
+_CONCLUSION_RE = re.compile(r"結論|要するに|端的に|一言で|ポイントは|まず(?:は)?.{0,6}(?:から|と)|先に.{0,4}(?:申し上げ|お伝え)")
+_DECLARATIVE_END_RE = re.compile(r"(?:です|ます|でした|ました|ません|になります|予定です)[。．.!！]?$")
+_QUESTION_RE = re.compile(r"[?？]|(?:ですか|ますか|でしょうか|ませんか|ですかね|いかがですか|どう(?:ですか|でしょう))[。．]?\s*$")
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[。！？!?])")
+
+# focus タグ → 重視する観点（未登録のタグは共通観点のみ）
+FOCUS_DIMENSIONS: Dict[str, Tuple[str, ...]] = {
+    "結論先出し": ("conclusion_first",),
+    "要点整理": ("concise", "conclusion_first"),
+    "論点整理": ("concise", "conclusion_first"),
+    "意思決定支援": ("conclusion_first", "concise"),
+    "判断の言語化": ("confidence", "conclusion_first"),
+    "選択肢提示": ("concise",),
+    "的確回答": ("concise", "confidence"),
+    "説明責任": ("confidence",),
+    "リスク説明": ("confidence", "concise"),
+    "期待値調整": ("confidence", "balance"),
+    "信頼回復": ("confidence", "listening"),
+    "次アクション合意": ("questions", "conclusion_first"),
+    "合意形成": ("questions", "balance"),
+    "交渉": ("questions", "confidence"),
+    "ヒアリング": ("questions", "listening"),
+    "深掘り質問": ("questions",),
+    "状況把握": ("questions", "listening"),
+    "対人支援": ("listening", "questions"),
+    "ファシリ": ("questions", "listening"),
+    "雑談": ("balance", "fluency"),
+}
+BASE_DIMENSIONS = ("fluency", "confidence")
+FOCUS_WEIGHT = 2.0
+BASE_WEIGHT = 1.0
+
+_LABELS = {
+    "conclusion_first": "結論先出し",
+    "concise": "簡潔さ",
+    "questions": "質問",
+    "listening": "聞く姿勢",
+    "balance": "発話バランス",
+    "fluency": "なめらかさ",
+    "confidence": "言い切り",
+}
+_GOOD = {
+    "conclusion_first": "発言の冒頭で結論を示せていました。",
+    "concise": "1回の発言が適度な長さにまとまっていました。",
+    "questions": "質問を挟みながら相手の情報を引き出せていました。",
+    "listening": "相手に話してもらう時間を確保できていました。",
+    "balance": "相手と同じくらいの量で会話を往復できていました。",
+    "fluency": "「えーと」などのつなぎ言葉が少なく、聞き取りやすい話し方でした。",
+    "confidence": "「たぶん」「と思います」などのぼかし表現が少なく、言い切れていました。",
+}
+_IMPROVE = {
+    "conclusion_first": "発言の最初の一文で結論（「結論から言うと〜です」）を言ってから理由を続けましょう。",
+    "concise": "1回の発言は2〜3文を目安に区切り、相手の反応を見てから続けましょう。",
+    "questions": "「具体的には？」「いつまでに？」など、相手に確認する質問を意識して入れましょう。",
+    "listening": "自分の説明を短めにして、相手が話す時間を増やしましょう。",
+    "balance": "一方的にならないよう、相手の発言量とのバランスを意識しましょう。",
+    "fluency": "つなぎ言葉（えーと・あの・なんか）を減らし、間は無言で取りましょう。",
+    "confidence": "ぼかし表現を減らし、事実と意見を分けて言い切りましょう。",
+}
+
+
+def _split_sentences(text: str) -> List[str]:
+    return [s for s in (x.strip() for x in _SENTENCE_SPLIT_RE.split(text)) if s]
+
+
+def _percentile(sorted_vals: List[int], q: float) -> int:
+    if not sorted_vals:
+        return 0
+    i = min(len(sorted_vals) - 1, int(round(q * (len(sorted_vals) - 1))))
+    return sorted_vals[i]
+
+
+def _is_conclusion_first(text: str) -> bool:
+    sentences = _split_sentences(text)
+    if not sentences:
+        return False
+    first = sentences[0]
+    if _CONCLUSION_RE.search(first):
+        return True
+    # 短い言い切りの一文から入っていれば結論先出しとみなす
+    return len(first) <= 30 and bool(_DECLARATIVE_END_RE.search(first))
+
+
+def compute_signals(transcript) -> Dict[str, Any]:
+    """transcript（list[{role,text,ts}]）から計測値を出す"""
+    user_lens: List[int] = []
+    user_chars = ai_chars = 0
+    questions = fillers = hedges = conclusion = long_turns = 0
+    for t in transcript or []:
+        if not isinstance(t, dict):
+            continue
+        text = (t.get("text") or "").strip()
+        if not text:
+            continue
+        role = t.get("role")
+        if role == "user":
+            n = len(text)
+            user_lens.append(n)
+            user_chars += n
+            if _QUESTION_RE.search(text):
+                questions += 1
+            fillers += len(_FILLER_RE.findall(text))
+            hedges += len(_HEDGE_RE.findall(text))
+            # 結論先出しは、ある程度の長さの発言（説明・報告）だけを対象にする
+            if n >= 20:
+                long_turns += 1
+                if _is_conclusion_first(text):
+                    conclusion += 1
+        elif role == "assistant":
+            ai_chars += len(text)
+
+    user_turns = len(user_lens)
+    lens = sorted(user_lens)
+    total_chars = user_chars + ai_chars
+    per100 = 100.0 / user_chars if user_chars else 0.0
+    return {
+        "user_turns": user_turns,
+        "user_chars": user_chars,
+        "assistant_chars": ai_chars,
+        "turn_chars_mean": round(user_chars / user_turns, 1) if user_turns else 0,
+        "turn_chars_median": _percentile(lens, 0.5),
+        "turn_chars_p90": _percentile(lens, 0.9),
+        "turn_chars_max": lens[-1] if lens else 0,
+        "question_ratio": round(questions / user_turns, 3) if user_turns else 0.0,
+        "fillers": fillers,
+        "fillers_per_100": round(fillers * per100, 2),
+        "hedges": hedges,
+        "hedges_per_100": round(hedges * per100, 2),
+        "conclusion_first_ratio": round(conclusion / long_turns, 3) if long_turns else None,
+        "user_talk_share": round(user_chars / total_chars, 3) if total_chars else 0.0,
+    }
+
+
+def _dimension_scores(sig: Dict[str, Any]) -> Dict[str, float]:
+    median = sig["turn_chars_median"]
+    if median <= 0:
+        concise = 0.0
+    elif median <= 120:
+        concise = 1.0 if median >= 15 else median / 15.0
+    else:
+        concise = max(0.0, 1.0 - (median - 120) / 240.0)
+    share = sig["user_talk_share"]
+    cf = sig["conclusion_first_ratio"]
+    return {
+        # 長めの発言が無い（短い応答だけ）の場合は判定できないので中立
+        "conclusion_first": 0.5 if cf is None else cf,
+        "concise": concise,
+        "questions": min(1.0, sig["question_ratio"] / 0.3),
+        "listening": 1.0 if share <= 0.5 else max(0.0, 1.0 - (share - 0.5) / 0.4),
+        "balance": max(0.0, 1.0 - abs(share - 0.5) * 2.5),
+        "fluency": max(0.0, 1.0 - sig["fillers_per_100"] / 5.0),
+        "confidence": max(0.0, 1.0 - sig["hedges_per_100"] / 4.0),
+    }
+
+
+def score_transcript(transcript, focus: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """
+    暫定フィードバック（normalize_feedback_payload と同じ形 + provisional / source / signals / dimensions）
+    """
+    sig = compute_signals(transcript)
+    weights: Dict[str, float] = {d: BASE_WEIGHT for d in BASE_DIMENSIONS}
+    for tag in focus or ():
+        for d in FOCUS_DIMENSIONS.get(tag, ()):
+            weights[d] = FOCUS_WEIGHT
+    dims = _dimension_scores(sig)
+    used = {d: round(dims[d], 3) for d in weights}
+
+    if sig["user_turns"] == 0:
+        score = 0
+    else:
+        score = int(round(100 * sum(dims[d] * w for d, w in weights.items()) / sum(weights.values())))
+
+    ordered = sorted(weights, key=lambda d: (-weights[d], d))
+    good = [_GOOD[d] for d in ordered if dims[d] >= 0.8][:3]
+    improve = [_IMPROVE[d] for d in sorted(ordered, key=lambda d: dims[d]) if dims[d] < 0.6][:3]
+    summary = (
+        f"ローカル集計による暫定評価です（ユーザー発言{sig['user_turns']}回・"
+        f"平均{sig['turn_chars_mean']}文字・質問率{int(round(sig['question_ratio'] * 100))}%）。"
+        "AIによる詳しいフィードバックを生成すると置き換わります。"
+    )
+    return {
+        "summary": summary,
+        "score": score,
+        "good_points": good,
+        "improvements": improve,
+        "next_actions": improve[:1],
+        "better_questions": [],
+        "key_moments": [],
+        "model_answer": "",
+        "alt_phrasings": [],
+        "next_drill": "",
+        "provisional": True,
+        "source": HEURISTIC_SOURCE,
+        "signals": sig,
+        "dimensions": {_LABELS[d]: v for d, v in used.items()},
+    }
+
+
+def score_export_rows(rows, scenarios_by_id: Dict[str, Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """
+    store.iter_export_rows() の (session_dict, transcript_json, feedback_json) を順に採点する。
+    transcript の無いセッションは飛ばす。
+    """
+    for meta, transcript_json, _ in rows:
+        if transcript_json is None:
+            continue
+        try:
+            log = json.loads(transcript_json)
+        except Exception:
+            continue
+        transcript = (log or {}).get("transcript") if isinstance(log, dict) else None
+        if not transcript:
+            continue
+        s = scenarios_by_id.get(meta.get("scenario_id")) or {}
+        fb = score_transcript(transcript, s.get("focus"))
+        yield {
+            "session_id": meta.get("session_id"),
+            "scenario_id": meta.get("scenario_id"),
+            "score": fb["score"],
+            "signals": fb["signals"],
+        }
+
+
+def main(argv=None) -> int:
+    import argparse
+    import os
+    from session_store import SQLiteSessionStore
+
+    parser = argparse.ArgumentParser(description="保存済み transcript のローカル一括採点")
+    parser.add_argument("--db", default=os.environ.get("SQLITE_PATH") or "app.db")
+    parser.add_argument("--out", default=None, help="1セッション1行の結果（JSONL）。省略時は集計のみ")
+    parser.add_argument("--scenario", default=None)
+    args = parser.parse_args(argv)
+
+    store = SQLiteSessionStore(args.db)
+    scenarios = {s["id"]: s for s in store.list_scenarios()}
+    rows = store.iter_export_rows()
+    if args.scenario:
+        rows = (r for r in rows if r[0].get("scenario_id") == args.scenario)
+
+    started = time.perf_counter()
+    n = 0
+    per_scenario: Dict[str, List[int]] = {}
+    out = open(args.out, "w", encoding="utf-8") if args.out else None
+    try:
+        for rec in score_export_rows(rows, scenarios):
+            n += 1
+            per_scenario.setdefault(rec["scenario_id"], []).append(rec["score"])
+            if out:
+                out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    finally:
+        if out:
+            out.close()
+    elapsed = time.perf_counter() - started
+    summary = {
+        "scored": n,
+        "elapsed_sec": round(elapsed, 3),
+        "per_sec": round(n / elapsed, 1) if elapsed > 0 else None,
+        "scenarios": {k: {"n": len(v), "avg": round(sum(v) / len(v), 1)} for k, v in sorted(per_scenario.items())},
+    }
+    print(json.dumps(summary, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+# json_codec.py
+"""
+JSON のエンコード/デコードをまとめる層（ストア・API レスポンス・Realtime の中継で共通に使う）。
+
+  JSON_CODEC=auto     # 既定。orjson が入っていれば orjson、無ければ標準の json
+  JSON_CODEC=orjson   # orjson を必須にする（入っていなければ起動時に ImportError）
+  JSON_CODEC=stdlib   # 常に標準の json
+
+どちらのバックエンドでも出力は同じ形にそろえる。
+- ensure_ascii=False 相当（日本語は \\uXXXX にせず UTF-8 のまま）
+- 区切りは空白なし（"," / ":"）。sort_keys / indent=2 は指定したときだけ
+- dict の非文字列キーは文字列にする
+orjson が扱えない値（64bit を超える整数、default に任せたい型など）は標準の json でやり直すので、
+結果は標準の json.dumps(..., ensure_ascii=False, separators=(",", ":")) と同じになる。
+
+dumps / loads は標準の json と同じ呼び方ができるので、モジュールごと Socket.IO の json= に渡せる。
+"""
+from __future__ import annotations
+from typing import Any, Callable, Optional
+import json as _stdlib
+import os
+
+BACKENDS = ("orjson", "stdlib")
+
+
+def _select():
+    name = (os.environ.get("JSON_CODEC") or "auto").strip().lower()
+    if name not in ("auto",) + BACKENDS:
+        raise ValueError(f"JSON_CODEC must be auto or one of {BACKENDS}: {name}")
+    if name == "stdlib":
+        return "stdlib", None
+    try:
+        import orjson
+    except ImportError:
+        if name == "orjson":
+            raise
+        return "stdlib", None
+    return "orjson", orjson
+
+
+backend, _orjson = _select()
+
+if _orjson is not None:
+    _BASE_OPTS = (_orjson.OPT_NON_STR_KEYS | _orjson.OPT_PASSTHROUGH_DATETIME
+                  | _orjson.OPT_PASSTHROUGH_DATACLASS | _orjson.OPT_PASSTHROUGH_SUBCLASS)
+
+JSONDecodeError = _stdlib.JSONDecodeError  # orjson.JSONDecodeError もこのサブクラス
+
+
+def _stdlib_dumps(obj: Any, default, sort_keys: bool, indent) -> str:
+    return _stdlib.dumps(obj, ensure_ascii=False, default=default, sort_keys=sort_keys,
+                         indent=2 if indent else None, separators=(",", ": ") if indent else (",", ":"))
+
+
+def dumps_bytes(obj: Any, *, default: Optional[Callable[[Any], Any]] = None, sort_keys: bool = False,
+                indent: bool = False) -> bytes:
+    """UTF-8 のバイト列にする（HTTP レスポンス・ファイル向け。str を経由しない）"""
+    if _orjson is not None:
+        opts = _BASE_OPTS
+        if sort_keys:
+            opts |= _orjson.OPT_SORT_KEYS
+        if indent:
+            opts |= _orjson.OPT_INDENT_2
+        try:
+            return _orjson.dumps(obj, default=default, option=opts)
+        except TypeError:
+            pass  # 標準の json でやり直す（扱えなければそちらの TypeError を出す）
+    return _stdlib_dumps(obj, default, sort_keys, indent).encode("utf-8")
+
+
+def dumps(obj: Any, *, default: Optional[Callable[[Any], Any]] = None, sort_keys: bool = False,
+          indent: bool = False, **_stdlib_kwargs) -> str:
+    """
+    str にする（DB の TEXT 列・WebSocket のテキストフレーム向け）。
+    標準の json 向けの引数（separators / ensure_ascii など）は受け付けるが無視する
+    """
+    if _orjson is not None:
+        return dumps_bytes(obj, default=default, sort_keys=sort_keys, indent=indent).decode("utf-8")
+    return _stdlib_dumps(obj, default, sort_keys, indent)
+
+
+def loads(s, **_stdlib_kwargs) -> Any:
+    """str / bytes / bytearray / memoryview を読む。不正な JSON は JSONDecodeError（ValueError）"""
+    if _orjson is not None:
+        return _orjson.loads(s)
+    if isinstance(s, memoryview):
+        s = s.tobytes()
+    return _stdlib.loads(s)
+
+
+def info() -> dict:
+    out = {"backend": backend}
+    if _orjson is not None:
+        out["version"] = getattr(_orjson, "__version__", None)
+    return out
+
+
+# ============================================================
+# Flask の JSON provider（jsonify / request.get_json をこの codec で処理する）
+# ============================================================
+def flask_provider_class():
+    """DefaultJSONProvider の設定（sort_keys / compact / default）はそのまま効かせる"""
+    from flask.json.provider import DefaultJSONProvider
+
+    class CodecJSONProvider(DefaultJSONProvider):
+        ensure_ascii = False
+
+        def dumps(self, obj: Any, **kwargs: Any) -> str:
+            return dumps(obj, default=kwargs.get("default", self.default),
+                         sort_keys=kwargs.get("sort_keys", self.sort_keys), indent=bool(kwargs.get("indent")))
+
+        def loads(self, s, **kwargs: Any) -> Any:
+            return loads(s)
+
+        def response(self, *args: Any, **kwargs: Any):
+            obj = self._prepare_response_obj(args, kwargs)
+            indent = self.compact is False or (self.compact is None and self._app.debug)
+            body = dumps_bytes(obj, default=self.default, sort_keys=self.sort_keys, indent=indent)
+            return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+
+    return CodecJSONProvider
@@ -0,0 +1,374 @@
+# profiling.py
+"""
+動いているワーカーをその場で調べるためのプロファイリング（API から呼ぶ。使っていないときは何もしない）。
+
+- CPU: ネイティブスレッドが interval ごとに sys._current_frames() を覗くサンプリング。
+  target を指定すると、スタックにその関数（Flask の view / Socket.IO のハンドラ）を含むサンプルだけ数える。
+  結果は flamegraph.pl / speedscope にそのまま渡せる collapsed 形式（"root;...;leaf 件数"）
+  ※ eventlet / gevent では、サンプル時点で動いている greenlet のスタックが見える（待機中の greenlet は数えない）
+- メモリ: tracemalloc を必要なときだけ start し、名前付きスナップショットと差分を取る。
+  差分は確保したときのスタックでサブシステム（store / relay / feedback / app ...）ごとに集計する。
+  加えて、登録したプローブ（client_states のおおよその保持サイズ、relay のバッファ量など）を返す
+- ダンプ: OS スレッドと greenlet（eventlet / gevent）のスタック
+
+サンプラーのスレッドも tracemalloc も、API で開始したときだけ動く（通常時のコストは 0）。
+"""
+from __future__ import annotations
+from collections import Counter, OrderedDict, deque
+from typing import Optional, Dict, Any, List, Callable, Iterable
+import fnmatch
+import gc
+import itertools
+import os
+import sys
+import time
+import traceback
+import types
+
+import concurrency
+
+# サブシステム → ファイル名のパターン（tracemalloc の差分の集計用）
+SUBSYSTEMS: Dict[str, tuple] = {
+    "store": ("*/session_store.py", "*/sqlite3/*", "*/json_codec.py"),
+    "relay": ("*/event_dispatch.py", "*/audio_transport.py", "*/audio_vad.py", "*/realtime_replay.py",
+              "*/websocket/*"),
+    "feedback": ("*/feedback_*.py", "*/rolling_feedback.py", "*/heuristic_scorer.py", "*/transcript_compactor.py",
+                 "*/upstream_admission.py"),
+    "socketio": ("*/socketio/*", "*/engineio/*", "*/flask_socketio/*", "*/emit_bus.py"),
+    "web": ("*/flask/*", "*/werkzeug/*", "*/jinja2/*", "*/asset_delivery.py"),
+    "app": ("*/test_OpenAI_WebUI.py",),  # client_states・ルート・中継のハンドラ本体
+}
+MAX_RESULTS = 5
+MAX_SNAPSHOTS = 8
+
+
+class ProfilerBusy(Exception):
+    """CPU プロファイルが既に実行中"""
+
+
+def _frame_label(code: types.CodeType) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_names() -> Dict[int, str]:
+    names = {}
+    for mod in (concurrency.original("threading"), sys.modules.get("threading")):
+        try:
+            for t in mod.enumerate():
+                if t.ident is not None:
+                    names.setdefault(t.ident, t.name)
+        except Exception:
+            pass
+    return names
+
+
+def _format_stack(frame) -> List[str]:
+    return [line.rstrip("\n") for line in traceback.format_stack(frame)]
+
+
+def subsystem_of(filename: str) -> str:
+    for name, patterns in SUBSYSTEMS.items():
+        if any(fnmatch.fnmatch(filename, p) for p in patterns):
+            return name
+    return "other"
+
+
+def attribute(tb) -> tuple:
+    """
+    tracemalloc の Traceback → (サブシステム, 代表フレーム)。
+    確保した場所に近い側から見て、最初にサブシステムに当てはまるフレーム（標準ライブラリの中で確保されても呼び出し元で数える）
+    """
+    frames = list(tb)
+    for frame in reversed(frames):
+        sub = subsystem_of(frame.filename)
+        if sub != "other":
+            return sub, frame
+    return "other", frames[-1]
+
+
+def deep_sizeof(obj: Any, max_objects: int = 200000) -> Dict[str, Any]:
+    """
+    obj からたどれるコンテナ・インスタンスの sys.getsizeof の合計（おおよその保持サイズ）。
+    モジュール・クラス・関数・スレッドの先はたどらない。max_objects で打ち切る
+    """
+    seen = set()
+    stack = [obj]
+    total = n = 0
+    skip = (types.ModuleType, type, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+            types.FrameType, types.CodeType)
+    while stack and n < max_objects:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, skip):
+            continue
+        seen.add(id(o))
+        n += 1
+        try:
+            total += sys.getsizeof(o)
+        except TypeError:
+            continue
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, deque)):
+            stack.extend(o)
+        elif isinstance(o, (str, bytes, bytearray, int, float, bool)) or o is None:
+            continue
+        else:
+            d = getattr(o, "__dict__", None)
+            if isinstance(d, dict):
+                stack.append(d)
+            for slot in getattr(type(o), "__slots__", ()):
+                if isinstance(slot, str) and hasattr(o, slot):
+                    stack.append(getattr(o, slot))
+    return {"bytes": total, "objects": n, "truncated": bool(stack)}
+
+
+class _CPUJob:
+    def __init__(self, job_id: int, seconds: float, interval: float, target: Optional[str],
+                 codes: Optional[frozenset]):
+        self.id = job_id
+        self.seconds = seconds
+        self.interval = interval
+        self.target = target
+        self.codes = codes
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.ticks = 0
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self.error: Optional[str] = None
+
+    def run(self) -> None:
+        own = concurrency.original("threading").get_ident()
+        sleep = concurrency.original("time").sleep
+        end = time.perf_counter() + self.seconds
+        names = _thread_names()
+        try:
+            while time.perf_counter() < end:
+                self.ticks += 1
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    stack = []
+                    matched = self.codes is None
+                    f = frame
+                    while f is not None:
+                        stack.append(f.f_code)
+                        if not matched and f.f_code in self.codes:
+                            matched = True
+                        f = f.f_back
+                    if not matched:
+                        continue
+                    if ident not in names:
+                        names = _thread_names()
+                    root = names.get(ident, f"thread-{ident}")
+                    self.stacks[";".join([root] + [_frame_label(c) for c in reversed(stack)])] += 1
+                    self.samples += 1
+                sleep(self.interval)
+        except Exception as e:  # 計測側の不具合でワーカーを落とさない
+            self.error = repr(e)
+        finally:
+            self.finished_at = time.time()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+    def summary(self, top: int = 20) -> Dict[str, Any]:
+        leaf = Counter()
+        for stack, n in self.stacks.items():
+            leaf[stack.rsplit(";", 1)[-1]] += n
+        return {
+            "id": self.id,
+            "target": self.target,
+            "seconds": self.seconds,
+            "interval_ms": round(self.interval * 1000, 3),
+            "running": self.finished_at is None,
+            "started_at": int(self.started_at),
+            "ticks": self.ticks,
+            "samples": self.samples,
+            "distinct_stacks": len(self.stacks),
+            "top_leaf_frames": [{"frame": k, "samples": v} for k, v in leaf.most_common(top)],
+            "error": self.error,
+        }
+
+
+class Profiler:
+    def __init__(self, max_seconds: float = 60.0, min_interval_ms: float = 1.0):
+        self.max_seconds = float(max_seconds)
+        self.min_interval = float(min_interval_ms) / 1000.0
+        self._lock = concurrency.original("threading").Lock()
+        self._ids = itertools.count(1)
+        self._cpu: "OrderedDict[int, _CPUJob]" = OrderedDict()
+        self._running: Optional[_CPUJob] = None
+        self._snapshots: "OrderedDict[str, Any]" = OrderedDict()
+        self._probes: Dict[str, Callable[[], Any]] = {}
+
+    # ---- CPU ----
+    def start_cpu(self, seconds: float, interval_ms: float = 5.0, target: Optional[str] = None,
+                  functions: Iterable[Callable] = ()) -> Dict[str, Any]:
+        """
+        seconds 秒のサンプリングをネイティブスレッドで開始する（結果は cpu_job(id)）。
+        functions を渡すと、それらのどれかがスタックにあるサンプルだけ数える（デコレータは外して比較）
+        """
+        import inspect
+        seconds = max(0.1, min(float(seconds), self.max_seconds))
+        interval = max(self.min_interval, float(interval_ms) / 1000.0)
+        fns = [inspect.unwrap(fn) for fn in functions]
+        codes = frozenset(fn.__code__ for fn in fns if hasattr(fn, "__code__")) or None
+        if fns and codes is None:
+            raise ValueError("target has no Python code object")
+        with self._lock:
+            if self._running is not None and self._running.finished_at is None:
+                raise ProfilerBusy(f"cpu profile {self._running.id} is running")
+            job = _CPUJob(next(self._ids), seconds, interval, target, codes)
+            self._running = job
+            self._cpu[job.id] = job
+            while len(self._cpu) > MAX_RESULTS:
+                self._cpu.popitem(last=False)
+        t = concurrency.original("threading").Thread(target=job.run, name="profiler-cpu", daemon=True)
+        t.start()
+        return job.summary()
+
+    def cpu_job(self, job_id: int) -> Optional[_CPUJob]:
+        with self._lock:
+            return self._cpu.get(job_id)
+
+    def cpu_jobs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            jobs = list(self._cpu.values())
+        return [j.summary(top=5) for j in jobs]
+
+    # ---- メモリ ----
+    def register_probe(self, name: str, fn: Callable[[], Any]) -> None:
+        """memory() で返す値（dict などをそのまま JSON にする）"""
+        self._probes[name] = fn
+
+    def tracemalloc_start(self, frames: int = 10) -> Dict[str, Any]:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(max(1, int(frames)))
+        return self.tracemalloc_status()
+
+    def tracemalloc_stop(self) -> Dict[str, Any]:
+        import tracemalloc
+        with self._lock:
+            self._snapshots.clear()
+        tracemalloc.stop()
+        return self.tracemalloc_status()
+
+    def tracemalloc_status(self) -> Dict[str, Any]:
+        import tracemalloc
+        out: Dict[str, Any] = {"tracing": tracemalloc.is_tracing()}
+        if out["tracing"]:
+            current, peak = tracemalloc.get_traced_memory()
+            out.update(current_bytes=current, peak_bytes=peak, frames=tracemalloc.get_traceback_limit(),
+                       overhead_bytes=tracemalloc.get_tracemalloc_memory())
+        with self._lock:
+            out["snapshots"] = list(self._snapshots)
+        return out
+
+    def snapshot(self, name: Optional[str] = None, top: int = 20) -> Dict[str, Any]:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running (start it first)")
+        snap = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+        name = name or f"snap-{int(time.time())}"
+        with self._lock:
+            self._snapshots[name] = snap
+            self._snapshots.move_to_end(name)
+            while len(self._snapshots) > MAX_SNAPSHOTS:
+                self._snapshots.popitem(last=False)
+        return {"name": name, **self._summarize(snap.statistics("traceback"), top)}
+
+    def diff(self, base: str, current: Optional[str] = None, top: int = 20) -> Dict[str, Any]:
+        """base → current（省略時は今のスナップショットを取って比較）の増減をサブシステムごとに"""
+        with self._lock:
+            old = self._snapshots.get(base)
+            new = self._snapshots.get(current) if current else None
+        if old is None or (current and new is None):
+            raise KeyError(current if old is not None else base)
+        if new is None:
+            current = self.snapshot()["name"]
+            with self._lock:
+                new = self._snapshots[current]
+        by_sub: Dict[str, Dict[str, int]] = {}
+        by_line: Dict[tuple, Dict[str, Any]] = {}
+        for st in new.compare_to(old, "traceback"):
+            sub, frame = attribute(st.traceback)
+            agg = by_sub.setdefault(sub, {"size_diff": 0, "count_diff": 0, "size": 0})
+            line = by_line.setdefault((frame.filename, frame.lineno), {
+                "where": f"{frame.filename}:{frame.lineno}", "subsystem": sub,
+                "size_diff": 0, "count_diff": 0, "size": 0})
+            for d in (agg, line):
+                d["size_diff"] += st.size_diff
+                d["count_diff"] += st.count_diff
+                d["size"] += st.size
+        return {
+            "base": base,
+            "current": current,
+            "subsystems": dict(sorted(by_sub.items(), key=lambda kv: -kv[1]["size_diff"])),
+            "top_growth": sorted(by_line.values(), key=lambda d: d["size_diff"], reverse=True)[:top],
+        }
+
+    @staticmethod
+    def _summarize(stats, top: int) -> Dict[str, Any]:
+        by_sub: Dict[str, int] = {}
+        by_line: Dict[tuple, Dict[str, Any]] = {}
+        for st in stats:
+            sub, frame = attribute(st.traceback)
+            by_sub[sub] = by_sub.get(sub, 0) + st.size
+            line = by_line.setdefault((frame.filename, frame.lineno), {
+                "where": f"{frame.filename}:{frame.lineno}", "subsystem": sub, "size": 0, "count": 0})
+            line["size"] += st.size
+            line["count"] += st.count
+        return {
+            "total_bytes": sum(st.size for st in stats),
+            "subsystems": dict(sorted(by_sub.items(), key=lambda kv: -kv[1])),
+            "top": sorted(by_line.values(), key=lambda d: d["size"], reverse=True)[:top],
+        }
+
+    def memory(self) -> Dict[str, Any]:
+        """登録したプローブの値と GC の状態（tracemalloc なしで取れるもの）"""
+        probes = {}
+        for name, fn in list(self._probes.items()):
+            try:
+                probes[name] = fn()
+            except Exception as e:
+                probes[name] = {"error": repr(e)}
+        return {"probes": probes, "gc_counts": gc.get_count(), "gc_objects": len(gc.get_objects()),
+                "tracemalloc": self.tracemalloc_status()}
+
+    # ---- ダンプ ----
+    @staticmethod
+    def dump_threads() -> List[Dict[str, Any]]:
+        names = _thread_names()
+        return [{"ident": ident, "name": names.get(ident, f"thread-{ident}"), "stack": _format_stack(frame)}
+                for ident, frame in sys._current_frames().items()]
+
+    @staticmethod
+    def dump_greenlets(limit: int = 500) -> Dict[str, Any]:
+        """中断中の greenlet（eventlet / gevent の green スレッド）のスタック"""
+        try:
+            import greenlet
+        except ImportError:
+            return {"available": False, "greenlets": []}
+        out = []
+        total = 0
+        for obj in gc.get_objects():
+            if not isinstance(obj, greenlet.greenlet) or obj.dead:
+                continue
+            total += 1
+            if len(out) >= limit:
+                continue
+            frame = obj.gr_frame
+            out.append({
+                "id": id(obj),
+                "type": type(obj).__name__,
+                "running": frame is None and bool(obj),
+                "stack": _format_stack(frame) if frame is not None else [],
+            })
+        return {"available": True, "total": total, "greenlets": out}
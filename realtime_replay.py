@@ -0,0 +1,305 @@
+# realtime_replay.py
+"""
+OpenAI Realtime の受信フレーム（LEGACY WebSocket 経路）を記録して、オフラインで再生する。
+
+記録（アプリ側）:
+  REALTIME_RECORD_DIR=recordings python test_OpenAI_WebUI.py
+  → recordings/<session_id or sid>-<unix秒>.rec.gz に1接続1ファイル
+    REALTIME_RECORD_AUDIO=0 で response.audio.delta の音声本体を省く（サイズ削減。再生時の負荷は軽くなる）
+
+ファイル形式（gzip テキスト）:
+  1行目: {"format": "realtime-rec", "version": 1, ...} ヘッダ
+  2行目以降: "<接続からの経過ms>\\t<受信したJSON（1行）>"
+
+再生:
+  python realtime_replay.py synth demo.rec.gz --turns 20              # 合成の記録を作る
+  python realtime_replay.py info demo.rec.gz
+  python realtime_replay.py replay demo.rec.gz --clients 50 --speed 10  # アプリの on_message に流す
+  python fake_realtime_server.py --recording demo.rec.gz               # WebSocket で配信（OPENAI_REALTIME_URL）
+"""
+from __future__ import annotations
+from typing import Optional, Dict, Any, List, Tuple, Callable, Iterator
+import base64
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+
+REC_FORMAT = "realtime-rec"
+REC_VERSION = 1
+
+Frame = Tuple[float, str]  # (接続からの経過秒, 受信した生メッセージ)
+
+
+class RealtimeRecorder:
+    """1接続分の受信フレームを記録する（書き込みは on_message のスレッドからのみ）"""
+    def __init__(self, path: str, include_audio: bool = True, meta: Optional[Dict[str, Any]] = None):
+        self.path = path
+        self.include_audio = include_audio
+        self._t0 = time.monotonic()
+        self._f = gzip.open(path, "wt", encoding="utf-8", compresslevel=5)
+        header = {"format": REC_FORMAT, "version": REC_VERSION, "started_at": time.time(),
+                  "include_audio": include_audio}
+        header.update(meta or {})
+        self._f.write(json.dumps(header, ensure_ascii=False) + "\n")
+        self._lock = threading.Lock()
+        self.frames = 0
+
+    @classmethod
+    def for_connection(cls, directory: str, name: str, include_audio: bool = True,
+                       meta: Optional[Dict[str, Any]] = None) -> "RealtimeRecorder":
+        os.makedirs(directory, exist_ok=True)
+        safe = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in name) or "conn"
+        return cls(os.path.join(directory, f"{safe}-{int(time.time())}.rec.gz"), include_audio, meta)
+
+    def record(self, message: Any) -> None:
+        if isinstance(message, (bytes, bytearray)):
+            message = message.decode("utf-8", "replace")
+        if not self.include_audio and '"response.audio.delta"' in message:
+            try:
+                data = json.loads(message)
+                delta = data.get("delta") or ""
+                data["delta"] = ""
+                data["delta_len"] = len(delta)
+                message = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+            except Exception:
+                pass
+        if "\n" in message:
+            # 1フレーム1行にする（整形されたJSONが来た場合のみ）
+            try:
+                message = json.dumps(json.loads(message), ensure_ascii=False, separators=(",", ":"))
+            except Exception:
+                message = message.replace("\n", " ")
+        ms = int((time.monotonic() - self._t0) * 1000)
+        with self._lock:
+            if self._f is None:
+                return
+            self._f.write(f"{ms}\t{message}\n")
+            self.frames += 1
+
+    def close(self) -> None:
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+
+def iter_recording(path: str) -> Iterator[Frame]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("format") != REC_FORMAT:
+            raise ValueError(f"not a realtime recording: {path}")
+        for line in f:
+            ms, sep, message = line.rstrip("\n").partition("\t")
+            if sep:
+                yield int(ms) / 1000.0, message
+
+
+def load_recording(path: str) -> List[Frame]:
+    return list(iter_recording(path))
+
+
+def synthesize(turns: int = 10, ai_sec: float = 3.0, user_gap_sec: float = 4.0,
+               deltas_per_sec: int = 10, with_audio: bool = True) -> List[Frame]:
+    """ネットワーク無しで試すための合成記録（ユーザー発話 → AI 音声応答 × turns）"""
+    frames: List[Frame] = []
+    t = 0.5
+    pcm_chunk = base64.b64encode(bytes(24000 * 2 // deltas_per_sec)).decode("ascii") if with_audio else ""
+
+    def add(dt, obj):
+        nonlocal t
+        t += dt
+        frames.append((round(t, 3), json.dumps(obj, ensure_ascii=False, separators=(",", ":"))))
+
+    add(0, {"type": "session.created"})
+    add(0.05, {"type": "session.updated"})
+    for i in range(turns):
+        add(user_gap_sec, {"type": "input_audio_buffer.speech_started"})
+        add(1.0, {"type": "input_audio_buffer.speech_stopped"})
+        add(0.05, {"type": "input_audio_buffer.committed", "item_id": f"u{i}"})
+        add(0.3, {"type": "conversation.item.input_audio_transcription.completed", "item_id": f"u{i}",
+                  "transcript": f"結論から言うと、案件{i}は予定どおり進んでいます。"})
+        add(0.1, {"type": "response.created", "response": {"id": f"r{i}"}})
+        n = max(1, int(ai_sec * deltas_per_sec))
+        for k in range(n):
+            add(1.0 / deltas_per_sec, {"type": "response.audio_transcript.delta", "response_id": f"r{i}", "delta": "なるほど、"})
+            if with_audio:
+                add(0, {"type": "response.audio.delta", "response_id": f"r{i}", "delta": pcm_chunk})
+        add(0.02, {"type": "response.audio.done", "response_id": f"r{i}"})
+        add(0.01, {"type": "response.audio_transcript.done", "response_id": f"r{i}", "transcript": "なるほど、" * n})
+        add(0.01, {"type": "response.done", "response": {"id": f"r{i}"}})
+    return frames
+
+
+def write_recording(path: str, frames: List[Frame], meta: Optional[Dict[str, Any]] = None) -> None:
+    header = {"format": REC_FORMAT, "version": REC_VERSION, "started_at": time.time()}
+    header.update(meta or {})
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=5) as f:
+        f.write(json.dumps(header, ensure_ascii=False) + "\n")
+        for t, message in frames:
+            f.write(f"{int(t * 1000)}\t{message}\n")
+
+
+def _percentile(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * (len(sorted_vals) - 1) + 0.5))]
+
+
+class ReplayEngine:
+    """
+    記録を複数の仮想クライアントで handler(ws, message, sid) に流す。
+    open_client(sid) -> ws（send() を持つもの） / close_client(sid) は接続の開始・終了時に呼ばれる。
+    speed: 1.0=実時間, 10=10倍速, 0=待ち無し（最大スループット）
+    """
+    def __init__(self, handler: Callable[[Any, str, str], Any], open_client: Callable[[str], Any],
+                 close_client: Optional[Callable[[str], Any]] = None, speed: float = 1.0):
+        self.handler = handler
+        self.open_client = open_client
+        self.close_client = close_client
+        self.speed = float(speed)
+
+    def _run_client(self, sid: str, frames: List[Frame], start_at: float, out: Dict[str, Any]) -> None:
+        ws = self.open_client(sid)
+        lat: List[float] = []
+        lag: List[float] = []
+        errors = 0
+        try:
+            for t, message in frames:
+                if self.speed > 0:
+                    due = start_at + t / self.speed
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    lag.append(max(0.0, time.monotonic() - due))
+                t0 = time.perf_counter()
+                try:
+                    self.handler(ws, message, sid)
+                except Exception:
+                    errors += 1
+                lat.append(time.perf_counter() - t0)
+        finally:
+            if self.close_client:
+                self.close_client(sid)
+        out[sid] = {"lat": lat, "lag": lag, "errors": errors}
+
+    def run(self, frames: List[Frame], clients: int = 1, stagger_sec: float = 0.0,
+            trace_memory: bool = False) -> Dict[str, Any]:
+        if trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+        results: Dict[str, Any] = {}
+        threads = []
+        started = time.monotonic()
+        for i in range(max(1, int(clients))):
+            sid = f"replay-{i}"
+            th = threading.Thread(target=self._run_client,
+                                  args=(sid, frames, started + i * stagger_sec, results), daemon=True)
+            threads.append(th)
+            th.start()
+        for th in threads:
+            th.join()
+        wall = time.monotonic() - started
+
+        lat = sorted(x for r in results.values() for x in r["lat"])
+        lag = sorted(x for r in results.values() for x in r["lag"])
+        out: Dict[str, Any] = {
+            "clients": len(results),
+            "events": len(lat),
+            "errors": sum(r["errors"] for r in results.values()),
+            "speed": self.speed,
+            "wall_sec": round(wall, 3),
+            "events_per_sec": round(len(lat) / wall, 1) if wall > 0 else None,
+            "handler_ms_avg": round(sum(lat) / len(lat) * 1000, 3) if lat else 0.0,
+            "handler_ms_p50": round(_percentile(lat, 0.5) * 1000, 3),
+            "handler_ms_p99": round(_percentile(lat, 0.99) * 1000, 3),
+            "handler_ms_max": round((lat[-1] if lat else 0.0) * 1000, 3),
+            "lag_ms_p99": round(_percentile(lag, 0.99) * 1000, 3),
+        }
+        if trace_memory:
+            import tracemalloc
+            out["tracemalloc_peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+        try:
+            import resource
+            out["maxrss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        except Exception:
+            pass
+        return out
+
+
+class _CaptureWS:
+    """リレーが OpenAI へ送り返すメッセージ（response.create 等）を数えるだけの ws"""
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, message) -> None:
+        self.sent += 1
+
+
+def replay_into_app(frames: List[Frame], clients: int, speed: float, stagger_sec: float = 0.0,
+                    trace_memory: bool = False) -> Dict[str, Any]:
+    """test_OpenAI_WebUI の on_message にそのまま流す（emit は接続の無い room 宛てになる）"""
+    import test_OpenAI_WebUI as appmod
+
+    sockets: Dict[str, _CaptureWS] = {}
+
+    def open_client(sid):
+        appmod.init_client_state(sid)
+        ws = sockets[sid] = _CaptureWS()
+        return ws
+
+    engine = ReplayEngine(appmod.on_message, open_client, appmod.cleanup_client_state, speed)
+    out = engine.run(frames, clients, stagger_sec, trace_memory)
+    out["relay_sends"] = sum(ws.sent for ws in sockets.values())
+    return out
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Realtime 受信フレームの記録・再生")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("synth", help="合成の記録を作る")
+    p.add_argument("path")
+    p.add_argument("--turns", type=int, default=10)
+    p.add_argument("--no-audio", action="store_true")
+    p = sub.add_parser("info", help="記録の概要")
+    p.add_argument("path")
+    p = sub.add_parser("replay", help="アプリの on_message に流す")
+    p.add_argument("path")
+    p.add_argument("--clients", type=int, default=1)
+    p.add_argument("--speed", type=float, default=0, help="1=実時間, 10=10倍速, 0=待ち無し")
+    p.add_argument("--stagger-sec", type=float, default=0.0)
+    p.add_argument("--trace-memory", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "synth":
+        frames = synthesize(args.turns, with_audio=not args.no_audio)
+        write_recording(args.path, frames, {"synthetic": True})
+        print(json.dumps({"frames": len(frames), "duration_sec": frames[-1][0] if frames else 0,
+                          "bytes": os.path.getsize(args.path)}, ensure_ascii=False))
+        return 0
+
+    frames = load_recording(args.path)
+    if args.cmd == "info":
+        types: Dict[str, int] = {}
+        for _, m in frames:
+            try:
+                ty = json.loads(m).get("type")
+            except Exception:
+                ty = "(invalid)"
+            types[ty] = types.get(ty, 0) + 1
+        print(json.dumps({"frames": len(frames), "duration_sec": frames[-1][0] if frames else 0,
+                          "types": dict(sorted(types.items(), key=lambda kv: -kv[1]))}, ensure_ascii=False))
+        return 0
+
+    out = replay_into_app(frames, args.clients, args.speed, args.stagger_sec, args.trace_memory)
+    print(json.dumps(out, ensure_ascii=False))
+    return 0 if out["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
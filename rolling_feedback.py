@@ -0,0 +1,350 @@
+# rolling_feedback.py
+"""
+セッション中にターン（ユーザー発言 → AI応答）ごとに小さく分析しておき、
+終了時は「分析メモ + 未分析の末尾ターン」だけで最終フィードバックを作る（FEEDBACK_ROLLING=1 で有効）。
+
+- ターンは POST /api/session/<id>/turns（WebRTC経路）か、LEGACY WebSocket の中継から追加される
+- 1セッションにつき分析は同時に1本。分析中に来たターンは次の分析にまとめる
+- 最終呼び出しの入力は会話の長さにほぼ依存しない（メモは件数上限つき、未分析の末尾ターンは
+  FEEDBACK_PROMPT_TOKEN_BUDGET からメモ分を引いた予算に transcript_compactor で収める）
+- 1回のターン分析は MAX_CHUNK_TURNS ターンまで（分析に失敗して溜まった分も古い順に分けて分析する）
+- 保存された transcript と分析済みのターンが食い違う場合は None を返し、呼び出し側は全文生成にフォールバックする
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Callable
+import json
+import os
+import threading
+import time
+
+import feedback_generator as fg
+from transcript_compactor import compact_lines, estimate_tokens, token_budget_from_env
+
+MAX_NOTES = 24          # 最終呼び出しに渡すメモの最大件数（古いものから間引く）
+NOTE_CONTEXT_NOTES = 3  # ターン分析に渡す直前のメモ件数
+MAX_CHUNK_TURNS = 8     # 1回のターン分析に入れる最大ターン数
+MIN_TAIL_TOKENS = 256   # メモで予算を使い切っても末尾ターンに残す最低限のトークン数
+TEXT_CLIP = 400
+
+
+def _clip(s: str, n: int = TEXT_CLIP) -> str:
+    s = (s or "").strip()
+    return s if len(s) <= n else s[:n] + "…"
+
+
+def _line(turn: Dict[str, Any]) -> str:
+    role = turn.get("role")
+    name = "ユーザー" if role == "user" else ("AI" if role == "assistant" else role)
+    return f"{name}: {_clip(turn.get('text'))}"
+
+
+def _valid_turns(turns) -> List[Dict[str, Any]]:
+    out = []
+    for t in turns or []:
+        if not isinstance(t, dict):
+            continue
+        role = (t.get("role") or "").strip()
+        text = (t.get("text") or "").strip()
+        if role and text:
+            out.append({"role": role, "text": text, "ts": t.get("ts")})
+    return out
+
+
+def build_turn_request(meta, recent_notes: List[Dict[str, Any]], lines: List[str],
+                       model: Optional[str] = None) -> Dict[str, Any]:
+    """直近のターンだけを分析する小さな payload"""
+    model = model or os.environ.get("FEEDBACK_TURN_MODEL") or os.environ.get("FEEDBACK_MODEL") or "gpt-4o-mini"
+    context = "\n".join(f"- {n.get('moment', '')}" for n in recent_notes if n.get("moment")) or "（なし）"
+    user = (
+        f"シナリオ: {fg._meta_attr(meta, 'title')}\n"
+        f"これまでの局面メモ:\n{context}\n\n"
+        "次の直近のやり取りだけを見て、ユーザーの発言について次のJSONで返してください。\n"
+        "{\n"
+        "  \"moment\": \"局面の要約（1文）\",\n"
+        "  \"good\": \"良かった点（無ければ空文字）\",\n"
+        "  \"improvement\": \"改善点（次にすぐ実行できる具体行動。無ければ空文字）\",\n"
+        "  \"better_question\": \"ここで確認すべきだった質問（無ければ空文字）\",\n"
+        "  \"score\": 0\n"
+        "}\n\n"
+        "やり取り:\n" + "\n".join(lines)
+    )
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": "あなたは会話練習のコーチです。日本語で、ごく短く答えてください。"},
+            {"role": "user", "content": user},
+        ],
+        "temperature": 0.2,
+    }
+
+
+def build_final_request(meta, notes: List[Dict[str, Any]], tail_lines: List[str], turns_total: int,
+                        model: Optional[str] = None) -> Dict[str, Any]:
+    """分析メモから最終フィードバックを作る payload（出力形式は feedback_generator と同じ）"""
+    model = model or os.environ.get("FEEDBACK_MODEL") or "gpt-4o-mini"
+    note_lines = []
+    for i, n in enumerate(notes, 1):
+        parts = [f"{i}. {n.get('moment', '')}"]
+        for key, label in (("good", "良"), ("improvement", "改善"), ("better_question", "質問")):
+            if n.get(key):
+                parts.append(f"[{label}] {n[key]}")
+        if isinstance(n.get("score"), int):
+            parts.append(f"[点] {n['score']}")
+        note_lines.append(" ".join(parts))
+    user = (
+        f"シナリオ: {fg._meta_attr(meta, 'title')}\n"
+        f"追加指示: {fg._meta_attr(meta, 'instructions')}\n\n"
+        f"全{turns_total}ターンの会話を、ターンごとの分析メモ（時系列）と未分析の末尾ターンから総合評価してください。\n"
+        "次のJSON形式で返してください。\n"
+        "{\n"
+        "  \"summary\": \"会話の要約（2〜4行）\",\n"
+        "  \"score\": 0,\n"
+        "  \"good_points\": [\"良かった点（最大3）\"],\n"
+        "  \"improvements\": [\"改善点（最大3）\"],\n"
+        "  \"better_questions\": [\"次に確認すべき質問（最大3）\"],\n"
+        "  \"key_moments\": [\"【局面】…\\n【改善】…\\n【模範（ユーザー）】…（2〜5個）\"],\n"
+        "  \"model_answer\": \"模範会話例（2〜4往復）\",\n"
+        "  \"alt_phrasings\": [\"言い換え例（柔らかめ）\", \"言い換え例（端的）\"],\n"
+        "  \"next_actions\": [\"次回の練習でやること（最大3）\"],\n"
+        "  \"next_drill\": \"次の1本ノック\"\n"
+        "}\n\n"
+        "分析メモ:\n" + ("\n".join(note_lines) or "（なし）") + "\n\n"
+        "未分析の末尾ターン:\n" + ("\n".join(tail_lines) or "（なし）")
+    )
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": (
+                "あなたは会話練習のコーチです。日本語で、短く具体的にフィードバックしてください。"
+                "相手を傷つけないトーンで、改善点は行動に落とせる形で提案してください。"
+            )},
+            {"role": "user", "content": user},
+        ],
+        "temperature": 0.2,
+    }
+
+
+class _RollingState:
+    __slots__ = ("meta", "turns", "analyzed", "notes", "running", "idle", "touched_at", "turn_calls", "turn_ms")
+
+    def __init__(self, meta):
+        self.meta = meta
+        self.turns: List[Dict[str, Any]] = []
+        self.analyzed = 0          # 分析済みのターン数（turns の先頭から）
+        self.notes: List[Dict[str, Any]] = []
+        self.running = False
+        self.idle = threading.Event()
+        self.idle.set()
+        self.touched_at = time.time()
+        self.turn_calls = 0
+        self.turn_ms = 0
+
+
+class RollingFeedbackAnalyzer:
+    """
+    spawn(fn, *args)  -> バックグラウンド実行（app では socketio.start_background_task）
+    post(payload)     -> chat/completions の応答 dict（既定は feedback_generator.post_chat_completions）
+    final_post        -> 最終呼び出し用（省略時は post と同じ）
+    """
+    def __init__(self, spawn: Callable[..., Any], post: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+                 max_sessions: int = 1000, ttl_sec: float = 3 * 3600,
+                 final_post: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None):
+        self._spawn = spawn
+        self._post = post or self._default_post
+        self._final_post = final_post or self._post
+        self._max_sessions = max(1, int(max_sessions))
+        self._ttl_sec = float(ttl_sec)
+        self._states: "OrderedDict[str, _RollingState]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {
+            "turns": 0, "turn_calls": 0, "turn_failed": 0,
+            "finalized": 0, "fallback": 0, "evicted": 0,
+        }
+
+    @staticmethod
+    def _default_post(payload: Dict[str, Any]) -> Dict[str, Any]:
+        api_key = fg.get_api_key()
+        if not api_key:
+            raise RuntimeError("OPEN_AI_KEY (or OPENAI_API_KEY) が設定されていません")
+        return fg.post_chat_completions(payload, api_key)
+
+    # ---- state ----
+    def _state(self, session_id: str, meta=None, create: bool = False) -> Optional[_RollingState]:
+        with self._lock:
+            now = time.time()
+            st = self._states.get(session_id)
+            if st is not None:
+                self._states.move_to_end(session_id)
+            elif create:
+                st = self._states[session_id] = _RollingState(meta)
+            if st is not None:
+                st.touched_at = now
+                if meta is not None and st.meta is None:
+                    st.meta = meta
+            # 古いセッションを捨てる（先頭が最も古い）
+            while self._states:
+                sid, old = next(iter(self._states.items()))
+                if len(self._states) <= self._max_sessions and now - old.touched_at <= self._ttl_sec:
+                    break
+                if old is st:
+                    break
+                del self._states[sid]
+                self._stats["evicted"] += 1
+            return st
+
+    # ---- turns ----
+    def append_turns(self, session_id: str, meta, turns) -> int:
+        """ターンを追加し、完結したやり取り（ユーザー→AI）があれば分析を開始する。return: 累計ターン数"""
+        new = _valid_turns(turns)
+        st = self._state(session_id, meta, create=True)
+        with self._lock:
+            st.turns.extend(new)
+            self._stats["turns"] += len(new)
+            n = len(st.turns)
+            start = not st.running and self._pending_end(st) > st.analyzed
+            if start:
+                st.running = True
+                st.idle.clear()
+        if start:
+            self._spawn(self._drain, session_id, st)
+        return n
+
+    @staticmethod
+    def _pending_end(st: _RollingState) -> int:
+        # 最後の assistant ターンまでを分析対象にする（ユーザー発言だけでは局面が閉じていない）
+        for i in range(len(st.turns) - 1, st.analyzed - 1, -1):
+            if st.turns[i]["role"] == "assistant":
+                return i + 1
+        return st.analyzed
+
+    @staticmethod
+    def _chunk_end(st: _RollingState, begin: int, end: int) -> int:
+        """begin から MAX_CHUNK_TURNS ターン以内で、できるだけ assistant ターンで区切る"""
+        limit = min(end, begin + MAX_CHUNK_TURNS)
+        if limit == end:
+            return end
+        for i in range(limit - 1, begin, -1):
+            if st.turns[i]["role"] == "assistant":
+                return i + 1
+        return limit
+
+    def _drain(self, session_id: str, st: _RollingState) -> None:
+        try:
+            while True:
+                with self._lock:
+                    end = self._pending_end(st)
+                    begin = st.analyzed
+                    if end <= begin:
+                        st.running = False
+                        st.idle.set()
+                        return
+                    end = self._chunk_end(st, begin, end)
+                    chunk = st.turns[begin:end]
+                    recent = st.notes[-NOTE_CONTEXT_NOTES:]
+                note = self._analyze(st.meta, recent, chunk)
+                with self._lock:
+                    st.turn_calls += 1
+                    if not note:
+                        # 失敗したターンは未分析のまま残す（次のターン追加でまとめて再分析、
+                        # それまでに終われば最終呼び出しの末尾ターンに入る）。すぐには再試行しない
+                        st.running = False
+                        st.idle.set()
+                        return
+                    st.analyzed = end
+                    st.turn_ms += note.get("ms", 0)
+                    st.notes.append(note)
+                    if len(st.notes) > MAX_NOTES:
+                        # 冒頭のメモは残し、中間から間引く
+                        del st.notes[1]
+        except Exception as e:
+            print(f"ターン分析エラー: {session_id}: {e}")
+            with self._lock:
+                st.running = False
+                st.idle.set()
+
+    def _analyze(self, meta, recent: List[Dict[str, Any]], chunk: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        started = time.monotonic()
+        try:
+            data = self._post(build_turn_request(meta, recent, [_line(t) for t in chunk]))
+            parsed = fg.parse_feedback_content(data)
+        except Exception as e:
+            parsed = {"error": str(e)}
+        elapsed_ms = int((time.monotonic() - started) * 1000)
+        with self._lock:
+            self._stats["turn_calls"] += 1
+            if parsed.get("error"):
+                self._stats["turn_failed"] += 1
+        if parsed.get("error"):
+            return None
+        note = {k: str(parsed.get(k) or "").strip() for k in ("moment", "good", "improvement", "better_question")}
+        try:
+            note["score"] = int(parsed.get("score"))
+        except Exception:
+            pass
+        note["ms"] = elapsed_ms
+        return note
+
+    # ---- final ----
+    def finalize(self, session_id: str, meta, transcript, wait_sec: float = 10) -> Optional[Dict[str, Any]]:
+        """
+        分析メモで最終フィードバックを生成する（feedback_generator.generate_feedback_with_openai と同じ形）。
+        状態が無い / transcript と食い違う場合は None（呼び出し側で全文生成）。
+        """
+        st = self._state(session_id)
+        saved = _valid_turns(transcript)
+        if st is None or not saved:
+            return None
+        # 進行中のターン分析を少しだけ待つ（待ちきれない分は末尾ターンとして最終呼び出しに入れる）
+        st.idle.wait(wait_sec)
+        with self._lock:
+            analyzed = st.analyzed
+            prefix = [(t["role"], t["text"]) for t in st.turns[:analyzed]]
+            notes = list(st.notes)
+        if not notes or [(t["role"], t["text"]) for t in saved[:analyzed]] != prefix:
+            with self._lock:
+                self._stats["fallback"] += 1
+            return None
+
+        # 未分析の末尾ターン（分析の失敗が続くと長くなる）は、予算からメモ等の分を引いた残りに収める
+        base = build_final_request(meta, notes, [], len(saved))
+        base_tokens = estimate_tokens(base["messages"][0]["content"] + base["messages"][1]["content"])
+        tail_budget = max(MIN_TAIL_TOKENS, token_budget_from_env() - base_tokens)
+        tail_lines, tail_metrics = compact_lines([_line(t) for t in saved[analyzed:]], budget=tail_budget)
+        payload = build_final_request(meta, notes, tail_lines, len(saved))
+        prompt = payload["messages"][0]["content"] + payload["messages"][1]["content"]
+        metrics: Dict[str, Any] = {
+            "rolling": True,
+            "turns_in": len(saved),
+            "turns_analyzed": analyzed,
+            "turns_tail": len(saved) - analyzed,
+            "notes": len(notes),
+            "turn_calls": st.turn_calls,
+            "turn_ms_total": st.turn_ms,
+            "tail": tail_metrics,
+            "prompt_tokens_est": estimate_tokens(prompt),
+        }
+        started = time.monotonic()
+        try:
+            data = self._final_post(payload)
+            result = fg.parse_feedback_content(data)
+            try:
+                metrics["usage"] = data.get("usage")
+            except Exception:
+                pass
+        except Exception as e:
+            result = {"error": f"フィードバック生成エラー: {e}"}
+            if isinstance(e, fg.RateLimitedError):
+                result.update(rate_limited=True, retry_after=e.retry_after)
+        metrics["latency_ms"] = int((time.monotonic() - started) * 1000)
+        print(f"feedback prompt metrics: {json.dumps(metrics, ensure_ascii=False)}")
+        with self._lock:
+            self._stats["finalized"] += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            out["sessions"] = len(self._states)
+            out["running"] = sum(1 for s in self._states.values() if s.running)
+        return out
@@ -0,0 +1,265 @@
+# scenario_index.py
+"""
+シナリオのおすすめ（「X に似たシナリオ」「この next_drill に合うシナリオ」）。
+
+- シナリオごとに focus / tags / shelf / title / default_instructions を重み付きで連結し、
+  文字 n-gram（2,3-gram。日本語は分かち書き不要）の TF-IDF ベクトルにする
+- 構築時に全シナリオ間の類似度行列を計算し、シナリオごとの上位候補を持っておく（similar は表引きだけ）
+- テキストからの検索はクエリを同じ n-gram に分解し、語彙にある列だけを使って全シナリオとの内積を取る
+- NumPy があれば行列演算、無ければ転置インデックスで同じ結果を返す
+- 同じテキストの再検索は LRU キャッシュから返す
+
+  python scenario_index.py "結論から先に報告する練習"
+  python scenario_index.py --similar report_to_boss
+  python scenario_index.py --bench
+"""
+from __future__ import annotations
+from collections import Counter, OrderedDict
+from typing import Optional, Dict, Any, List, Tuple, Iterable
+import math
+import threading
+import unicodedata
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy はオプション
+    np = None
+
+NGRAM_SIZES = (2, 3)
+# フィールドごとの重み（出現回数に掛ける）
+FIELD_WEIGHTS = (("focus", 3), ("tags", 2), ("shelf", 2), ("title", 2), ("default_instructions", 1))
+MAX_NEIGHBORS = 10
+
+
+def _segments(text: str) -> List[str]:
+    """NFKC・小文字化して、空白・記号で区切った断片にする"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    out, cur = [], []
+    for ch in text:
+        if unicodedata.category(ch)[0] in ("L", "N"):
+            cur.append(ch)
+        elif cur:
+            out.append("".join(cur))
+            cur = []
+    if cur:
+        out.append("".join(cur))
+    return out
+
+
+def char_ngrams(text: str, sizes: Tuple[int, ...] = NGRAM_SIZES) -> Counter:
+    """文字 n-gram の出現回数（1文字だけの断片はそのまま1語として数える）"""
+    grams: Counter = Counter()
+    for seg in _segments(text):
+        if len(seg) < min(sizes):
+            grams[seg] += 1
+            continue
+        for n in sizes:
+            for i in range(len(seg) - n + 1):
+                grams[seg[i:i + n]] += 1
+    return grams
+
+
+def _field_text(value: Any) -> str:
+    if isinstance(value, (list, tuple)):
+        return " ".join(str(v) for v in value)
+    return str(value or "")
+
+
+def scenario_terms(s: Dict[str, Any]) -> Counter:
+    terms: Counter = Counter()
+    for field, weight in FIELD_WEIGHTS:
+        for g, c in char_ngrams(_field_text(s.get(field))).items():
+            terms[g] += c * weight
+    return terms
+
+
+class ScenarioIndex:
+    def __init__(self, scenarios: List[Dict[str, Any]], vocab: Dict[str, int], idf: List[float],
+                 rows: List[Dict[int, float]], cache_size: int = 1024):
+        self.scenarios = scenarios
+        self.ids = [s.get("id") for s in scenarios]
+        self._pos = {sid: i for i, sid in enumerate(self.ids)}
+        self.vocab = vocab
+        self.idf = idf
+        self._rows = rows  # 正規化済みの疎ベクトル（term index -> weight）
+        self._postings: Dict[int, List[Tuple[int, float]]] = {}
+        for i, row in enumerate(rows):
+            for t, w in row.items():
+                self._postings.setdefault(t, []).append((i, w))
+        self._matrix = None
+        if np is not None and scenarios:
+            m = np.zeros((len(scenarios), len(vocab)), dtype=np.float32)
+            for i, row in enumerate(rows):
+                if row:
+                    m[i, list(row.keys())] = list(row.values())
+            self._matrix = m
+        self._neighbors = self._build_neighbors()
+        self._cache: "OrderedDict[Tuple, List[Tuple[int, float]]]" = OrderedDict()
+        self._cache_size = int(cache_size)
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"queries": 0, "cache_hits": 0}
+
+    @classmethod
+    def build(cls, scenarios: Iterable[Dict[str, Any]], **kwargs) -> "ScenarioIndex":
+        scenarios = [s for s in scenarios if isinstance(s, dict) and s.get("id")]
+        docs = [scenario_terms(s) for s in scenarios]
+        vocab: Dict[str, int] = {}
+        df: Counter = Counter()
+        for d in docs:
+            for g in d:
+                if g not in vocab:
+                    vocab[g] = len(vocab)
+                df[g] += 1
+        n = len(docs)
+        idf = [0.0] * len(vocab)
+        for g, i in vocab.items():
+            idf[i] = math.log((1 + n) / (1 + df[g])) + 1.0
+        rows = [cls._weigh({vocab[g]: c for g, c in d.items()}, idf) for d in docs]
+        return cls(scenarios, vocab, idf, rows, **kwargs)
+
+    @staticmethod
+    def _weigh(counts: Dict[int, float], idf: List[float]) -> Dict[int, float]:
+        """サブリニア tf × idf を L2 正規化"""
+        row = {t: (1.0 + math.log(c)) * idf[t] for t, c in counts.items() if c > 0}
+        norm = math.sqrt(sum(w * w for w in row.values()))
+        return {t: w / norm for t, w in row.items()} if norm else {}
+
+    def _build_neighbors(self) -> List[List[Tuple[int, float]]]:
+        n = len(self.scenarios)
+        if n == 0:
+            return []
+        k = min(MAX_NEIGHBORS, n - 1)
+        if self._matrix is not None:
+            sim = self._matrix @ self._matrix.T
+            np.fill_diagonal(sim, -1.0)
+            order = np.argsort(-sim, axis=1)[:, :k]
+            return [[(int(j), float(sim[i, j])) for j in order[i]] for i in range(n)]
+        out = []
+        for i, row in enumerate(self._rows):
+            scores: Dict[int, float] = {}
+            for t, w in row.items():
+                for j, wj in self._postings[t]:
+                    if j != i:
+                        scores[j] = scores.get(j, 0.0) + w * wj
+            out.append(sorted(scores.items(), key=lambda x: (-x[1], x[0]))[:k])
+        return out
+
+    # ---- query ----
+    def _query_vector(self, text: str) -> Dict[int, float]:
+        counts = {self.vocab[g]: c for g, c in char_ngrams(text).items() if g in self.vocab}
+        return self._weigh(counts, self.idf)
+
+    def _score_text(self, text: str) -> List[Tuple[int, float]]:
+        q = self._query_vector(text)
+        if not q:
+            return []
+        if self._matrix is not None:
+            cols = list(q.keys())
+            scores = self._matrix[:, cols] @ np.asarray(list(q.values()), dtype=np.float32)
+            order = np.argsort(-scores)
+            return [(int(i), float(scores[i])) for i in order if scores[i] > 0]
+        acc: Dict[int, float] = {}
+        for t, w in q.items():
+            for i, wi in self._postings[t]:
+                acc[i] = acc.get(i, 0.0) + w * wi
+        return sorted(acc.items(), key=lambda x: (-x[1], x[0]))
+
+    def _view(self, i: int, score: float) -> Dict[str, Any]:
+        s = self.scenarios[i]
+        return {"id": s.get("id"), "title": s.get("title") or s.get("id"), "mode": s.get("mode"),
+                "shelf": s.get("shelf"), "focus": list(s.get("focus") or []), "score": round(score, 4)}
+
+    @staticmethod
+    def _keep(s: Dict[str, Any], exclude: Optional[str], mode: Optional[str]) -> bool:
+        return s.get("id") != exclude and (not mode or s.get("mode") == mode)
+
+    def similar(self, scenario_id: str, k: int = 5, mode: Optional[str] = None) -> List[Dict[str, Any]]:
+        """scenario_id に似たシナリオ（構築時に計算済みの上位候補から）"""
+        i = self._pos.get(scenario_id)
+        if i is None:
+            return []
+        out = []
+        for j, score in self._neighbors[i]:
+            if score > 0 and self._keep(self.scenarios[j], None, mode):
+                out.append(self._view(j, score))
+                if len(out) >= k:
+                    break
+        return out
+
+    def recommend(self, text: str, k: int = 5, exclude: Optional[str] = None,
+                  mode: Optional[str] = None) -> List[Dict[str, Any]]:
+        """テキスト（next_drill や改善点）に合うシナリオ"""
+        key = " ".join(_segments(text))
+        with self._lock:
+            self.stats["queries"] += 1
+            ranked = self._cache.get(key)
+            if ranked is not None:
+                self._cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+        if ranked is None:
+            ranked = self._score_text(text)
+            with self._lock:
+                self._cache[key] = ranked
+                if len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        out = []
+        for i, score in ranked:
+            if self._keep(self.scenarios[i], exclude, mode):
+                out.append(self._view(i, score))
+                if len(out) >= k:
+                    break
+        return out
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        return {"scenarios": len(self.scenarios), "vocab": len(self.vocab),
+                "backend": "numpy" if self._matrix is not None else "python", **stats}
+
+
+def main(argv=None) -> int:
+    import argparse
+    import json
+    import time
+    from session_store import SCENARIOS
+
+    parser = argparse.ArgumentParser(description="シナリオのおすすめ（文字 n-gram TF-IDF）")
+    parser.add_argument("text", nargs="?", default=None)
+    parser.add_argument("--similar", default=None, help="このシナリオIDに似たもの")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--bench", action="store_true", help="構築時間と1クエリあたりの時間（µs）")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    index = ScenarioIndex.build(SCENARIOS)
+    build_ms = (time.perf_counter() - t0) * 1000
+    if args.bench:
+        texts = ["結論から先に30秒で報告する", "相手の懸念を確認してから提案する", "数字で根拠を示す"]
+        n = 2000
+        t0 = time.perf_counter()
+        for i in range(n):
+            index.similar(index.ids[i % len(index.ids)], args.k)
+        sim_us = (time.perf_counter() - t0) / n * 1e6
+        t0 = time.perf_counter()
+        for i in range(n):
+            index._score_text(texts[i % len(texts)])
+        text_us = (time.perf_counter() - t0) / n * 1e6
+        t0 = time.perf_counter()
+        for i in range(n):
+            index.recommend(texts[i % len(texts)], args.k)
+        cached_us = (time.perf_counter() - t0) / n * 1e6
+        print(json.dumps({**index.info(), "build_ms": round(build_ms, 2), "similar_us": round(sim_us, 1),
+                          "text_uncached_us": round(text_us, 1), "text_cached_us": round(cached_us, 1)},
+                         ensure_ascii=False))
+        return 0
+    if args.similar:
+        result = index.similar(args.similar, args.k)
+    else:
+        result = index.recommend(args.text or "", args.k)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
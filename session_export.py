@@ -0,0 +1,137 @@
+# session_export.py
+"""
+sessions / transcripts / feedback の NDJSON エクスポート・インポート。
+
+1行 = 1セッション:
+  {"session": {...}, "transcript": {...} | null, "feedback": {...} | null}
+
+使い方:
+  python session_export.py export backup.ndjson.gz
+  python session_export.py import backup.ndjson.gz
+（DBは SQLITE_PATH、未設定なら app.db。拡張子 .gz なら gzip 扱い）
+"""
+from __future__ import annotations
+from typing import Optional, Dict, Any, Iterable, Iterator, IO
+import gzip
+import os
+import sys
+import zlib
+
+import json_codec
+
+
+def iter_ndjson_lines(store, batch_size: int = 500) -> Iterator[str]:
+    """
+    store.iter_export_rows() を NDJSON 行（改行付き）に変換する。
+    保存済みJSON文字列はパースせずにそのまま埋め込む。
+    """
+    for meta, transcript_json, feedback_json in store.iter_export_rows(batch_size=batch_size):
+        yield (
+            '{"session":' + json_codec.dumps(meta)
+            + ',"transcript":' + (transcript_json or "null")
+            + ',"feedback":' + (feedback_json or "null")
+            + "}\n"
+        )
+
+
+def iter_gzip_chunks(lines: Iterable[str], flush_bytes: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    行を逐次 gzip 圧縮してチャンクで返す（HTTPストリーミング用）。
+    """
+    comp = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 で gzip ヘッダ付き
+    pending = 0
+    for line in lines:
+        data = line.encode("utf-8")
+        pending += len(data)
+        out = comp.compress(data)
+        if pending >= flush_bytes:
+            out += comp.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if out:
+            yield out
+    yield comp.flush()
+
+
+def _open(path: str, mode: str) -> IO[str]:
+    if path == "-":
+        return sys.stdout if "w" in mode else sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def export_to_file(store, path: str, batch_size: int = 500) -> int:
+    n = 0
+    f = _open(path, "w")
+    try:
+        for line in iter_ndjson_lines(store, batch_size=batch_size):
+            f.write(line)
+            n += 1
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    return n
+
+
+class RecordError(ValueError):
+    """NDJSON の line 行目（1始まり）が取り込める形になっていない"""
+    def __init__(self, line: int, message: str):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+def iter_records(f: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """1行ずつ読んで検証する（壊れた行は RecordError。ストアに渡す前に止まる）"""
+    from session_store import _SESSION_FIELDS
+
+    for line_no, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rec = json_codec.loads(line)
+        except Exception as e:
+            raise RecordError(line_no, f"invalid JSON: {e}") from e
+        if not isinstance(rec, dict) or not isinstance(rec.get("session"), dict):
+            raise RecordError(line_no, "\"session\" object is missing")
+        missing = [k for k in _SESSION_FIELDS if k not in rec["session"]]
+        if missing:
+            raise RecordError(line_no, f"session is missing {', '.join(missing)}")
+        yield rec
+
+
+def import_from_file(store, path: str, batch_size: int = 500) -> int:
+    f = _open(path, "r")
+    try:
+        return store.import_records(iter_records(f), batch_size=batch_size)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def main(argv: Optional[list] = None) -> int:
+    import argparse
+    from session_store import ImportAborted, SQLiteSessionStore
+
+    parser = argparse.ArgumentParser(description="app.db の NDJSON エクスポート/インポート")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="ファイルパス（.gz なら gzip、- なら標準入出力）")
+    parser.add_argument("--db", default=os.environ.get("SQLITE_PATH") or "app.db")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    store = SQLiteSessionStore(args.db)
+    if args.command == "export":
+        n = export_to_file(store, args.path, batch_size=args.batch_size)
+    else:
+        try:
+            n = import_from_file(store, args.path, batch_size=args.batch_size)
+        except ImportAborted as e:
+            print(f"import: failed after {e.imported} sessions: {e.cause}", file=sys.stderr)
+            return 1
+    print(f"{args.command}: {n} sessions", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
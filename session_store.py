@@ -1,13 +1,19 @@
 # session_store.py
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import Optional, Dict, Any, List, Tuple
+from dataclasses import dataclass, replace
+from typing import Optional, Dict, Any, List, Tuple, Iterable, Iterator
+from collections import OrderedDict
+import bisect
+from functools import wraps
 import time
 import threading
 from uuid import uuid4
 import os
 import json
 
+import concurrency
+import json_codec
+
 # ---- シナリオ定義（ここに集約） ----
 DEFAULT_SCENARIOS = [
     {
@@ -78,17 +84,285 @@ class SessionMeta:
     instructions: str
     created_at: int
 
+_SESSION_FIELDS = ("session_id", "scenario_id", "mode", "title", "instructions", "created_at")
+
+ExportRow = Tuple[Dict[str, Any], Optional[str], Optional[str]]
+
+
+class ImportAborted(Exception):
+    """
+    import_records が途中で失敗した。imported はそれまでに書き込み済みの件数（SQLite版は commit 済みのバッチ分）、
+    line は原因が session_export.RecordError のときの行番号（1始まり、それ以外は None）
+    """
+    def __init__(self, imported: int, cause: BaseException):
+        super().__init__(f"{cause} (imported {imported} before the error)")
+        self.imported = imported
+        self.cause = cause
+        self.line: Optional[int] = getattr(cause, "line", None)
+
+# DBスキーマの版数（PRAGMA user_version）。テーブル・列を追加したら +1 し、_init_db に移行処理を書く
+SCHEMA_VERSION = 2  # 2: 集計のバケットを 1点 / 1秒刻みに変更（feedback_stats を作り直す）
+
+# ---- 集計（スコア推移）用 ----
+STATS_GROUP_KEYS = ("scenario_id", "shelf_id", "mode", "day")
+SCORE_BUCKETS = 101         # 1点刻み（0〜100）。中央値はこの分布から正確に出す
+SCORE_HIST_WIDTH = 10       # 表示用の score_hist は 0-9, 10-19, ..., 90-99, 100 の11本にまとめる
+LENGTH_BUCKET_SEC = 1       # セッション長は1秒刻み
+LENGTH_BUCKETS = 3601       # 最後のバケットは60分以上（中央値がそこに入ると 3600 を返す）
+STATS_TZ_OFFSET_SEC = int(float(os.environ.get("STATS_TZ_OFFSET_HOURS") or 9) * 3600)  # 既定はJSTで日付を切る
+
+
+def stats_day(created_at: int) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(int(created_at) + STATS_TZ_OFFSET_SEC))
+
+
+def feedback_score(payload: Any) -> Optional[int]:
+    """
+    集計対象のスコア。エラー・暫定（provisional）・スコア無しは None（集計しない）。
+    """
+    if not isinstance(payload, dict) or payload.get("error") or payload.get("provisional"):
+        return None
+    try:
+        return max(0, min(100, int(payload.get("score"))))
+    except Exception:
+        return None
+
+
+def transcript_duration_sec(payload: Any) -> Optional[int]:
+    """
+    transcript の ts（ミリ秒）/ ended_at からセッション長（秒）を出す。求められなければ None。
+    """
+    if not isinstance(payload, dict):
+        return None
+    ts = []
+    for t in payload.get("transcript") or []:
+        try:
+            ts.append(float(t.get("ts")))
+        except Exception:
+            continue
+    if not ts:
+        return None
+    end = payload.get("ended_at")
+    try:
+        end = float(end) if end is not None else max(ts)
+    except Exception:
+        end = max(ts)
+    span = end - min(ts)
+    if min(ts) > 1e11:  # Date.now() のミリ秒
+        span /= 1000.0
+    return max(0, int(span))
+
+
+def _score_bucket(score: int) -> int:
+    return max(0, min(int(score), SCORE_BUCKETS - 1))
+
+
+def _length_bucket(length: int) -> int:
+    return max(0, min(int(length) // LENGTH_BUCKET_SEC, LENGTH_BUCKETS - 1))
+
+
+def _median_from_hist(hist: List[int]) -> Optional[float]:
+    """
+    1刻みのヒストグラム（添字 = 値）の中央値。件数が偶数なら中央の2件の平均
+    """
+    n = sum(hist)
+    if n <= 0:
+        return None
+    lo_rank, hi_rank = (n - 1) // 2, n // 2  # 0始まりの順位
+    lo = hi = None
+    acc = 0
+    for i, c in enumerate(hist):
+        acc += c
+        if lo is None and acc > lo_rank:
+            lo = i
+        if acc > hi_rank:
+            hi = i
+            break
+    return (lo + hi) / 2.0
+
+
+def summarize_stats_rows(rows: Iterable[Tuple[Any, str, int, int, int]]) -> List[Dict[str, Any]]:
+    """
+    (key, kind, bucket, n, total) の行を key ごとの集計結果にまとめる。
+    """
+    out: Dict[Any, Dict[str, Any]] = {}
+    for key, kind, bucket, n, total in rows:
+        v = out.get(key)
+        if v is None:
+            v = out[key] = {
+                "key": key, "count": 0, "score_sum": 0,
+                "score_by_point": [0] * SCORE_BUCKETS, "length_hist": [0] * LENGTH_BUCKETS,
+            }
+        if kind == "score":
+            v["count"] += int(n)
+            v["score_sum"] += int(total)
+            v["score_by_point"][int(bucket)] += int(n)
+        elif kind == "length":
+            v["length_hist"][int(bucket)] += int(n)
+    res = []
+    for key in sorted(out.keys()):
+        v = out[key]
+        if v["count"] <= 0:
+            continue
+        v["avg_score"] = round(v["score_sum"] / v["count"], 1)
+        median_score = _median_from_hist(v["score_by_point"])
+        v["median_score"] = int(median_score) if median_score == int(median_score) else median_score
+        median_length = _median_from_hist(v["length_hist"])
+        v["median_length_sec"] = int(median_length * LENGTH_BUCKET_SEC + 0.5) if median_length is not None else None
+        v["score_hist"] = [0] * (100 // SCORE_HIST_WIDTH + 1)
+        for point, c in enumerate(v.pop("score_by_point")):
+            v["score_hist"][point // SCORE_HIST_WIDTH] += c
+        del v["length_hist"]
+        res.append(v)
+    return res
+
+
+def _approx_size(obj: Any) -> int:
+    """
+    メモリ上限の判定用のおおよそのバイト数（json.dumps するより安い概算）
+    """
+    if obj is None:
+        return 0
+    if isinstance(obj, str):
+        return 49 + len(obj) * 2
+    if isinstance(obj, dict):
+        return 64 + sum(_approx_size(k) + _approx_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return 56 + sum(_approx_size(v) for v in obj)
+    return 32
+
+
+class _MemRecord:
+    __slots__ = ("meta", "transcript", "feedback", "size", "touched")
+
+    def __init__(self, meta: SessionMeta, now: float):
+        self.meta = meta
+        self.transcript: Optional[Dict[str, Any]] = None
+        self.feedback: Any = None
+        self.size = _approx_size(meta.title) + _approx_size(meta.instructions) + 200
+        self.touched = now
+
+
+class _MemStripe:
+    __slots__ = ("lock", "records", "bytes")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records: "OrderedDict[str, _MemRecord]" = OrderedDict()  # LRU順（先頭が最も古い）
+        self.bytes = 0
+
+
 class InMemorySessionStore:
     """
     セッションID・シナリオ・履歴・ログ保存を担う最小ストア。
     後でSQLite版に差し替えても、同じI/Fで移行できるようにしています。
+
+    - ロックは session_id のハッシュで stripes 個に分割（高並列でも競合しにくい）
+    - max_bytes > 0 なら、stripe ごとに max_bytes / stripes を上限に LRU で追い出す
+    - ttl_sec > 0 なら、最後のアクセスから ttl_sec 経過したセッションを追い出す
+    - list_sessions / list_feedback_sessions は作成日時順のインデックスから返す（毎回ソートしない）
+    キャッシュ層やテスト用途を想定。追い出されたセッションは存在しない扱いになる。
     """
-    def __init__(self, scenarios: Optional[List[Dict[str, Any]]] = None):
+    def __init__(self, scenarios: Optional[List[Dict[str, Any]]] = None, stripes: int = 16,
+                 max_bytes: int = 0, ttl_sec: float = 0):
         self._scenarios = scenarios or SCENARIOS
-        self._sessions: Dict[str, SessionMeta] = {}
-        self._logs: Dict[str, Dict[str, Any]] = {}
-        self._feedback: Dict[str, Any] = {}  # 追加：フィードバック保存用
-        self._lock = threading.Lock()
+        self._stripes = [_MemStripe() for _ in range(max(1, int(stripes)))]
+        self._stripe_budget = (int(max_bytes) // len(self._stripes)) if max_bytes and max_bytes > 0 else 0
+        self._ttl = float(ttl_sec or 0)
+        # 作成日時順インデックス [(created_at, session_id), ...]（昇順）。追い出し分は遅延削除
+        self._index: List[Tuple[int, str]] = []
+        self._index_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        self._index_dead = 0
+        self._evicted = 0
+        self._expired = 0
+
+    def _stripe(self, session_id: str) -> _MemStripe:
+        return self._stripes[hash(session_id) % len(self._stripes)]
+
+    # ---- record helpers（stripe.lock 内で呼ぶ）----
+    def _live(self, st: _MemStripe, session_id: str, touch: bool = True) -> Optional[_MemRecord]:
+        rec = st.records.get(session_id)
+        if rec is None:
+            return None
+        now = time.monotonic()
+        if self._ttl and now - rec.touched > self._ttl:
+            self._drop(st, session_id, expired=True)
+            return None
+        if touch:
+            rec.touched = now
+            st.records.move_to_end(session_id)
+        return rec
+
+    def _drop(self, st: _MemStripe, session_id: str, expired: bool = False) -> None:
+        rec = st.records.pop(session_id, None)
+        if rec is None:
+            return
+        st.bytes -= rec.size
+        with self._counter_lock:
+            self._index_dead += 1
+            if expired:
+                self._expired += 1
+            else:
+                self._evicted += 1
+
+    def _resize(self, st: _MemStripe, rec: _MemRecord, delta: int) -> None:
+        rec.size += delta
+        st.bytes += delta
+        self._enforce(st)
+
+    def _enforce(self, st: _MemStripe) -> None:
+        now = time.monotonic()
+        while st.records:
+            sid, oldest = next(iter(st.records.items()))
+            if self._ttl and now - oldest.touched > self._ttl:
+                self._drop(st, sid, expired=True)
+            elif self._stripe_budget and st.bytes > self._stripe_budget and len(st.records) > 1:
+                self._drop(st, sid)
+            else:
+                break
+
+    def _index_add(self, meta: SessionMeta) -> None:
+        with self._index_lock:
+            key = (meta.created_at, meta.session_id)
+            if not self._index or self._index[-1] <= key:
+                self._index.append(key)
+            else:
+                bisect.insort(self._index, key)
+            self._maybe_compact_index()
+
+    def _maybe_compact_index(self) -> None:
+        # _index_lock 内で呼ぶ。dict の in 判定は GIL 下でアトミックなので stripe.lock は取らない
+        with self._counter_lock:
+            dead = self._index_dead
+        if dead < 1024 or dead * 2 < len(self._index):
+            return
+        self._index = [k for k in self._index if k[1] in self._stripe(k[1]).records]
+        with self._counter_lock:
+            self._index_dead = 0
+
+    def _iter_index(self, newest_first: bool = True) -> Iterator[Tuple[_MemStripe, str]]:
+        with self._index_lock:
+            keys = list(reversed(self._index)) if newest_first else list(self._index)
+        seen = set()  # 追い出し後に再登録されたIDは古いキーが残っているので重複を除く
+        for _, sid in keys:
+            if sid in seen:
+                continue
+            seen.add(sid)
+            yield self._stripe(sid), sid
+
+    def memory_stats(self) -> Dict[str, int]:
+        with self._counter_lock:
+            evicted, expired = self._evicted, self._expired
+        return {
+            "sessions": sum(len(st.records) for st in self._stripes),
+            "bytes": sum(st.bytes for st in self._stripes),
+            "max_bytes": self._stripe_budget * len(self._stripes),
+            "stripes": len(self._stripes),
+            "index_len": len(self._index),
+            "evicted": evicted,
+            "expired": expired,
+        }
 
     # ---- scenario ----
     def list_modes(self) -> List[str]:
@@ -138,19 +412,52 @@ class InMemorySessionStore:
             instructions=instr,
             created_at=int(time.time())
         )
-        with self._lock:
-            self._sessions[sid] = meta
+        self._put_meta(meta)
         return meta
 
+    def _put_meta(self, meta: SessionMeta) -> _MemRecord:
+        st = self._stripe(meta.session_id)
+        with st.lock:
+            rec = self._live(st, meta.session_id)
+            is_new = rec is None
+            if is_new:
+                rec = _MemRecord(meta, time.monotonic())
+                st.records[meta.session_id] = rec
+                st.bytes += rec.size
+                self._enforce(st)
+            else:
+                rec.meta = meta
+        if is_new:
+            self._index_add(meta)
+        return rec
+
     def get_session(self, session_id: str) -> Optional[SessionMeta]:
-        with self._lock:
-            return self._sessions.get(session_id)
+        st = self._stripe(session_id)
+        with st.lock:
+            rec = self._live(st, session_id)
+            return rec.meta if rec else None
+
+    def get_session_bundle(self, session_id: str) -> Tuple[Optional[SessionMeta], Optional[Dict[str, Any]], Any]:
+        """
+        (meta, transcript, feedback) をまとめて返す（SQLite版と同じI/F）
+        """
+        st = self._stripe(session_id)
+        with st.lock:
+            rec = self._live(st, session_id)
+            if rec is None:
+                return (None, None, None)
+            return (rec.meta, rec.transcript, rec.feedback)
 
     def list_sessions(self, limit: int = 50) -> List[SessionMeta]:
-        with self._lock:
-            arr = list(self._sessions.values())
-        arr.sort(key=lambda x: x.created_at, reverse=True)
-        return arr[:limit]
+        out: List[SessionMeta] = []
+        for st, sid in self._iter_index():
+            with st.lock:
+                rec = self._live(st, sid, touch=False)  # 期限切れはここで追い出す（一覧に出さない）
+            if rec is not None:
+                out.append(rec.meta)
+                if len(out) >= limit:
+                    break
+        return out
 
     # ---- logs ----
     def save_transcript(self, session_id: str, payload: Dict[str, Any]) -> bool:
@@ -158,33 +465,49 @@ class InMemorySessionStore:
         payload例:
           { "ended_at": 123, "transcript":[{"role":"user","text":"...","ts":...}, ...] }
         """
-        with self._lock:
-            if session_id not in self._sessions:
+        st = self._stripe(session_id)
+        with st.lock:
+            rec = self._live(st, session_id)
+            if rec is None:
                 return False
-            self._logs[session_id] = payload
+            delta = _approx_size(payload) - _approx_size(rec.transcript)
+            rec.transcript = payload
+            self._resize(st, rec, delta)
         return True
 
     def get_transcript(self, session_id: str) -> Optional[Dict[str, Any]]:
-        with self._lock:
-            return self._logs.get(session_id)
+        st = self._stripe(session_id)
+        with st.lock:
+            rec = self._live(st, session_id)
+            return rec.transcript if rec else None
 
     # ---- feedback ----
     def save_feedback(self, session_id: str, payload: Any) -> bool:
-        with self._lock:
-            if session_id not in self._sessions:
+        st = self._stripe(session_id)
+        with st.lock:
+            rec = self._live(st, session_id)
+            if rec is None:
                 return False
-            self._feedback[session_id] = payload
+            delta = _approx_size(payload) - _approx_size(rec.feedback)
+            rec.feedback = payload
+            self._resize(st, rec, delta)
         return True
 
     def get_feedback(self, session_id: str) -> Any:
-        with self._lock:
-            return self._feedback.get(session_id)
+        st = self._stripe(session_id)
+        with st.lock:
+            rec = self._live(st, session_id)
+            return rec.feedback if rec else None
 
     # ---- STG-002 ----
     def delete_feedback(self, session_id: str) -> bool:
-        with self._lock:
-            if session_id in self._feedback:
-                del self._feedback[session_id]
+        st = self._stripe(session_id)
+        with st.lock:
+            rec = self._live(st, session_id, touch=False)
+            if rec is not None and rec.feedback is not None:
+                delta = -_approx_size(rec.feedback)
+                rec.feedback = None
+                self._resize(st, rec, delta)
         return True
 
     def list_feedback_sessions(self, limit: int = 200) -> List[Tuple[str, str, int, str]]:
@@ -192,30 +515,287 @@ class InMemorySessionStore:
         生成済フィードバックが存在するセッションの一覧
         return: [(session_id, title, created_at, mode), ...]
         """
-        with self._lock:
-            ids = list(self._feedback.keys())
+        out: List[Tuple[str, str, int, str]] = []
+        for st, sid in self._iter_index():
+            with st.lock:
+                rec = self._live(st, sid, touch=False)
+                if rec is None or rec.feedback is None:
+                    continue
+                meta = rec.meta
+            out.append((sid, meta.title, meta.created_at, meta.mode))
+            if len(out) >= limit:
+                break
+        return out
 
-            out: List[Tuple[str, str, int, str]] = []
-            for sid in ids:
-                meta = self._sessions.get(sid)
-                if not meta:
+    # ---- stats ----
+    def get_score_stats(self, group_by: str = "scenario_id", mode: Optional[str] = None,
+                        shelf_id: Optional[str] = None, scenario_id: Optional[str] = None,
+                        day_from: Optional[str] = None, day_to: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        SQLite版と同じ形の集計結果（こちらは件数が少ない前提でその場で計算）
+        """
+        if group_by not in STATS_GROUP_KEYS:
+            raise ValueError(f"group_by must be one of {STATS_GROUP_KEYS}")
+        rows = []
+        items = []
+        for st in self._stripes:
+            with st.lock:
+                for sid in list(st.records):
+                    r = self._live(st, sid, touch=False)
+                    if r is not None and r.feedback is not None:
+                        items.append((r.meta, r.transcript, r.feedback))
+        for meta, log, fb in items:
+            score = feedback_score(fb)
+            if score is None:
+                continue
+            s = self.find_scenario(meta.scenario_id) or {}
+            dims = {
+                "scenario_id": meta.scenario_id,
+                "shelf_id": s.get("shelf_id") or "UNSPECIFIED",
+                "mode": meta.mode,
+                "day": stats_day(meta.created_at),
+            }
+            if (mode and dims["mode"] != mode) or (shelf_id and dims["shelf_id"] != shelf_id) \
+                    or (scenario_id and dims["scenario_id"] != scenario_id) \
+                    or (day_from and dims["day"] < day_from) or (day_to and dims["day"] > day_to):
+                continue
+            rows.append((dims[group_by], "score", _score_bucket(score), 1, score))
+            length = transcript_duration_sec(log)
+            if length is not None:
+                rows.append((dims[group_by], "length", _length_bucket(length), 1, length))
+        return summarize_stats_rows(rows)
+
+    # ---- export / import ----
+    def iter_export_rows(self, batch_size: int = 500) -> Iterator[ExportRow]:
+        """
+        (session_dict, transcript_json, feedback_json) を created_at 昇順で返す。
+        JSON は文字列のまま返す（SQLite版と同じ形）。
+        """
+        for st, sid in self._iter_index(newest_first=False):
+            with st.lock:
+                rec = self._live(st, sid, touch=False)
+                if rec is None:
                     continue
-                out.append((sid, meta.title, meta.created_at, meta.mode))
+                m, log, fb = rec.meta, rec.transcript, rec.feedback
+            yield (
+                {k: getattr(m, k) for k in _SESSION_FIELDS},
+                None if log is None else json_codec.dumps(log),
+                None if fb is None else json_codec.dumps(fb),
+            )
+
+    def import_records(self, records: Iterable[Dict[str, Any]], batch_size: int = 500) -> int:
+        """
+        {"session": {...}, "transcript": ..., "feedback": ...} を取り込む（既存IDは上書き）。
+        return: 取り込んだセッション数（途中で失敗したら ImportAborted）
+        """
+        n = 0
+        try:
+            for rec in records:
+                meta = SessionMeta(**{k: rec["session"][k] for k in _SESSION_FIELDS})
+                self._put_meta(meta)
+                if rec.get("transcript") is not None:
+                    self.save_transcript(meta.session_id, rec["transcript"])
+                if rec.get("feedback") is not None:
+                    self.save_feedback(meta.session_id, rec["feedback"])
+                n += 1
+        except Exception as e:
+            raise ImportAborted(n, e) from e
+        return n
+
+
+class _BundleCache:
+    """
+    get_session_bundle 用の LRU キャッシュ（容量はバイト数で制限）。
+    値は (version, size, row)。version は sessions.version と一致する間だけ有効。
+    row は (meta, transcript の JSON 文字列, feedback の JSON 文字列)。デコードは取り出すたびに行うので、
+    呼び出し側が返り値を書き換えてもキャッシュには残らない。
+    """
+    def __init__(self, max_bytes: int, native: bool = False):
+        self._max_bytes = max(0, int(max_bytes))
+        self._items: "OrderedDict[str, Tuple[int, int, Tuple[Any, Any, Any]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = _native_threading().Lock() if native else threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_bytes > 0
+
+    def get(self, session_id: str, version: int) -> Optional[Tuple[Any, Any, Any]]:
+        with self._lock:
+            item = self._items.get(session_id)
+            if item is None or item[0] != version:
+                self.misses += 1
+                return None
+            self._items.move_to_end(session_id)
+            self.hits += 1
+            return item[2]
+
+    def put(self, session_id: str, version: int, size: int, bundle: Tuple[Any, Any, Any]) -> None:
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(session_id, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[session_id] = (version, size, bundle)
+            self._bytes += size
+            while self._bytes > self._max_bytes and self._items:
+                _, (_, sz, _) = self._items.popitem(last=False)
+                self._bytes -= sz
+
+    def invalidate(self, session_id: str) -> None:
+        with self._lock:
+            old = self._items.pop(session_id, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self._max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def _loads_or_none(payload_json: Optional[str]) -> Any:
+    if payload_json is None:
+        return None
+    try:
+        return json_codec.loads(payload_json)
+    except Exception:
+        return None
+
+
+def _native_threading():
+    """
+    eventlet / gevent が threading を monkey patch していても、本物の threading モジュールを返す。
+    tpool 等のネイティブスレッドから触るロックは green ではなく native である必要がある。
+    """
+    try:
+        return concurrency.original("threading")
+    except Exception:
+        return threading
 
-        out.sort(key=lambda x: x[2], reverse=True)
-        return out[:limit]
+
+class _DBExecutor:
+    """
+    SQLiteSessionStore の DB 処理をどこで実行するか。
+      - "inline": 呼び出し元でそのまま実行（従来どおり）
+      - "tpool" : eventlet.tpool のネイティブスレッドで実行（hub を止めない）
+      - "gevent": gevent の hub の threadpool で実行（hub を止めない）
+      - "thread": ThreadPoolExecutor で実行（monkey patch しないサーバー向け）
+      - "native": 動いている方式に合わせて tpool / gevent / inline を選ぶ（concurrency.py）
+    max_pending で投入待ちを含めた同時実行数を制限する（超えた呼び出しは待つ）。
+    """
+    MODES = ("inline", "tpool", "gevent", "thread", "native")
+
+    def __init__(self, mode: str = "inline", workers: int = 4, max_pending: int = 64):
+        if mode not in self.MODES:
+            raise ValueError(f"db executor must be one of {self.MODES}")
+        if mode == "native":
+            mode = {"eventlet": "tpool", "gevent": "gevent"}.get(concurrency.active(), "inline")
+        self.mode = mode
+        self._pool = None
+        if mode == "tpool":
+            from eventlet import tpool
+            self._tpool = tpool
+        elif mode == "gevent":
+            import gevent
+            self._gevent = gevent
+        elif mode == "thread":
+            from concurrent.futures import ThreadPoolExecutor
+            self._pool = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="sqlite")
+        # 呼び出し元（greenlet 側）で待つので、セマフォは通常の threading のものを使う
+        self._slots = threading.BoundedSemaphore(max(1, int(max_pending)))
+        self._inside = _native_threading().local()
+        self._stats_lock = _native_threading().Lock()
+        self._stats: Dict[str, float] = {"calls": 0, "pending": 0, "max_pending": 0, "wait_ms": 0.0, "run_ms": 0.0}
+
+    @property
+    def native(self) -> bool:
+        return self.mode != "inline"
+
+    def _run(self, fn, args, kwargs):
+        self._inside.active = True
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._inside.active = False
+            with self._stats_lock:
+                self._stats["run_ms"] += (time.perf_counter() - started) * 1000
+
+    def call(self, fn, *args, **kwargs):
+        if self.mode == "inline" or getattr(self._inside, "active", False):
+            return fn(*args, **kwargs)
+        queued = time.perf_counter()
+        self._slots.acquire()
+        try:
+            with self._stats_lock:
+                self._stats["calls"] += 1
+                self._stats["pending"] += 1
+                self._stats["max_pending"] = max(self._stats["max_pending"], self._stats["pending"])
+                self._stats["wait_ms"] += (time.perf_counter() - queued) * 1000
+            if self.mode == "tpool":
+                return self._tpool.execute(self._run, fn, args, kwargs)
+            if self.mode == "gevent":
+                return self._gevent.get_hub().threadpool.apply(self._run, (fn, args, kwargs))
+            return self._pool.submit(self._run, fn, args, kwargs).result()
+        finally:
+            with self._stats_lock:
+                self._stats["pending"] -= 1
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            out: Dict[str, Any] = dict(self._stats)
+        out["mode"] = self.mode
+        out["wait_ms"] = round(out["wait_ms"], 1)
+        out["run_ms"] = round(out["run_ms"], 1)
+        return out
+
+
+def _db_call(fn):
+    """SQLiteSessionStore の公開メソッドを self._executor 経由で実行する"""
+    @wraps(fn)
+    def _wrapper(self, *args, **kwargs):
+        return self._executor.call(fn, self, *args, **kwargs)
+    return _wrapper
 
 
 class SQLiteSessionStore:
     """
     SQLite に永続化するストア。
     InMemorySessionStore と同じ I/F を維持し、最小差分で差し替えできるようにする。
+
+    cache_bytes > 0 のとき、get_session / get_transcript / get_feedback は
+    get_session_bundle 経由のLRUキャッシュを使う。
+    書き込みごとに sessions.version を +1 するため、別ワーカーが更新した場合も
+    version 不一致でキャッシュは破棄される。
+
+    executor="tpool" / "gevent"（"native" で自動選択）のとき、DB を触る公開メソッドはネイティブスレッドで
+    実行される（commit の fsync 等で eventlet / gevent の hub が止まらない）。_DBExecutor 参照。
     """
-    def __init__(self, db_path: str = "app.db", scenarios: Optional[List[Dict[str, Any]]] = None):
+    def __init__(self, db_path: str = "app.db", scenarios: Optional[List[Dict[str, Any]]] = None,
+                 cache_bytes: int = 0, executor: str = "inline", executor_workers: int = 4,
+                 executor_max_pending: int = 64):
         import sqlite3
         self._scenarios = scenarios or SCENARIOS
         self._db_path = db_path
-        self._lock = threading.Lock()
+        self._executor = _DBExecutor(executor, executor_workers, executor_max_pending)
+        # tpool / thread では DB ロックをネイティブスレッドから取るため native lock にする
+        self._lock = _native_threading().Lock() if self._executor.native else threading.Lock()
+        self._cache = _BundleCache(cache_bytes, native=self._executor.native)
         self._conn = sqlite3.connect(self._db_path, check_same_thread=False)
         self._conn.execute("PRAGMA journal_mode=WAL;")
         self._conn.execute("PRAGMA foreign_keys=ON;")
@@ -224,6 +804,10 @@ class SQLiteSessionStore:
     def _init_db(self) -> None:
         with self._lock:
             cur = self._conn.cursor()
+            # スキーマが最新なら DDL / 移行チェックは丸ごと省略（ワーカー起動の短縮）
+            user_version = int(cur.execute("PRAGMA user_version").fetchone()[0])
+            if user_version >= SCHEMA_VERSION:
+                return
             cur.execute(
                 """
                 CREATE TABLE IF NOT EXISTS sessions (
@@ -255,7 +839,53 @@ class SQLiteSessionStore:
                 """
             )
             cur.execute("CREATE INDEX IF NOT EXISTS idx_sessions_created_at ON sessions(created_at DESC);")
+            # キャッシュ整合用の version 列（既存DBには後付けで追加）
+            cols = {r[1] for r in cur.execute("PRAGMA table_info(sessions)").fetchall()}
+            if "version" not in cols:
+                cur.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            cols = {r[1] for r in cur.execute("PRAGMA table_info(transcripts)").fetchall()}
+            if "duration_sec" not in cols:
+                cur.execute("ALTER TABLE transcripts ADD COLUMN duration_sec INTEGER")
+
+            # スコア集計（save_feedback / delete_feedback で差分更新。payload は読まない）
+            #  feedback_stats     : (day, scenario, shelf, mode) × kind(score|length) × bucket の件数・合計
+            #  feedback_stats_src : セッションごとに何を加算したか（上書き・削除時に差し引く）
+            #  版数 1 までの feedback_stats は10点 / 30秒刻みなので作り直す
+            need_backfill = user_version < 2 or not cur.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='feedback_stats_src'"
+            ).fetchone()
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS feedback_stats (
+                    day TEXT NOT NULL,
+                    scenario_id TEXT NOT NULL,
+                    shelf_id TEXT NOT NULL,
+                    mode TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    n INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY(day, scenario_id, shelf_id, mode, kind, bucket)
+                )
+                """
+            )
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS feedback_stats_src (
+                    session_id TEXT PRIMARY KEY,
+                    day TEXT NOT NULL,
+                    scenario_id TEXT NOT NULL,
+                    shelf_id TEXT NOT NULL,
+                    mode TEXT NOT NULL,
+                    score INTEGER NOT NULL,
+                    length_sec INTEGER
+                )
+                """
+            )
+            cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
             self._conn.commit()
+        if need_backfill:
+            self.rebuild_score_stats()
 
     # ---- scenario ----
     def list_modes(self) -> List[str]:
@@ -291,6 +921,7 @@ class SQLiteSessionStore:
         return None
 
     # ---- session ----
+    @_db_call
     def create_session(self, scenario_id: str = "free_talk", instructions_override: Optional[str] = None) -> SessionMeta:
         s = self.find_scenario(scenario_id) or self.find_scenario("free_talk")
         assert s is not None
@@ -313,7 +944,10 @@ class SQLiteSessionStore:
             self._conn.commit()
         return meta
 
+    @_db_call
     def get_session(self, session_id: str) -> Optional[SessionMeta]:
+        if self._cache.enabled:
+            return self.get_session_bundle(session_id)[0]
         with self._lock:
             cur = self._conn.execute(
                 "SELECT session_id, scenario_id, mode, title, instructions, created_at FROM sessions WHERE session_id=?",
@@ -331,6 +965,74 @@ class SQLiteSessionStore:
             created_at=int(row[5]),
         )
 
+    @_db_call
+    def get_session_bundle(self, session_id: str) -> Tuple[Optional[SessionMeta], Optional[Dict[str, Any]], Any]:
+        """
+        (meta, transcript, feedback) を1クエリでまとめて取得する。
+        /feedback/<id> のように3つとも必要な画面向け。
+        """
+        if self._cache.enabled:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT version FROM sessions WHERE session_id=?", (session_id,)
+                ).fetchone()
+            if not row:
+                self._cache.invalidate(session_id)
+                return (None, None, None)
+            cached = self._cache.get(session_id, int(row[0]))
+            if cached is not None:
+                meta, transcript_json, feedback_json = cached
+                return (replace(meta), _loads_or_none(transcript_json), _loads_or_none(feedback_json))
+
+        with self._lock:
+            cur = self._conn.execute(
+                """
+                SELECT s.session_id, s.scenario_id, s.mode, s.title, s.instructions, s.created_at, s.version,
+                       t.payload_json, f.payload_json
+                FROM sessions s
+                LEFT JOIN transcripts t ON t.session_id = s.session_id
+                LEFT JOIN feedback f ON f.session_id = s.session_id
+                WHERE s.session_id=?
+                """,
+                (session_id,)
+            )
+            row = cur.fetchone()
+        if not row:
+            return (None, None, None)
+        meta = SessionMeta(
+            session_id=row[0],
+            scenario_id=row[1],
+            mode=row[2],
+            title=row[3],
+            instructions=row[4],
+            created_at=int(row[5]),
+        )
+        if self._cache.enabled:
+            size = sum(len(x or "") for x in (row[3], row[4], row[7], row[8])) * 2 + 256
+            self._cache.put(session_id, int(row[6]), size, (replace(meta), row[7], row[8]))
+        return (meta, _loads_or_none(row[7]), _loads_or_none(row[8]))
+
+    @property
+    def db_path(self) -> str:
+        return self._db_path
+
+    def cache_stats(self) -> Dict[str, int]:
+        return self._cache.stats()
+
+    def executor_stats(self) -> Dict[str, Any]:
+        return self._executor.stats()
+
+    @_db_call
+    def checkpoint_wal(self, mode: str = "TRUNCATE") -> Dict[str, int]:
+        """WAL を本体に書き戻す（停止前のドレインで使う）。return: busy / wal_pages / checkpointed"""
+        mode = mode.upper()
+        if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"invalid wal_checkpoint mode: {mode}")
+        with self._lock:
+            row = self._conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        return {"busy": int(row[0]), "wal_pages": int(row[1]), "checkpointed": int(row[2])}
+
+    @_db_call
     def list_sessions(self, limit: int = 50) -> List[SessionMeta]:
         with self._lock:
             cur = self._conn.execute(
@@ -351,68 +1053,91 @@ class SQLiteSessionStore:
         ]
 
     # ---- logs ----
+    def _bump_version(self, session_id: str) -> bool:
+        """
+        sessions.version を +1（ロック内・commit前に呼ぶ）。セッションが無ければ False。
+        """
+        cur = self._conn.execute("UPDATE sessions SET version = version + 1 WHERE session_id=?", (session_id,))
+        return cur.rowcount > 0
+
+    @_db_call
     def save_transcript(self, session_id: str, payload: Dict[str, Any]) -> bool:
-        import json
+        payload_json = json_codec.dumps(payload)
+        duration = transcript_duration_sec(payload)
         with self._lock:
-            cur = self._conn.execute("SELECT 1 FROM sessions WHERE session_id=?", (session_id,))
-            if not cur.fetchone():
+            if not self._bump_version(session_id):
+                self._conn.rollback()
                 return False
-            payload_json = json.dumps(payload, ensure_ascii=False)
             self._conn.execute(
-                "INSERT INTO transcripts(session_id, payload_json) VALUES (?, ?) "
-                "ON CONFLICT(session_id) DO UPDATE SET payload_json=excluded.payload_json",
-                (session_id, payload_json)
+                "INSERT INTO transcripts(session_id, payload_json, duration_sec) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET payload_json=excluded.payload_json, "
+                "duration_sec=excluded.duration_sec",
+                (session_id, payload_json, duration)
             )
+            self._stats_update_length(session_id, duration)
             self._conn.commit()
+        self._cache.invalidate(session_id)
         return True
 
+    @_db_call
     def get_transcript(self, session_id: str) -> Optional[Dict[str, Any]]:
-        import json
+        if self._cache.enabled:
+            return self.get_session_bundle(session_id)[1]
         with self._lock:
             cur = self._conn.execute("SELECT payload_json FROM transcripts WHERE session_id=?", (session_id,))
             row = cur.fetchone()
         if not row:
             return None
         try:
-            return json.loads(row[0])
+            return json_codec.loads(row[0])
         except Exception:
             return None
 
     # ---- feedback ----
+    @_db_call
     def save_feedback(self, session_id: str, payload: Any) -> bool:
-        import json
+        payload_json = json_codec.dumps(payload)
         with self._lock:
-            cur = self._conn.execute("SELECT 1 FROM sessions WHERE session_id=?", (session_id,))
-            if not cur.fetchone():
+            if not self._bump_version(session_id):
+                self._conn.rollback()
                 return False
-            payload_json = json.dumps(payload, ensure_ascii=False)
             self._conn.execute(
                 "INSERT INTO feedback(session_id, payload_json) VALUES (?, ?) "
                 "ON CONFLICT(session_id) DO UPDATE SET payload_json=excluded.payload_json",
                 (session_id, payload_json)
             )
+            self._stats_remove(session_id)
+            self._stats_apply(session_id, payload)
             self._conn.commit()
+        self._cache.invalidate(session_id)
         return True
 
+    @_db_call
     def get_feedback(self, session_id: str) -> Any:
-        import json
+        if self._cache.enabled:
+            return self.get_session_bundle(session_id)[2]
         with self._lock:
             cur = self._conn.execute("SELECT payload_json FROM feedback WHERE session_id=?", (session_id,))
             row = cur.fetchone()
         if not row:
             return None
         try:
-            return json.loads(row[0])
+            return json_codec.loads(row[0])
         except Exception:
             return None
 
     # ---- STG-002 ----
+    @_db_call
     def delete_feedback(self, session_id: str) -> bool:
         with self._lock:
             self._conn.execute("DELETE FROM feedback WHERE session_id=?", (session_id,))
+            self._stats_remove(session_id)
+            self._bump_version(session_id)
             self._conn.commit()
+        self._cache.invalidate(session_id)
         return True
 
+    @_db_call
     def list_feedback_sessions(self, limit: int = 200) -> List[Tuple[str, str, int, str]]:
         """
         生成済フィードバックが存在するセッションの一覧
@@ -431,3 +1156,230 @@ class SQLiteSessionStore:
             )
             rows = cur.fetchall()
         return [(r[0], r[1], int(r[2]), r[3]) for r in rows]
+
+
+    # ---- stats ----
+    def _stats_add(self, dims: Tuple[str, str, str, str], kind: str, value: int, sign: int) -> None:
+        bucket = _score_bucket(value) if kind == "score" else _length_bucket(value)
+        self._conn.execute(
+            "INSERT INTO feedback_stats(day, scenario_id, shelf_id, mode, kind, bucket, n, total) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(day, scenario_id, shelf_id, mode, kind, bucket) "
+            "DO UPDATE SET n = n + excluded.n, total = total + excluded.total",
+            (*dims, kind, bucket, sign, sign * value)
+        )
+
+    def _stats_remove(self, session_id: str) -> None:
+        """（ロック内）このセッションの加算分を差し引く"""
+        row = self._conn.execute(
+            "SELECT day, scenario_id, shelf_id, mode, score, length_sec FROM feedback_stats_src WHERE session_id=?",
+            (session_id,)
+        ).fetchone()
+        if not row:
+            return
+        dims = (row[0], row[1], row[2], row[3])
+        self._stats_add(dims, "score", int(row[4]), -1)
+        if row[5] is not None:
+            self._stats_add(dims, "length", int(row[5]), -1)
+        self._conn.execute("DELETE FROM feedback_stats_src WHERE session_id=?", (session_id,))
+
+    def _stats_apply(self, session_id: str, payload: Any) -> None:
+        """（ロック内）フィードバック1件分を加算する"""
+        score = feedback_score(payload)
+        if score is None:
+            return
+        row = self._conn.execute(
+            """
+            SELECT s.scenario_id, s.mode, s.created_at, t.duration_sec
+            FROM sessions s LEFT JOIN transcripts t ON t.session_id = s.session_id
+            WHERE s.session_id=?
+            """,
+            (session_id,)
+        ).fetchone()
+        if not row:
+            return
+        scenario = self.find_scenario(row[0]) or {}
+        dims = (stats_day(row[2]), row[0], scenario.get("shelf_id") or "UNSPECIFIED", row[1])
+        length = row[3]
+        self._stats_add(dims, "score", score, 1)
+        if length is not None:
+            self._stats_add(dims, "length", int(length), 1)
+        self._conn.execute(
+            "INSERT INTO feedback_stats_src(session_id, day, scenario_id, shelf_id, mode, score, length_sec) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (session_id, *dims, score, length)
+        )
+
+    def _stats_update_length(self, session_id: str, length: Optional[int]) -> None:
+        """（ロック内）transcript 上書き時に、集計済みセッションの長さだけ差し替える"""
+        row = self._conn.execute(
+            "SELECT day, scenario_id, shelf_id, mode, length_sec FROM feedback_stats_src WHERE session_id=?",
+            (session_id,)
+        ).fetchone()
+        if not row or row[4] == length:
+            return
+        dims = (row[0], row[1], row[2], row[3])
+        if row[4] is not None:
+            self._stats_add(dims, "length", int(row[4]), -1)
+        if length is not None:
+            self._stats_add(dims, "length", int(length), 1)
+        self._conn.execute("UPDATE feedback_stats_src SET length_sec=? WHERE session_id=?", (length, session_id))
+
+    @_db_call
+    def rebuild_score_stats(self) -> int:
+        """
+        集計テーブルを feedback 全件から作り直す（既存DBの初回移行・不整合時の復旧用）。
+        return: 集計したフィードバック件数
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM feedback_stats")
+            self._conn.execute("DELETE FROM feedback_stats_src")
+            for session_id, payload_json in self._conn.execute(
+                "SELECT session_id, payload_json FROM feedback"
+            ).fetchall():
+                self._stats_apply(session_id, _loads_or_none(payload_json))
+            self._conn.commit()
+            row = self._conn.execute("SELECT COUNT(*) FROM feedback_stats_src").fetchone()
+        return int(row[0])
+
+    @_db_call
+    def get_score_stats(self, group_by: str = "scenario_id", mode: Optional[str] = None,
+                        shelf_id: Optional[str] = None, scenario_id: Optional[str] = None,
+                        day_from: Optional[str] = None, day_to: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        group_by（scenario_id / shelf_id / mode / day）ごとのスコア集計。
+        return: [{"key", "count", "score_sum", "avg_score", "median_score", "score_hist", "median_length_sec"}, ...]
+        """
+        if group_by not in STATS_GROUP_KEYS:
+            raise ValueError(f"group_by must be one of {STATS_GROUP_KEYS}")
+        where = []
+        params: List[Any] = []
+        for col, val in (("mode", mode), ("shelf_id", shelf_id), ("scenario_id", scenario_id)):
+            if val:
+                where.append(f"{col}=?")
+                params.append(val)
+        if day_from:
+            where.append("day>=?")
+            params.append(day_from)
+        if day_to:
+            where.append("day<=?")
+            params.append(day_to)
+        sql = (
+            f"SELECT {group_by}, kind, bucket, SUM(n), SUM(total) FROM feedback_stats "
+            + ("WHERE " + " AND ".join(where) + " " if where else "")
+            + f"GROUP BY {group_by}, kind, bucket"
+        )
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return summarize_stats_rows(rows)
+
+    # ---- export / import ----
+    def iter_export_rows(self, batch_size: int = 500) -> Iterator[ExportRow]:
+        """
+        (session_dict, transcript_json, feedback_json) を created_at 昇順でストリーミングする。
+        専用の読み取り接続＋fetchmany で読むため、件数に関係なくメモリは一定。
+        WAL のスナップショット上で読むので書き込みはブロックせず、ストアのロックも取らない。
+        JSON は保存済み文字列のまま返す（再パースしない）。
+        """
+        import sqlite3
+        conn = sqlite3.connect(f"file:{self._db_path}?mode=ro", uri=True, check_same_thread=False)
+        try:
+            cur = conn.execute(
+                """
+                SELECT s.session_id, s.scenario_id, s.mode, s.title, s.instructions, s.created_at,
+                       t.payload_json, f.payload_json
+                FROM sessions s
+                LEFT JOIN transcripts t ON t.session_id = s.session_id
+                LEFT JOIN feedback f ON f.session_id = s.session_id
+                ORDER BY s.created_at, s.session_id
+                """
+            )
+            while True:
+                rows = self._executor.call(cur.fetchmany, batch_size)
+                if not rows:
+                    break
+                for r in rows:
+                    yield (
+                        {
+                            "session_id": r[0],
+                            "scenario_id": r[1],
+                            "mode": r[2],
+                            "title": r[3],
+                            "instructions": r[4],
+                            "created_at": int(r[5]),
+                        },
+                        r[6],
+                        r[7],
+                    )
+        finally:
+            conn.close()
+
+    @_db_call
+    def import_records(self, records: Iterable[Dict[str, Any]], batch_size: int = 500) -> int:
+        """
+        {"session": {...}, "transcript": ..., "feedback": ...} を batch_size 件ずつ
+        executemany + 1トランザクションで取り込む（既存IDは上書きし version を進める）。
+        return: 取り込んだセッション数
+        途中で失敗したら ImportAborted（失敗したバッチは rollback され、それより前のバッチは残る）
+        """
+        n = 0
+        batch: List[Dict[str, Any]] = []
+        try:
+            for rec in records:
+                batch.append(rec)
+                if len(batch) >= batch_size:
+                    n += self._import_batch(batch)
+                    batch = []
+            if batch:
+                n += self._import_batch(batch)
+        except Exception as e:
+            raise ImportAborted(n, e) from e
+        finally:
+            self._cache.clear()
+        return n
+
+    def _import_batch(self, batch: List[Dict[str, Any]]) -> int:
+        sessions = []
+        transcripts = []
+        feedbacks = []
+        for rec in batch:
+            meta = rec["session"]
+            sessions.append(tuple(meta[k] for k in _SESSION_FIELDS))
+            if rec.get("transcript") is not None:
+                transcripts.append((meta["session_id"], json_codec.dumps(rec["transcript"]),
+                                    transcript_duration_sec(rec["transcript"])))
+            if rec.get("feedback") is not None:
+                feedbacks.append((meta["session_id"], json_codec.dumps(rec["feedback"])))
+        with self._lock:
+            try:
+                self._conn.executemany(
+                    "INSERT INTO sessions(session_id, scenario_id, mode, title, instructions, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET scenario_id=excluded.scenario_id, mode=excluded.mode, "
+                    "title=excluded.title, instructions=excluded.instructions, created_at=excluded.created_at, "
+                    "version=sessions.version+1",
+                    sessions
+                )
+                self._conn.executemany(
+                    "INSERT INTO transcripts(session_id, payload_json, duration_sec) VALUES (?, ?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET payload_json=excluded.payload_json, "
+                    "duration_sec=excluded.duration_sec",
+                    transcripts
+                )
+                self._conn.executemany(
+                    "INSERT INTO feedback(session_id, payload_json) VALUES (?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET payload_json=excluded.payload_json",
+                    feedbacks
+                )
+                for rec in batch:
+                    sid = rec["session"]["session_id"]
+                    if rec.get("feedback") is not None:
+                        self._stats_remove(sid)
+                        self._stats_apply(sid, rec["feedback"])
+                    elif rec.get("transcript") is not None:
+                        self._stats_update_length(sid, transcript_duration_sec(rec["transcript"]))
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return len(sessions)
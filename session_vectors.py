@@ -0,0 +1,459 @@
+# session_vectors.py
+"""
+「似た過去セッション」検索用のローカルなベクトルインデックス（ネットワークのモデルは使わない）。
+
+- 埋め込み: 文字 n-gram（scenario_index.char_ngrams と同じ分解）を crc32 で dim 次元にハッシュし、
+  符号付き・サブリニア tf で足し込んで L2 正規化（feature hashing。プロセスをまたいでも同じ値になる）
+- 保存: <dir>/vectors.f32（float32 の行優先 N×dim をそのまま並べる）と <dir>/ids.txt（1行1 session_id）、
+  <dir>/meta.json（dim）。追記のみ。ベクトル→ID の順に書くので、途中で落ちても短い方に揃えて開ける
+- 同じ session_id を再登録すると新しい行を足し、古い行は無効扱い（compact() で詰める）
+- 検索: vectors.f32 を mmap してコサイン類似度（正規化済みなので内積）の上位 k 件。
+  NumPy があれば numpy.memmap をブロックごとに行列×ベクトル、無ければ純 Python（遅いが同じ結果）
+- 書き込みは1プロセス（Web アプリ）だけが行う前提。他プロセスからは読み取り・CLI の build で作り直す
+
+  python session_vectors.py build --db app.db --dir session_vectors
+  python session_vectors.py query --dir session_vectors "納期遅延の説明で結論が後回しになった"
+  python session_vectors.py bench --n 1000000 --dim 256
+"""
+from __future__ import annotations
+from array import array
+from typing import Optional, Dict, Any, List, Tuple, Iterable
+import heapq
+import json
+import math
+import mmap
+import os
+import sys
+import threading
+import time
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy はオプション
+    np = None
+
+from scenario_index import char_ngrams
+
+DEFAULT_DIM = 256
+MAX_TEXT_CHARS = 4000
+QUERY_BLOCK_ROWS = 65536
+_VECTORS = "vectors.f32"
+_IDS = "ids.txt"
+_META = "meta.json"
+
+
+def embed(text: str, dim: int = DEFAULT_DIM) -> array:
+    """テキスト → L2 正規化済みの float32 ベクトル（array('f')。空文字ならゼロベクトル）"""
+    acc = [0.0] * dim
+    for gram, c in char_ngrams(text).items():
+        h = zlib.crc32(gram.encode("utf-8"))
+        w = 1.0 + math.log(c)
+        acc[h % dim] += -w if h & 0x80000000 else w
+    norm = math.sqrt(sum(x * x for x in acc))
+    if norm:
+        acc = [x / norm for x in acc]
+    return array("f", acc)
+
+
+def session_text(transcript: Any, feedback: Any, max_chars: int = MAX_TEXT_CHARS) -> str:
+    """
+    セッションを表すテキスト（フィードバックの summary を先頭に、続けて発話を時系列で）。
+    transcript / feedback は保存形式の dict でも JSON 文字列でもよい
+    """
+    if isinstance(transcript, str):
+        transcript = json.loads(transcript)
+    if isinstance(feedback, str):
+        feedback = json.loads(feedback)
+    parts = []
+    if isinstance(feedback, dict) and feedback.get("summary"):
+        parts.append(str(feedback["summary"]))
+    turns = transcript.get("transcript") if isinstance(transcript, dict) else None
+    for t in turns or []:
+        if isinstance(t, dict) and t.get("text"):
+            parts.append(str(t["text"]))
+    return "\n".join(parts)[:max_chars]
+
+
+class SessionVectorIndex:
+    def __init__(self, directory: str, dim: int = DEFAULT_DIM):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, _META)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                stored = int(json.load(f)["dim"])
+            if stored != dim:
+                raise ValueError(f"dim mismatch: {directory} has dim={stored}, requested {dim}")
+        else:
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"dim": dim, "dtype": "float32"}, f)
+        self.dim = dim
+        self._row_bytes = dim * 4
+        self._vec_path = os.path.join(directory, _VECTORS)
+        self._ids_path = os.path.join(directory, _IDS)
+        self._lock = threading.Lock()
+        self._ids: List[str] = []
+        self._latest: Dict[str, int] = {}
+        self._live = bytearray()  # 行ごとに 1=有効 / 0=再登録で置き換え済み
+        self._view = None
+        self._view_rows = 0
+        self.stats_counters: Dict[str, float] = {"appends": 0, "queries": 0, "last_query_ms": 0.0}
+        self._load()
+        self._vec_f = open(self._vec_path, "ab")
+        self._ids_f = open(self._ids_path, "a", encoding="utf-8")
+
+    def _load(self) -> None:
+        ids: List[str] = []
+        if os.path.exists(self._ids_path):
+            with open(self._ids_path, "r", encoding="utf-8") as f:
+                ids = f.read().splitlines()
+        vec_rows = os.path.getsize(self._vec_path) // self._row_bytes if os.path.exists(self._vec_path) else 0
+        n = min(len(ids), vec_rows)
+        # 書きかけの行（落ちたときの片方だけの追記）を切り詰める
+        if os.path.exists(self._vec_path) and os.path.getsize(self._vec_path) != n * self._row_bytes:
+            with open(self._vec_path, "r+b") as f:
+                f.truncate(n * self._row_bytes)
+        if len(ids) != n:
+            ids = ids[:n]
+            with open(self._ids_path, "w", encoding="utf-8") as f:
+                f.write("".join(i + "\n" for i in ids))
+        self._ids = ids
+        self._live = bytearray(b"\x01" * n)
+        for row, sid in enumerate(ids):
+            prev = self._latest.get(sid)
+            if prev is not None:
+                self._live[prev] = 0
+            self._latest[sid] = row
+
+    def __len__(self) -> int:
+        return len(self._latest)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._latest
+
+    # ---- 追記 ----
+    def append(self, session_id: str, vector) -> int:
+        """1件追記（既にあれば置き換え）。return: 行番号"""
+        return self.append_many([session_id], [vector])
+
+    def append_many(self, session_ids: List[str], vectors) -> int:
+        """
+        まとめて追記。vectors は array('f') / list の並び、または NumPy の (n, dim) 配列。
+        return: 最後の行番号
+        """
+        if np is not None and isinstance(vectors, np.ndarray):
+            blob = np.ascontiguousarray(vectors, dtype=np.float32).tobytes()
+        else:
+            buf = array("f")
+            for v in vectors:
+                buf.extend(v if isinstance(v, array) else array("f", v))
+            blob = buf.tobytes()
+        if len(blob) != len(session_ids) * self._row_bytes:
+            raise ValueError(f"expected {len(session_ids)} vectors of dim={self.dim}")
+        with self._lock:
+            self._vec_f.write(blob)
+            self._vec_f.flush()
+            self._ids_f.write("".join(sid + "\n" for sid in session_ids))
+            self._ids_f.flush()
+            for sid in session_ids:
+                row = len(self._ids)
+                self._ids.append(sid)
+                self._live.append(1)
+                prev = self._latest.get(sid)
+                if prev is not None:
+                    self._live[prev] = 0
+                self._latest[sid] = row
+            self.stats_counters["appends"] += len(session_ids)
+            return len(self._ids) - 1
+
+    def add_session(self, session_id: str, transcript: Any, feedback: Any = None) -> bool:
+        text = session_text(transcript, feedback)
+        if not text:
+            return False
+        self.append(session_id, embed(text, self.dim))
+        return True
+
+    # ---- 検索 ----
+    def _matrix(self, rows: int):
+        """先頭 rows 行の読み取り専用ビュー（追記で行数が増えたら張り直す）"""
+        if self._view is not None and self._view_rows == rows:
+            return self._view
+        if rows == 0:
+            return None
+        if np is not None:
+            view = np.memmap(self._vec_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        else:
+            with open(self._vec_path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), rows * self._row_bytes, access=mmap.ACCESS_READ)
+            view = memoryview(mm).cast("f")
+        self._view, self._view_rows = view, rows
+        return view
+
+    def vector(self, session_id: str) -> Optional[array]:
+        with self._lock:
+            row = self._latest.get(session_id)
+            rows = len(self._ids)
+            m = self._matrix(rows) if row is not None else None
+        if m is None:
+            return None
+        if np is not None:
+            return array("f", m[row].tobytes())
+        return array("f", m[row * self.dim:(row + 1) * self.dim])
+
+    def query(self, vector, k: int = 10, exclude: Iterable[str] = ()) -> List[Tuple[str, float]]:
+        """コサイン類似度の上位 k 件 [(session_id, score)]（exclude の session_id は除く）"""
+        t0 = time.perf_counter()
+        with self._lock:
+            rows = len(self._ids)
+            m = self._matrix(rows)
+            live = bytes(self._live[:rows])
+            skip = {self._latest[s] for s in exclude if s in self._latest}
+        if m is None or k <= 0:
+            return []
+        if np is not None:
+            top = self._query_numpy(m, rows, np.asarray(vector, dtype=np.float32), k, live, skip)
+        else:
+            top = self._query_python(m, rows, array("f", vector), k, live, skip)
+        with self._lock:
+            ids = self._ids
+            out = [(ids[row], score) for score, row in top]
+            self.stats_counters["queries"] += 1
+            self.stats_counters["last_query_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        return out
+
+    def _query_numpy(self, m, rows, q, k, live, skip):
+        live_mask = np.frombuffer(live, dtype=np.uint8)
+        best: List[Tuple[float, int]] = []
+        for a in range(0, rows, QUERY_BLOCK_ROWS):
+            b = min(rows, a + QUERY_BLOCK_ROWS)
+            scores = m[a:b] @ q
+            scores[live_mask[a:b] == 0] = -np.inf
+            for row in skip:
+                if a <= row < b:
+                    scores[row - a] = -np.inf
+            kk = min(k, b - a)
+            idx = np.argpartition(-scores, kk - 1)[:kk]
+            best.extend((float(scores[i]), a + int(i)) for i in idx if scores[i] != -np.inf)
+        return heapq.nlargest(k, best)
+
+    def _query_python(self, m, rows, q, k, live, skip):
+        dim = self.dim
+        heap: List[Tuple[float, int]] = []
+        for row in range(rows):
+            if not live[row] or row in skip:
+                continue
+            off = row * dim
+            score = sum(x * y for x, y in zip(m[off:off + dim], q))
+            if len(heap) < k:
+                heapq.heappush(heap, (score, row))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, row))
+        return sorted(heap, reverse=True)
+
+    def similar(self, session_id: str, k: int = 10) -> List[Tuple[str, float]]:
+        v = self.vector(session_id)
+        if v is None:
+            return []
+        return self.query(v, k, exclude=(session_id,))
+
+    def search_text(self, text: str, k: int = 10) -> List[Tuple[str, float]]:
+        return self.query(embed(text, self.dim), k)
+
+    # ---- 保守 ----
+    def compact(self) -> int:
+        """置き換え済みの行を除いて書き直す。return: 除いた行数"""
+        with self._lock:
+            rows = len(self._ids)
+            dropped = rows - len(self._latest)
+            if dropped == 0:
+                return 0
+            m = self._matrix(rows)
+            tmp_vec, tmp_ids = self._vec_path + ".tmp", self._ids_path + ".tmp"
+            keep = [row for row in range(rows) if self._live[row]]
+            with open(tmp_vec, "wb") as f:
+                for row in keep:
+                    if np is not None:
+                        f.write(m[row].tobytes())
+                    else:
+                        f.write(m[row * self.dim:(row + 1) * self.dim].tobytes())
+            with open(tmp_ids, "w", encoding="utf-8") as f:
+                f.write("".join(self._ids[row] + "\n" for row in keep))
+            self._vec_f.close()
+            self._ids_f.close()
+            self._view, self._view_rows = None, 0
+            os.replace(tmp_vec, self._vec_path)
+            os.replace(tmp_ids, self._ids_path)
+            self._ids = [self._ids[row] for row in keep]
+            self._latest = {sid: i for i, sid in enumerate(self._ids)}
+            self._live = bytearray(b"\x01" * len(self._ids))
+            self._vec_f = open(self._vec_path, "ab")
+            self._ids_f = open(self._ids_path, "a", encoding="utf-8")
+            return dropped
+
+    def close(self) -> None:
+        with self._lock:
+            self._vec_f.close()
+            self._ids_f.close()
+            self._view, self._view_rows = None, 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = len(self._ids)
+            return {
+                "sessions": len(self._latest),
+                "rows": rows,
+                "stale_rows": rows - len(self._latest),
+                "dim": self.dim,
+                "bytes": rows * self._row_bytes,
+                "backend": "numpy" if np is not None else "python",
+                **self.stats_counters,
+            }
+
+
+# ============================================================
+# CLI
+# ============================================================
+def build_from_db(db_path: str, directory: str, dim: int = DEFAULT_DIM, only_missing: bool = False,
+                  batch: int = 1000) -> Dict[str, Any]:
+    """app.db の全セッションを（only_missing なら未登録分だけ）登録する"""
+    from session_store import SQLiteSessionStore
+
+    store = SQLiteSessionStore(db_path)
+    index = SessionVectorIndex(directory, dim)
+    t0 = time.perf_counter()
+    added = skipped = 0
+    ids: List[str] = []
+    vecs: List[array] = []
+    for session, transcript_json, feedback_json in store.iter_export_rows():
+        sid = session["session_id"]
+        if only_missing and sid in index:
+            continue
+        text = session_text(transcript_json, feedback_json) if transcript_json else ""
+        if not text:
+            skipped += 1
+            continue
+        ids.append(sid)
+        vecs.append(embed(text, dim))
+        if len(ids) >= batch:
+            index.append_many(ids, vecs)
+            added += len(ids)
+            ids, vecs = [], []
+    if ids:
+        index.append_many(ids, vecs)
+        added += len(ids)
+    out = {"added": added, "skipped": skipped, "sec": round(time.perf_counter() - t0, 2), **index.stats()}
+    index.close()
+    return out
+
+
+def _percentile(arr, p):
+    if not arr:
+        return 0.0
+    return arr[min(len(arr) - 1, int(len(arr) * p))]
+
+
+def bench(n: int, dim: int, queries: int, k: int, directory: Optional[str] = None) -> Dict[str, Any]:
+    """
+    n 件のインデックスで計測する。
+    - 実テキスト相当（日本語の発話）の埋め込みと1件ずつの追記を 2000 件
+    - 残りはランダムな正規化済みベクトルをまとめて追記（NumPy 必須）
+    - 開き直し（ids.txt の読み込み）時間、top-k 検索の p50/p99
+    """
+    import random
+    import shutil
+    import tempfile
+
+    own_dir = directory is None
+    directory = directory or tempfile.mkdtemp(prefix="session-vectors-")
+    out: Dict[str, Any] = {"n": n, "dim": dim, "k": k}
+    try:
+        index = SessionVectorIndex(directory, dim)
+        phrases = ["結論から申し上げます。", "納期が三日遅れる見込みです。", "原因は外部APIの仕様変更です。",
+                   "再発防止として結合テストを追加します。", "ご判断いただきたいのは二点です。",
+                   "お客様の課題をもう少し詳しく伺えますか。", "数字で言うと前年比一二〇パーセントです。"]
+        rnd = random.Random(0)
+        real = min(n, 2000)
+        texts = ["".join(rnd.choice(phrases) for _ in range(40)) for _ in range(real)]
+        t0 = time.perf_counter()
+        for i, text in enumerate(texts):
+            index.append(f"real-{i:07d}", embed(text, dim))
+        out["embed_append_us"] = round((time.perf_counter() - t0) / real * 1e6, 1)
+        rest = n - real
+        if rest > 0:
+            if np is None:
+                raise RuntimeError("bench with n > 2000 needs numpy")
+            gen = np.random.default_rng(0)
+            t0 = time.perf_counter()
+            chunk = 100000
+            for a in range(0, rest, chunk):
+                b = min(rest, a + chunk)
+                m = gen.standard_normal((b - a, dim), dtype=np.float32)
+                m /= np.linalg.norm(m, axis=1, keepdims=True)
+                index.append_many([f"syn-{i:07d}" for i in range(a, b)], m)
+            out["bulk_append_rows_per_sec"] = round(rest / (time.perf_counter() - t0))
+        index.close()
+
+        t0 = time.perf_counter()
+        index = SessionVectorIndex(directory, dim)
+        out["open_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        out["file_mb"] = round(os.path.getsize(index._vec_path) / 1e6, 1)
+        lat = []
+        for i in range(queries):
+            t0 = time.perf_counter()
+            index.similar(f"real-{i % real:07d}", k)
+            lat.append(time.perf_counter() - t0)
+        out["query_ms_first"] = round(lat[0] * 1000, 1)  # mmap 直後（ページキャッシュ次第）
+        lat.sort()
+        out["query_ms_p50"] = round(_percentile(lat, 0.50) * 1000, 1)
+        out["query_ms_p99"] = round(_percentile(lat, 0.99) * 1000, 1)
+        out["backend"] = index.stats()["backend"]
+        index.close()
+        return out
+    finally:
+        if own_dir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="似た過去セッション検索用のベクトルインデックス")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("build", help="app.db から登録する")
+    p.add_argument("--db", default="app.db")
+    p.add_argument("--dir", default="session_vectors")
+    p.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    p.add_argument("--only-missing", action="store_true")
+    p.add_argument("--compact", action="store_true", help="登録後に置き換え済みの行を詰める")
+    p = sub.add_parser("query", help="テキストに近いセッション")
+    p.add_argument("text")
+    p.add_argument("--dir", default="session_vectors")
+    p.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    p.add_argument("-k", type=int, default=10)
+    p = sub.add_parser("bench", help="n 件での追記・検索の計測")
+    p.add_argument("--n", type=int, default=1000000)
+    p.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    p.add_argument("--queries", type=int, default=20)
+    p.add_argument("-k", type=int, default=10)
+    p.add_argument("--dir", default=None, help="既存のディレクトリを使う（指定しなければ一時ディレクトリ）")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "build":
+        out = build_from_db(args.db, args.dir, args.dim, only_missing=args.only_missing)
+        if args.compact:
+            index = SessionVectorIndex(args.dir, args.dim)
+            out["compacted_rows"] = index.compact()
+            index.close()
+    elif args.cmd == "query":
+        index = SessionVectorIndex(args.dir, args.dim)
+        out = [{"session_id": sid, "score": round(score, 4)} for sid, score in index.search_text(args.text, args.k)]
+        index.close()
+    else:
+        out = bench(args.n, args.dim, args.queries, args.k, args.dir)
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,517 @@
+// practice.html のクライアント処理（セッションごとの値は <body> の data-* から読む）
+const chat = document.getElementById('chat');
+const statusArea = document.getElementById('status');
+let pc, dataChannel;
+let lastUserFinalEl = null; // 既存変数は残置（下位互換のため）
+let provisionalUserBubble = null;   // speech_started 直後に出す暫定バブル
+
+// ★追加：保存用（session_id は server 側の変数名差異に備えて or で吸収）
+const SESSION_ID = document.body.dataset.sessionId;
+const transcriptLog = []; // {role,text,ts}
+
+// ★追加：逐次分析（FEEDBACK_ROLLING=1 のときだけ、確定発話をサーバへ送る）
+const ROLLING_FEEDBACK = document.body.dataset.rollingFeedback === "1";
+function logTurn(role, text){
+  const turn = { role, text, ts: Date.now() };
+  transcriptLog.push(turn);
+  if (!ROLLING_FEEDBACK) return;
+  fetch(`/api/session/${SESSION_ID}/turns`, {
+    method: "POST",
+    headers: {"Content-Type":"application/json"},
+    body: JSON.stringify({ turns: [turn] })
+  }).catch(() => {});
+}
+
+// ★追加：今「誰のユーザーターン」を肉付け中か
+let activeUserRootId = null;
+
+// ★追加：手動 response.create 用（1000ms無音でAI発話）
+let responseCreateTimer = null;
+let responseInFlight = false;
+
+function clearResponseTimer(){
+  if (responseCreateTimer) {
+    clearTimeout(responseCreateTimer);
+    responseCreateTimer = null;
+  }
+}
+
+function scheduleResponseCreate(){
+  clearResponseTimer();
+  responseCreateTimer = setTimeout(() => {
+    try {
+      if (dataChannel && dataChannel.readyState === "open" && !responseInFlight) {
+        dataChannel.send(JSON.stringify({ type: "response.create" }));
+        responseInFlight = true;
+        appendStatus("response.create を送信（1000ms無音で手動開始）");
+      }
+    } catch (e) {
+      console.error("response.create 送信失敗:", e);
+    }
+  }, 1000);
+}
+
+// ▼▼ 追記：item順序制御用のマップと挿入ヘルパ ▼▼
+const nodeByItem = new Map();        // item_id -> DOMノード
+const waitingChildren = new Map();   // parent_item_id -> [子ノード待機列]
+// 追加: ユーザー発話統合用のメタ情報
+const itemRole = new Map();          // item_id -> 'user' | 'assistant' ...
+const itemRoot = new Map();          // item_id -> root item_id（ユーザー連続発話の先頭）
+const rootItems = new Map();         // root item_id -> [item_id, ...]（同じ吹き出しに統合される順序）
+const userTextByItem = new Map();    // item_id -> transcript
+
+// ★追加：AI応答（赤吹き出し）を item ごとに分離して保持（過去分が混ざるのを防止）
+const aiTextByItem = new Map();      // item_id -> transcript buffer
+
+function insertAfterAnchor(node, previousId) {
+  const anchor = nodeByItem.get(previousId);
+  if (anchor && anchor.parentNode) {
+    anchor.insertAdjacentElement('afterend', node);
+    return true;
+  }
+  return false;
+}
+
+function registerNode(id, node, previousId) {
+  node.classList.add('streaming'); // 生成時は暫定表示
+  if (previousId) {
+    if (!insertAfterAnchor(node, previousId)) {
+      const q = waitingChildren.get(previousId) || [];
+      q.push(node);
+      waitingChildren.set(previousId, q);
+    }
+  } else {
+    // 先頭要素（previousが無い場合）は末尾に
+    if (!node.parentNode) chat.appendChild(node);
+  }
+  nodeByItem.set(id, node);
+
+  // 自分を待っていた子をこの直後に並べる
+  const children = waitingChildren.get(id);
+  if (children && children.length) {
+    let last = node;
+    for (const child of children) {
+      if (!child.parentNode) last.insertAdjacentElement('afterend', child);
+      last = child;
+    }
+    waitingChildren.delete(id);
+  }
+}
+// ▲▲ 追記ここまで ▲▲
+
+async function appendStatus(msg){
+  const div = document.createElement('div');
+  div.textContent = "> " + msg;
+  statusArea.appendChild(div);
+  statusArea.scrollTop = statusArea.scrollHeight;
+}
+
+// 💬 吹き出し形式でユーザー発話（緑色）
+async function appendUser(msg) {
+  const bubble = document.createElement('div');
+  bubble.className = 'message user';
+  bubble.textContent = msg.trim();
+  chat.appendChild(bubble);
+  chat.scrollTop = chat.scrollHeight;
+}
+
+// 💬 吹き出し形式でAI発話（赤色）
+async function appendAI(msg, stream = false) {
+  let bubble = chat.querySelector('.message.ai.streaming');
+  if (!bubble || !stream) {
+    // 既存フォールバックは残置（非JSON時用）
+    let uStream = chat.querySelector('.message.user.streaming');
+    if (!uStream && !lastUserFinalEl) {
+      uStream = document.createElement('div');
+      uStream.className = 'message user streaming';
+      uStream.textContent = '…';
+      chat.appendChild(uStream);
+    }
+    bubble = document.createElement('div');
+    bubble.className = 'message ai streaming';
+    const u = chat.querySelector('.message.user.streaming') || lastUserFinalEl;
+    if (u && u.parentNode === chat) {
+      u.insertAdjacentElement('afterend', bubble);
+    } else {
+      chat.appendChild(bubble);
+    }
+  }
+  bubble.textContent = msg.trim();
+  chat.scrollTop = chat.scrollHeight;
+}
+
+async function getJWT(){
+  try {
+    const res = await fetch('/jwt');
+    const data = await res.json();
+    if (res.status === 401) {
+      const next = encodeURIComponent(window.location.pathname + window.location.search);
+      window.location.href = '/login?next=' + next;
+      return null;
+    }
+    return data.jwt;
+  } catch(e){
+    console.error("JWT取得失敗:", e);
+    appendStatus("JWT取得に失敗");
+    return null;
+  }
+}
+
+async function startRealtime(){
+  const token = await getJWT();
+  if(!token){ appendStatus("トークンなし"); return; }
+
+  const MODEL = "gpt-realtime";
+  const offer = await createLocalOffer();
+  appendStatus("SDP作成完了");
+
+  // ✅ Flaskサーバーのsdp-proxyを経由してCORSを回避
+  const proxyUrl = "/realtime/sdp-proxy";
+  const r = await fetch(proxyUrl, {
+    method: "POST",
+    headers: { "Content-Type": "application/sdp" },
+    body: offer.sdp
+  });
+
+  if (!r.ok) {
+    appendStatus("SDP proxy fetch失敗: " + r.status);
+    return;
+  }
+
+  const answerSDP = await r.text();
+  await pc.setRemoteDescription({ type: "answer", sdp: answerSDP });
+  appendStatus("Realtime接続完了 (via Flask proxy)");
+}
+
+async function createLocalOffer(){
+  pc = new RTCPeerConnection();
+  dataChannel = pc.createDataChannel("oai-events");
+
+  // --- DataChannel open直後に WebRTC セッションへ session.update を送る --- //
+  dataChannel.onopen = () => { // NEW(★)
+    // ▼▼ 追加(2/2)：テキスト入力値を instructions に適用 ▼▼
+    const promptEl = document.getElementById('prompt');
+    const userInstructions = (promptEl && promptEl.value.trim()) ? promptEl.value.trim()
+                           : "あなたは親切で有能なアシスタントです。応答は簡潔に。";
+    // ▲▲ 追加(2/2) ここまで ▲▲
+
+    // WebRTCセッションに対して“この接続”の設定を適用（サーバ側WSには影響しない）
+    const update = {
+      type: "session.update",
+      session: {
+        speed: 1.5, // ★ 1.5 が上限（2.0は不可）
+        input_audio_transcription: {
+          model: "whisper-1",
+          language: "ja",
+        },
+        turn_detection: {
+          type: "server_vad",
+          threshold: 0.5,
+          // 「無音がこのくらい続いたら1発話として区切る」の秒数イメージ
+          // 値を小さくすると、短い間でも小刻みに区切ってくれる（＝テキストも早く出やすい）
+          silence_duration_ms: 30,      // ここを 300ms 前後に
+          prefix_padding_ms: 300,        // 直前の音声も少しだけ巻き戻して含める
+          idle_timeout_ms: null,
+          // ★追加：自動でAI応答を作らない（1000ms無音で手動 response.create する）
+          create_response: false,
+          interrupt_response: false
+        },
+        instructions: userInstructions
+      }
+    };
+    dataChannel.send(JSON.stringify(update));
+    appendStatus("session.update を送信（WebRTC, with instructions）");
+  };
+  // ----------------------------------------------------------------------- //
+
+  dataChannel.onmessage = (event) => {
+    const msg = event.data;
+    console.log("📩 DataChannel受信:", msg);
+    try {
+      const parsed = JSON.parse(msg);
+
+      // ▼▼▼ スレッド順の基準（previous_item_id） + 吹き出し統合ロジック ▼▼▼
+      if (parsed.type === "conversation.item.created" && parsed.item) {
+        const it = parsed.item;
+        const prev = parsed.previous_item_id || null;
+        itemRole.set(it.id, it.role);
+
+        // ★追加①：アシスタントが出てきたら「直前のユーザーターンは終わり」
+        if (it.role === 'assistant') {
+          // 今しゃべっているユーザーターンは無しにする
+          activeUserRootId = null;
+
+          // もし使われなかった暫定「…」バブルが残っていたら削除
+          if (provisionalUserBubble) {
+            provisionalUserBubble.remove();
+            provisionalUserBubble = null;
+          }
+
+          // ★追加：AIの新規吹き出しをここで生成し、itemごとのバッファを初期化
+          aiTextByItem.set(it.id, "");
+          const bubble = document.createElement('div');
+          bubble.className = 'message ai streaming';
+          bubble.textContent = '…';
+          registerNode(it.id, bubble, prev);
+          chat.scrollTop = chat.scrollHeight;
+
+          // この後の user 用の処理はスキップ
+          return;
+        }
+
+        // ▼ ここから下は既存の「user用」ロジックをそのまま利用 ▼
+        if (it.role === 'user') {
+          let rootId;
+          let bubble;
+
+          if (prev && itemRole.get(prev) === 'user') {
+            // 直前も user → 同じ root にぶら下げる
+            rootId = itemRoot.get(prev) || prev;
+            itemRoot.set(it.id, rootId);
+
+            bubble = nodeByItem.get(rootId) || nodeByItem.get(prev);
+            if (bubble) {
+              nodeByItem.set(it.id, bubble); // 同じDOMノードを共有
+            }
+
+            const arr = rootItems.get(rootId) || [rootId];
+            if (!arr.includes(it.id)) arr.push(it.id);
+            rootItems.set(rootId, arr);
+
+          } else {
+            // 新しいユーザー発話 → 新しい root
+            rootId = it.id;
+            itemRoot.set(it.id, rootId);
+            rootItems.set(rootId, [it.id]);
+
+            // speech_started で作った暫定バブルがあればそれを採用
+            if (provisionalUserBubble) {
+              bubble = provisionalUserBubble;
+              provisionalUserBubble = null;
+              bubble.classList.remove('provisional');
+              // 既に chat に append 済みなので、registerNode 内で二重 append されないように
+              registerNode(it.id, bubble, prev);
+            } else {
+              // 暫定が無ければ今まで通り新規作成
+              bubble = document.createElement('div');
+              bubble.className = 'message user streaming';
+              bubble.textContent = '…';
+              registerNode(it.id, bubble, prev);
+            }
+          }
+
+          userTextByItem.set(it.id, "");
+          chat.scrollTop = chat.scrollHeight;
+        }
+      }
+      // ▲▲▲ ここまで ▲▲▲
+
+      // 発話開始時（DOMは conversation.item.created 側で作成する）
+      if (parsed.type === "input_audio_buffer.speech_started") {
+        // ★追加：1000ms 無音タイマーを止める（まだユーザーターン継続）
+        clearResponseTimer();
+
+        // ★修正ポイント：activeUserRootId は無視し、
+        // 既に暫定バブルがある場合だけ新規生成を抑止
+        if (provisionalUserBubble) {
+          return;
+        }
+
+        window._userBuffer = "";
+
+        // 新しい暫定バブルを即時表示
+        const bubble = document.createElement('div');
+        bubble.className = 'message user streaming provisional';
+        bubble.textContent = '…';
+        chat.appendChild(bubble);
+        chat.scrollTop = chat.scrollHeight;
+        provisionalUserBubble = bubble;
+      }
+
+      // ★追加：VADが「一旦止まった(=100ms無音)」を検知したら、1000msでAI開始を予約
+      if (parsed.type === "input_audio_buffer.speech_stopped") {
+        scheduleResponseCreate();
+      }
+
+      // ▼▼▼ WebRTC互換イベント：delta 単位で「itemごと」に更新し、root で再計算 ▼▼▼
+      else if (parsed.type === "conversation.item.input_audio_transcription.delta" && parsed.delta) {
+        const { item_id, delta } = parsed;
+
+        // 念のため role が user 以外なら無視
+        if (itemRole.get(item_id) !== 'user') {
+          return;
+        }
+
+        // どのルートメッセージ（＝1つの緑バブル）に属するか
+        const rootId = itemRoot.get(item_id) || item_id;
+        activeUserRootId = rootId;
+
+        // ルートに対応するバブルを取得
+        let bubble = nodeByItem.get(rootId);
+
+        // まだバブルが紐づいていない＆暫定バブルがある場合は
+        // 暫定バブルを「正式バブル」として昇格させる
+        if (!bubble && provisionalUserBubble) {
+          bubble = provisionalUserBubble;
+          provisionalUserBubble = null;
+
+          nodeByItem.set(rootId, bubble);
+          nodeByItem.set(item_id, bubble);
+        }
+
+        // それでも見つからない場合の保険
+        if (!bubble) {
+          bubble = document.createElement('div');
+          bubble.className = 'message user streaming';
+          bubble.textContent = '…';
+          registerNode(rootId, bubble, null);
+          nodeByItem.set(rootId, bubble);
+          nodeByItem.set(item_id, bubble);
+        }
+
+        // ★ 1) item 単位でテキストを更新（ここでは item_id ごとに持つ）
+        const prevItemText = userTextByItem.get(item_id) || "";
+        const newItemText = prevItemText + delta;
+        userTextByItem.set(item_id, newItemText);
+
+        // ★ 2) root 配下の item を順番に連結して、バブル全体テキストを再計算
+        const chain = rootItems.get(rootId) || [rootId];
+        let merged = "";
+        for (const id of chain) {
+          merged += (userTextByItem.get(id) || "");
+        }
+
+        bubble.textContent = merged || '…';
+        chat.scrollTop = chat.scrollHeight;
+      }
+      else if (parsed.type === "conversation.item.input_audio_transcription.completed" && parsed.transcript) {
+        const itemId = parsed.item_id;
+
+        // user 以外の completed は無視
+        if (itemRole.get(itemId) !== 'user') {
+          return;
+        }
+
+        // ★ この item のテキストを「最終 transcript で上書き」
+        userTextByItem.set(itemId, parsed.transcript || "");
+
+        const rootId = itemRoot.get(itemId) || itemId;
+        const bubble = nodeByItem.get(rootId);
+        if (bubble) {
+          // root 配下の item たちを順番に連結して確定テキストにする
+          const chain = rootItems.get(rootId) || [rootId];
+          let merged = "";
+          for (const id of chain) {
+            merged += (userTextByItem.get(id) || "");
+          }
+          bubble.textContent = merged.trim();
+          bubble.classList.remove('streaming');
+          lastUserFinalEl = bubble; // 既存互換
+          chat.scrollTop = chat.scrollHeight;
+        }
+
+        // ★追加：ユーザー確定発話をログ保存用に保持
+        const t = (parsed.transcript || "").trim();
+        if (t) logTurn("user", t);
+      }
+
+      // ✅ AI応答（赤吹き出し）：itemごとにバッファを分離して更新（過去分混入バグを防止）
+      if (parsed.type === "response.audio_transcript.delta" && parsed.delta) {
+        const id = parsed.item_id;
+        const prev = aiTextByItem.get(id) || "";
+        const next = prev + parsed.delta;
+        aiTextByItem.set(id, next);
+
+        let bubble = nodeByItem.get(id);
+        if (!bubble) {
+          // 互換：通常は先に conversation.item.created が来るが、未登録時は暫定作成
+          bubble = document.createElement('div');
+          bubble.className = 'message ai streaming';
+          chat.appendChild(bubble);
+          nodeByItem.set(id, bubble);
+        }
+        bubble.textContent = next.trim();
+        chat.scrollTop = chat.scrollHeight;
+      }
+      else if (parsed.type === "response.audio_transcript.done" && parsed.transcript) {
+        const id = parsed.item_id;
+        aiTextByItem.set(id, parsed.transcript || "");
+
+        let bubble = nodeByItem.get(id);
+        if (!bubble) {
+          bubble = document.createElement('div');
+          bubble.className = 'message ai streaming';
+          chat.appendChild(bubble);
+          nodeByItem.set(id, bubble);
+        }
+        bubble.textContent = (parsed.transcript || "").trim();
+        bubble.classList.remove('streaming');
+        chat.scrollTop = chat.scrollHeight;
+
+        // ★追加：AI確定発話をログ保存用に保持
+        const t = (parsed.transcript || "").trim();
+        if (t) logTurn("assistant", t);
+      }
+
+      // ★追加：レスポンス終了で inFlight を解除（次の1000ms無音でまた開始できる）
+      if (parsed.type === "response.done") {
+        responseInFlight = false;
+      }
+
+      else {
+        console.debug("📘 他イベント:", parsed.type);
+      }
+    } catch (e) {
+      console.warn("⚠️ 非JSONメッセージ:", msg);
+      if (msg.toLowerCase().includes("response")) {
+        appendAI(msg);
+      } else {
+        appendUser(msg);
+      }
+    }
+  };
+  const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
+  stream.getTracks().forEach((track)=>pc.addTrack(track, stream));
+
+  // ✅ リモート音声を再生する MediaStreamTrack を処理
+  pc.ontrack = (event) => {
+    const remoteStream = event.streams[0];
+    const audioEl = document.createElement("audio");
+    audioEl.srcObject = remoteStream;
+    audioEl.autoplay = true;
+    document.body.appendChild(audioEl);
+    appendStatus("🎧 リモート音声ストリーム受信中...");
+  };
+
+  // ✅ onconnectionstatechange でデバッグ出力
+  pc.onconnectionstatechange = () => {
+    appendStatus("PeerConnection 状態: " + pc.connectionState);
+  };
+
+  // ✅ DataChannel受信も確認
+  pc.ondatachannel = (event) => {
+    const ch = event.channel;
+    ch.onmessage = (ev) => appendStatus("📩 DataChannel message: " + ev.data);
+  };
+
+  const offer = await pc.createOffer();
+  await pc.setLocalDescription(offer);
+  return offer;
+}
+
+async function endAndSave(){
+  const payload = { ended_at: Date.now(), transcript: transcriptLog };
+  const res = await fetch(`/api/session/${SESSION_ID}/transcript`, {
+    method: "POST",
+    headers: {"Content-Type":"application/json"},
+    body: JSON.stringify(payload)
+  });
+  if(res.ok){
+    location.href = `/feedback/${SESSION_ID}`;
+  } else {
+    appendStatus("保存失敗: " + res.status);
+  }
+}
+
+document.getElementById('start-btn').addEventListener('click', startRealtime);
+document.getElementById('end-btn').addEventListener('click', endAndSave);
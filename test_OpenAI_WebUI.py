@@ -1,37 +1,116 @@
-# eventlet.monkey_patch() は最初に呼び出す必要があります
-import eventlet
-eventlet.monkey_patch()
+# 起動時間の計測（/api/startup で参照できる）
+import time
+_BOOT_T0 = time.perf_counter()
+_BOOT_PHASES = []
+
+def _boot_mark(name):
+    _BOOT_PHASES.append((name, time.perf_counter()))
+
+# 並行処理の方式（APP_CONCURRENCY=eventlet|gevent|threading、既定 eventlet）。concurrency.py 参照
+# monkey patch は import では行わない。直接起動（python test_OpenAI_WebUI.py）のときだけ最初にここで行い、
+# gunicorn などでは起動側のワーカー（-k eventlet / -k gevent）の patch に合わせる
+import concurrency
+if __name__ == "__main__":
+    concurrency.patch()
+_boot_mark("monkey_patch")
 
 import os
 from dotenv import load_dotenv
 load_dotenv()  # .env を読み込む（ローカル用）
 
+import re
+import sys
+import binascii
 import json
+import json_codec
 import threading
 import base64
 from datetime import datetime, timezone, timedelta
 from flask import Flask, render_template, request, redirect, url_for, jsonify, session
-from flask_socketio import SocketIO, emit
-import websocket
+from flask_socketio import SocketIO, emit, join_room
 import queue
 from functools import wraps
+# websocket（LEGACY経路）と jwt は使う時に import する（起動時間短縮）
+_boot_mark("imports")
 
 # 追加
-from session_store import SQLiteSessionStore
-store = SQLiteSessionStore(os.environ.get("SQLITE_PATH") or "app.db")
+from session_store import ImportAborted, SQLiteSessionStore
+from audio_transport import AudioTransport, pcm_to_wav
+from event_dispatch import EventDispatcher
+from emit_bus import session_room
+# SESSION_CACHE_BYTES: get_session/get_transcript/get_feedback のLRUキャッシュ容量（0で無効）
+# SQLITE_EXECUTOR: DB処理の実行場所（native=eventlet/gevent ならネイティブスレッドで実行し hub を止めない / inline）
+store = SQLiteSessionStore(
+    os.environ.get("SQLITE_PATH") or "app.db",
+    cache_bytes=int(os.environ.get("SESSION_CACHE_BYTES") or 8 * 1024 * 1024),
+    executor=os.environ.get("SQLITE_EXECUTOR") or concurrency.default_db_executor(),
+    executor_max_pending=int(os.environ.get("SQLITE_EXECUTOR_MAX_PENDING") or 64),
+)
+_boot_mark("store")
 
 # Flaskアプリケーションの設定
 app = Flask(__name__)
 
+# JSON_CODEC: jsonify / get_json・ストア・Realtime 中継の JSON 処理（auto=orjson があれば使う / orjson / stdlib）
 try:
-    app.json.ensure_ascii = False   # Flask 2.2+ 系
-except Exception:
+    app.json = json_codec.flask_provider_class()(app)   # Flask 2.2+ 系（ensure_ascii=False 相当）
+except ImportError:
     app.config['JSON_AS_ASCII'] = False  # 旧Flask互換
     
 app.config['SECRET_KEY'] = 'secret!'
 app.config['SESSION_COOKIE_SAMESITE'] = 'Strict'
 app.config['SESSION_COOKIE_HTTPONLY'] = True
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
+# SOCKETIO_MESSAGE_QUEUE: 複数ワーカーで emit を共有するメッセージキュー（未指定なら単一プロセス）
+#   unix:///path（emit_bus.py の broker）/ local://（同一プロセス・テスト用）/ redis:// 等は Flask-SocketIO にそのまま渡す
+SOCKETIO_MESSAGE_QUEUE = os.environ.get("SOCKETIO_MESSAGE_QUEUE") or ""
+_socketio_options = {}
+if SOCKETIO_MESSAGE_QUEUE:
+    from emit_bus import make_client_manager
+    _channel = os.environ.get("SOCKETIO_CHANNEL") or "flask-socketio"
+    _bus_manager = make_client_manager(SOCKETIO_MESSAGE_QUEUE, channel=_channel)
+    if _bus_manager is not None:
+        _socketio_options["client_manager"] = _bus_manager
+    else:
+        _socketio_options.update(message_queue=SOCKETIO_MESSAGE_QUEUE, channel=_channel)
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=concurrency.async_mode(), json=json_codec,
+                    **_socketio_options)
+
+# JINJA_BYTECODE_CACHE_DIR: コンパイル済みテンプレートをワーカー間・再起動間で共有
+if os.environ.get("JINJA_BYTECODE_CACHE_DIR"):
+    from jinja2 import FileSystemBytecodeCache
+    os.makedirs(os.environ["JINJA_BYTECODE_CACHE_DIR"], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(os.environ["JINJA_BYTECODE_CACHE_DIR"])
+
+# ============================================================
+# 静的アセットと応答の圧縮（asset_delivery.py）
+#  - static/ は /assets/<内容のハッシュ>/<name> で配信（immutable・1年キャッシュ、gzip/br は事前に作成）
+#    テンプレートでは {{ asset_url('practice.js') }}
+#  - HTML / JSON の応答を Accept-Encoding に応じて gzip（brotli モジュールがあれば br）で圧縮
+#    RESPONSE_COMPRESS=0 で無効。RESPONSE_COMPRESS_MIN_BYTES 未満は圧縮しない
+# ============================================================
+from asset_delivery import StaticAssets, ResponseCompressor
+
+static_assets = StaticAssets(app.static_folder)
+app.jinja_env.globals["asset_url"] = static_assets.url
+RESPONSE_COMPRESS = os.environ.get("RESPONSE_COMPRESS", "1") == "1"
+response_compressor = ResponseCompressor(
+    min_bytes=int(os.environ.get("RESPONSE_COMPRESS_MIN_BYTES") or 1024)) if RESPONSE_COMPRESS else None
+
+@app.route("/assets/<version>/<path:filename>")
+def static_asset(version, filename):
+    result = static_assets.respond(filename, version, request.headers.get("Accept-Encoding"),
+                                   request.headers.get("If-None-Match"))
+    if result is None:
+        return "not found", 404
+    status, body, headers = result
+    return app.response_class(body, status=status, headers=headers)
+
+@app.after_request
+def _compress_response(response):
+    if response_compressor is None:
+        return response
+    return response_compressor(response, request.headers.get("Accept-Encoding"))
+_boot_mark("app")
 
 # ============================================================
 # SEC-001: 簡易認可（PIN）
@@ -91,7 +170,16 @@ def logout():
 
 # OpenAI用の環境変数取得
 key = os.environ.get("OPEN_AI_KEY")
-url = "wss://api.openai.com/v1/realtime?model=gpt-realtime"
+# OPENAI_REALTIME_URL: 接続先の差し替え（fake_realtime_server.py での再生・負荷試験用）
+url = os.environ.get("OPENAI_REALTIME_URL") or "wss://api.openai.com/v1/realtime?model=gpt-realtime"
+
+# ============================================================
+# Realtime 受信フレームの記録（realtime_replay.py で再生できる）
+#  - REALTIME_RECORD_DIR を指定すると1接続1ファイルで記録
+#  - REALTIME_RECORD_AUDIO=0 で音声本体（response.audio.delta）を省く
+# ============================================================
+REALTIME_RECORD_DIR = os.environ.get("REALTIME_RECORD_DIR") or ""
+REALTIME_RECORD_AUDIO = os.environ.get("REALTIME_RECORD_AUDIO", "1") == "1"
 
 # ============================================================
 # LEGACY: OpenAI Realtime WebSocket経路（Socket.IO連携）を使うか
@@ -119,8 +207,16 @@ def init_client_state(sid):
 
 def cleanup_client_state(sid):
     if sid in client_states:
+        _collect_audio_vad_stats(client_states[sid])
+        _close_recorder(client_states[sid])
         del client_states[sid]
 
+def _close_recorder(state):
+    rec = state.pop("recorder", None) if state else None
+    if rec is not None:
+        rec.close()
+        print(f"realtime recording saved: {rec.path} ({rec.frames} frames)")
+
 def _make_session_view(meta, session_id=None):
     """
     templates 側（practice.html / feedback.html）が期待する
@@ -247,7 +343,8 @@ def practice(session_id):
         session_id=session_id,
         scenario_title=meta.title,
         instructions=meta.instructions,
-        session=session_view
+        session=session_view,
+        rolling_feedback=rolling_analyzer is not None
     )
 
 @app.route("/home")
@@ -294,6 +391,63 @@ def session_start():
     meta = store.create_session(scenario_id, instructions)
     return redirect(url_for("index", session_id=meta.session_id))
 
+# ============================================================
+# シナリオのおすすめ（scenario_index.py）
+#  - 文字 n-gram TF-IDF の類似度を起動直後にバックグラウンドで計算しておく
+#  - SCENARIO_RECOMMEND=0 で無効化
+# ============================================================
+SCENARIO_RECOMMEND = os.environ.get("SCENARIO_RECOMMEND", "1") == "1"
+_scenario_index = None
+_scenario_index_lock = threading.Lock()
+
+def _get_scenario_index():
+    """構築済みならそれを、まだなら（最初の1回だけ）その場で作る"""
+    global _scenario_index
+    if _scenario_index is None:
+        with _scenario_index_lock:
+            if _scenario_index is None:
+                from scenario_index import ScenarioIndex
+                _scenario_index = ScenarioIndex.build(store.list_scenarios())
+    return _scenario_index
+
+def _recommend_for_feedback(meta, feedback_data, k=3):
+    """next_drill（無ければ改善点）に合うシナリオ。今のシナリオは除く"""
+    if not SCENARIO_RECOMMEND or not meta or not isinstance(feedback_data, dict):
+        return []
+    text = feedback_data.get("next_drill") or " ".join(feedback_data.get("improvements") or [])
+    if not text:
+        return []
+    return _get_scenario_index().recommend(text, k=k, exclude=meta.scenario_id)
+
+def _recommend_k():
+    try:
+        return max(1, min(int(request.args.get("k", 5)), 20))
+    except ValueError:
+        return 5
+
+@app.route("/api/scenarios/<scenario_id>/similar")
+@require_auth
+def api_similar_scenarios(scenario_id):
+    if not store.find_scenario(scenario_id):
+        return jsonify({"ok": False, "error": "scenario not found"}), 404
+    items = _get_scenario_index().similar(scenario_id, k=_recommend_k(), mode=request.args.get("mode"))
+    return jsonify({"ok": True, "scenario_id": scenario_id, "items": items})
+
+@app.route("/api/scenarios/recommend")
+@require_auth
+def api_recommend_scenarios():
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify({"ok": False, "error": "q is required"}), 400
+    items = _get_scenario_index().recommend(q, k=_recommend_k(), exclude=request.args.get("exclude"),
+                                            mode=request.args.get("mode"))
+    return jsonify({"ok": True, "items": items})
+
+@app.route("/api/scenarios/index/stats")
+@require_auth
+def api_scenario_index_stats():
+    return jsonify(_get_scenario_index().info())
+
 @app.route("/history")
 def history():
     # UI改善（溜まり過ぎ対策）：/history をページング表示
@@ -390,13 +544,20 @@ def feedbacks():
 
 @app.route("/feedback/<session_id>")
 def feedback(session_id):
-    meta = store.get_session(session_id)
-    log = store.get_transcript(session_id)
+    # meta / transcript / feedback を1クエリ（+キャッシュ）でまとめて取得
+    meta, log, feedback_data = store.get_session_bundle(session_id)
 
     # ★追加：feedback.html が期待する変数名に合わせて渡す（既存は残す）
     session_view = _make_session_view(meta, session_id=session_id)
     transcript = log
-    feedback_data = store.get_feedback(session_id)  # ★変更：保存済みフィードバックを取得
+
+    feedback_pending = False
+    if feedback_pregen and meta and log:
+        feedback_pending = feedback_pregen.note_view(session_id, feedback_data) == "pending"
+
+    # まだ無ければローカル採点の暫定フィードバックを表示（保存はしない）
+    if feedback_data is None and FEEDBACK_PROVISIONAL and meta and log and log.get("transcript"):
+        feedback_data = _provisional_feedback(meta, log["transcript"])
 
     return render_template(
         "feedback.html",
@@ -405,235 +566,169 @@ def feedback(session_id):
         session_id=session_id,
         session=session_view,
         transcript=transcript,
-        feedback=feedback_data
+        feedback=feedback_data,
+        feedback_pending=feedback_pending,
+        recommendations=_recommend_for_feedback(meta, feedback_data)
     )
 
+# ============================================================
+# ローカル採点による暫定フィードバック（LLM結果が無い間だけ表示）
+#  - FEEDBACK_PROVISIONAL=0 で無効化
+# ============================================================
+FEEDBACK_PROVISIONAL = os.environ.get("FEEDBACK_PROVISIONAL", "1") == "1"
+
+def _provisional_feedback(meta, transcript):
+    from heuristic_scorer import score_transcript
+    s = store.find_scenario(meta.scenario_id) or {}
+    return score_transcript(transcript, s.get("focus"))
+
+@app.route("/api/session/<session_id>/feedback/provisional")
+@require_auth
+def api_provisional_feedback(session_id):
+    meta, log, _ = store.get_session_bundle(session_id)
+    if not meta:
+        return jsonify({"ok": False, "error": "session not found"}), 404
+    transcript = (log or {}).get("transcript") or []
+    if not transcript:
+        return jsonify({"ok": False, "error": "transcript is empty"}), 400
+    return jsonify({"ok": True, "feedback": _provisional_feedback(meta, transcript)})
+
 @app.post("/api/session/<session_id>/transcript")
 @require_auth
 def api_save_transcript(session_id):
     payload = request.get_json(force=True)
     ok = store.save_transcript(session_id, payload)
+    if ok and feedback_pregen and (payload or {}).get("transcript"):
+        if drain.draining:
+            drain.defer("feedback", session_id)  # 次の起動で生成する
+        else:
+            feedback_pregen.schedule(session_id)
+    if ok:
+        _schedule_session_vector(session_id)
     return jsonify({"ok": ok}), (200 if ok else 404)
 
 # ▼▼▼ 追加：フィードバック生成API（最小差分で追加） ▼▼▼
-def _generate_feedback_with_openai(meta, transcript):
-    """
-    transcript（list[dict]）から簡易フィードバックを生成する。
-    - 失敗時は {"error": "..."} を返す
-    - 成功時は dict（JSONにできる形）を返す
-    """
-    try:
-        import requests
+# 生成・正規化ロジックはバッチ（feedback_batch.py）と共有するため feedback_generator.py へ移動
+from feedback_generator import (
+    generate_feedback_with_openai as _generate_feedback_with_openai,
+    normalize_feedback_payload as _normalize_feedback_payload,
+)
 
-        api_key = os.environ.get("OPEN_AI_KEY") or os.environ.get("OPENAI_API_KEY")
-        if not api_key:
-            return {"error": "OPEN_AI_KEY (or OPENAI_API_KEY) が設定されていません"}
+# ============================================================
+# OpenAI 呼び出しの入場制御（優先度: sdp/realtime > feedback > background）
+#  - 全体 UPSTREAM_MAX_CONCURRENT / UPSTREAM_RPM / UPSTREAM_BURST
+#  - クラスごと UPSTREAM_<CLASS>_CONCURRENCY / _QUEUE / _WAIT_SEC
+#  - 満杯・待ち時間超過は 503 + Retry-After で断る。上流の 429 で全体を一時停止
+# ============================================================
+import feedback_generator as fg
+from upstream_admission import AdmissionController, AdmissionRejected
 
-        model = os.environ.get("FEEDBACK_MODEL") or "gpt-4o-mini"
+admission = AdmissionController.from_env()
+fg.add_rate_limit_listener(admission.penalize)
 
-        title = ""
-        instructions = ""
-        try:
-            title = getattr(meta, "title", "") or ""
-        except Exception:
-            title = ""
-        try:
-            instructions = getattr(meta, "instructions", "") or ""
-        except Exception:
-            instructions = ""
-
-        def _clip(s, n=500):
-            s = s or ""
-            return s if len(s) <= n else s[:n] + "…"
-
-        lines = []
-        for t in transcript:
-            role = (t.get("role") or "").strip()
-            text = (t.get("text") or "").strip()
-            if not role or not text:
-                continue
-            if role == "user":
-                lines.append(f"ユーザー: {_clip(text)}")
-            elif role == "assistant":
-                lines.append(f"AI: {_clip(text)}")
-            else:
-                lines.append(f"{role}: {_clip(text)}")
-
-        convo_text = "\n".join(lines)
-
-        system = (
-            "あなたは会話練習のコーチです。日本語で、短く具体的にフィードバックしてください。"
-            "相手を傷つけないトーンで、改善点は行動に落とせる形で提案してください。"
-        )
-        user = (
-            f"シナリオ: {title}\n"
-            f"追加指示: {instructions}\n\n"
-            "以下の会話ログ（全体）を読んで、次のJSON形式で返してください。\n"
-            "※ユーザーの最初の返答だけでなく、会話の流れ全体を対象にしてください。\n"
-            "{\n"
-            "  \"summary\": \"会話の要約（2〜4行。状況/論点/結論が分かるように）\",\n"
-            "  \"score\": 0,\n"
-            "  \"good_points\": [\"良かった点（最大3）\"],\n"
-            "  \"improvements\": [\"改善点（最大3。次回すぐ実行できる具体行動で）\"],\n"
-            "  \"better_questions\": [\"次に確認すべき質問（最大3）\"],\n"
-            "  \"key_moments\": [\n"
-            "    \"【局面】(いつ/何に対して)\\n【狙い】(相手が知りたいこと)\\n【改善】(こう言うと良い)\\n【模範（ユーザー）】(1〜3文)\\n【短い言い換え】(1文)\",\n"
-            "    \"...（2〜5個）\"\n"
-            "  ],\n"
-            "  \"model_answer\": \"模範会話例（2〜4往復。ユーザーと相手の両方を書き、重要局面ではユーザーの返しを示す）\",\n"
-            "  \"alt_phrasings\": [\"言い換え例（柔らかめ）\", \"言い換え例（端的）\"],\n"
-            "  \"next_actions\": [\"次回の練習でやること（最大3）\"],\n"
-            "  \"next_drill\": \"次の1本ノック（次回の練習テーマを1つ。短く）\"\n"
-            "}\n\n"
-            "会話ログ:\n"
-            f"{convo_text}"
-        )
+def _admission_rejected_response(e):
+    resp = jsonify({"ok": False, "error": f"upstream busy ({e.reason})", "retry_after": e.retry_after_header})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = e.retry_after_header
+    return resp
 
-        payload = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": system},
-                {"role": "user", "content": user},
-            ],
-            "temperature": 0.2,
-        }
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        }
-        data = None
-        last_err = None
-        for _ in range(2):
-            try:
-                res = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload, timeout=60)
-                res.raise_for_status()
-                data = res.json()
-                last_err = None
-                break
-            except Exception as e:
-                last_err = e
-                data = None
-        if last_err is not None:
-            raise last_err
-
-        content = None
-        try:
-            content = data["choices"][0]["message"]["content"]
-        except Exception:
-            content = None
+@app.route("/api/socketio/bus/stats")
+@require_auth
+def api_socketio_bus_stats():
+    manager = socketio.server.manager
+    stats = manager.bus_stats() if hasattr(manager, "bus_stats") else {"backend": getattr(manager, "name", "local")}
+    return jsonify({"ok": True, "enabled": bool(SOCKETIO_MESSAGE_QUEUE), "stats": stats})
 
-        if isinstance(content, str) and content.strip():
-            try:
-                parsed = json.loads(content)
-                if isinstance(parsed, dict):
-                    return parsed
-                return {"text": content}
-            except Exception:
-                return {"text": content}
+@app.route("/api/upstream/stats")
+@require_auth
+def api_upstream_stats():
+    return jsonify({"ok": True, "stats": admission.stats()})
 
-        return {"error": "フィードバック生成に失敗しました（contentが空）"}
+# ============================================================
+# ターンごとの逐次分析（セッション終了時の生成を小さな最終呼び出しだけにする）
+#  - FEEDBACK_ROLLING=1 で有効（デフォルトOFF）
+#  - ターンは POST /api/session/<id>/turns か LEGACY WebSocket の中継で追加
+# ============================================================
+FEEDBACK_ROLLING = os.environ.get("FEEDBACK_ROLLING", "0") == "1"
+rolling_analyzer = None
+if FEEDBACK_ROLLING:
+    from rolling_feedback import RollingFeedbackAnalyzer
+
+    def _rolling_turn_post(payload):
+        # ターンごとの分析は background 扱い（最終呼び出しは呼び出し元の枠で行う）
+        with admission.slot("background"):
+            return RollingFeedbackAnalyzer._default_post(payload)
+
+    rolling_analyzer = RollingFeedbackAnalyzer(socketio.start_background_task, post=_rolling_turn_post,
+                                               final_post=RollingFeedbackAnalyzer._default_post)
+
+def _generate_feedback(session_id, meta, transcript):
+    """逐次分析があればそれを使い、無ければ会話全体から生成する（正規化済みで返す）"""
+    result = None
+    if rolling_analyzer:
+        result = rolling_analyzer.finalize(session_id, meta, transcript)
+    if result is None:
+        result = _generate_feedback_with_openai(meta, transcript)
+    return _normalize_feedback_payload(result)
+
+def _generate_feedback_for_session(session_id):
+    meta, log, _ = store.get_session_bundle(session_id)
+    transcript = (log or {}).get("transcript") or []
+    if not meta or not transcript:
+        return {"error": "session or transcript not found"}
+    return _generate_feedback(session_id, meta, transcript)
+
+def _pregenerate_feedback(session_id):
+    """先行生成は background 枠で（混んでいれば諦めて、画面を開いたときに生成する）"""
+    try:
+        with drain.job("feedback", session_id), admission.slot("background"):
+            return _generate_feedback_for_session(session_id)
+    except AdmissionRejected as e:
+        return {"error": str(e)}
 
-    except Exception as e:
-        return {"error": f"フィードバック生成エラー: {e}"}
+@app.post("/api/session/<session_id>/turns")
+@require_auth
+def api_append_turns(session_id):
+    """確定したターン（{"turns": [{role,text,ts}, ...]}）を逐次分析に追加する"""
+    if not rolling_analyzer:
+        return jsonify({"ok": False, "error": "rolling feedback is disabled"}), 404
+    if drain.draining:
+        return _draining_response()
+    meta = store.get_session(session_id)
+    if not meta:
+        return jsonify({"ok": False, "error": "session not found"}), 404
+    payload = request.get_json(force=True) or {}
+    n = rolling_analyzer.append_turns(session_id, meta, payload.get("turns") or [])
+    return jsonify({"ok": True, "turns": n})
 
+@app.route("/api/feedback/rolling/stats")
+@require_auth
+def api_feedback_rolling_stats():
+    if not rolling_analyzer:
+        return jsonify({"ok": True, "enabled": False})
+    return jsonify({"ok": True, "enabled": True, "stats": rolling_analyzer.stats()})
 
+# ============================================================
+# フィードバック先行生成（transcript 保存直後にバックグラウンドで生成）
+#  - FEEDBACK_PREGENERATE=1 で有効（デフォルトOFF）
+#  - 同時実行数 FEEDBACK_PREGENERATE_CONCURRENCY / 1時間あたり上限 FEEDBACK_PREGENERATE_PER_HOUR
+# ============================================================
+FEEDBACK_PREGENERATE = os.environ.get("FEEDBACK_PREGENERATE", "0") == "1"
+feedback_pregen = None
+if FEEDBACK_PREGENERATE:
+    from feedback_pregen import FeedbackPregenerator
+    feedback_pregen = FeedbackPregenerator(
+        store,
+        _pregenerate_feedback,
+        socketio.start_background_task,
+        max_concurrent=int(os.environ.get("FEEDBACK_PREGENERATE_CONCURRENCY") or 2),
+        max_per_hour=int(os.environ.get("FEEDBACK_PREGENERATE_PER_HOUR") or 200),
+        on_saved=lambda session_id, _: _on_feedback_saved(session_id),
+    )
 
-def _normalize_feedback_payload(payload):
-    """
-    OpenAIの返り値（JSON/テキスト/エラー）を templates で扱いやすい形に正規化する。
-    - summary: str
-    - good_points / improvements / next_actions: list[str]
-    - score: int
-    """
-    try:
-        if payload is None:
-            payload = {}
-        if isinstance(payload, str):
-            payload = {"text": payload}
-        elif not isinstance(payload, dict):
-            payload = {"text": str(payload)}
-
-        v = dict(payload)
-
-        def _as_str(x):
-            if x is None:
-                return ""
-            try:
-                return str(x)
-            except Exception:
-                return ""
-
-        def _as_list(x):
-            if x is None:
-                return []
-            if isinstance(x, list):
-                out = []
-                for it in x:
-                    s = _as_str(it).strip()
-                    if s:
-                        out.append(s)
-                return out
-            s = _as_str(x).strip()
-            return [s] if s else []
-
-        if not isinstance(v.get("summary"), str):
-            v["summary"] = _as_str(v.get("summary"))
-
-        if not v.get("summary"):
-            if v.get("error"):
-                v["summary"] = _as_str(v.get("error"))
-            elif v.get("text"):
-                v["summary"] = _as_str(v.get("text"))
-
-        v["good_points"] = _as_list(v.get("good_points"))
-        v["improvements"] = _as_list(v.get("improvements"))
-        v["next_actions"] = _as_list(v.get("next_actions"))
-        v["better_questions"] = _as_list(v.get("better_questions"))
-        v["key_moments"] = _as_list(v.get("key_moments"))
-
-        if not isinstance(v.get("model_answer"), str):
-            v["model_answer"] = _as_str(v.get("model_answer"))
-        v["alt_phrasings"] = _as_list(v.get("alt_phrasings"))
-        if not isinstance(v.get("next_drill"), str):
-            v["next_drill"] = _as_str(v.get("next_drill"))
-
-        score = v.get("score")
-        try:
-            v["score"] = int(score)
-        except Exception:
-            v["score"] = 0
-
-        if "better_questions" not in v:
-            v["better_questions"] = []
-        if "key_moments" not in v:
-            v["key_moments"] = []
-        if "model_answer" not in v:
-            v["model_answer"] = ""
-        if "alt_phrasings" not in v:
-            v["alt_phrasings"] = []
-        if "next_drill" not in v:
-            v["next_drill"] = ""
-
-        if "summary" not in v:
-            v["summary"] = ""
-        if "good_points" not in v:
-            v["good_points"] = []
-        if "improvements" not in v:
-            v["improvements"] = []
-        if "next_actions" not in v:
-            v["next_actions"] = []
-        if "score" not in v:
-            v["score"] = 0
-
-        return v
-    except Exception:
-        return {
-            "summary": "（フィードバックの整形に失敗しました）",
-            "good_points": [],
-            "improvements": [],
-            "next_actions": [],
-            "score": 0
-        }
+def _on_feedback_saved(session_id):
+    socketio.emit("feedback_ready", {"session_id": session_id}, room=session_room(session_id))
+    _schedule_session_vector(session_id)
 
 @app.post("/api/session/<session_id>/feedback/generate")
 @require_auth
@@ -646,12 +741,45 @@ def api_generate_feedback(session_id):
     transcript = log.get("transcript") or []
     if not transcript:
         return jsonify({"ok": False, "error": "transcript is empty"}), 400
+    if drain.draining:
+        return _draining_response()
+
+    # 先行生成が進行中なら、二重に呼ばずにその結果を待つ
+    if feedback_pregen:
+        joined = feedback_pregen.join(session_id)
+        if joined is not None:
+            return jsonify({"ok": True, "feedback": joined})
+        feedback_pregen.note_regenerated(store.get_feedback(session_id))
 
-    feedback_payload = _generate_feedback_with_openai(meta, transcript)
-    feedback_payload = _normalize_feedback_payload(feedback_payload)
+    try:
+        with drain.job("feedback", session_id), admission.slot("feedback"):
+            feedback_payload = _generate_feedback(session_id, meta, transcript)
+    except AdmissionRejected as e:
+        return _admission_rejected_response(e)
+    if feedback_payload.get("rate_limited"):
+        # 上流の 429：保存せず、入場制御の一時停止が明けるまで待ってもらう
+        retry_after = max(feedback_payload.get("retry_after") or 0, admission.stats()["paused_sec"])
+        return _admission_rejected_response(AdmissionRejected("feedback", "rate_limited", retry_after))
     ok = store.save_feedback(session_id, feedback_payload)
+    if ok:
+        _schedule_session_vector(session_id)
 
     return jsonify({"ok": ok, "feedback": feedback_payload}), (200 if ok else 404)
+
+@app.route("/api/session/<session_id>/feedback")
+@require_auth
+def api_feedback_status(session_id):
+    """フィードバック画面のポーリング用（先行生成の完了待ち）"""
+    pending = bool(feedback_pregen and feedback_pregen.in_flight(session_id))
+    ready = store.get_feedback(session_id) is not None
+    return jsonify({"ok": True, "pending": pending, "ready": ready})
+
+@app.route("/api/feedback/pregen/stats")
+@require_auth
+def api_feedback_pregen_stats():
+    if not feedback_pregen:
+        return jsonify({"ok": True, "enabled": False})
+    return jsonify({"ok": True, "enabled": True, "stats": feedback_pregen.stats()})
 # ▲▲▲ 追加ここまで ▲▲▲
 
 # ▼▼▼ STG-002: フィードバック削除API ▼▼▼
@@ -662,169 +790,405 @@ def api_delete_feedback(session_id):
     if not meta:
         return jsonify({"ok": False, "error": "session not found"}), 404
 
+    if feedback_pregen:
+        feedback_pregen.cancel(session_id)
     ok = store.delete_feedback(session_id)
     return jsonify({"ok": ok}), (200 if ok else 404)
 # ▲▲▲ 追加ここまで ▲▲▲
 
+# ▼▼▼ 追加：スコア集計（feedback_stats の集計テーブルのみ参照） ▼▼▼
+def _stats_query_args():
+    group_by = request.args.get("group_by") or "scenario_id"
+    try:
+        days = int(request.args.get("days") or "0")
+    except Exception:
+        days = 0
+    day_from = request.args.get("day_from")
+    if days > 0 and not day_from:
+        day_from = (datetime.now(JST) - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    return dict(
+        group_by=group_by,
+        mode=request.args.get("mode") or None,
+        shelf_id=request.args.get("shelf_id") or None,
+        scenario_id=request.args.get("scenario_id") or None,
+        day_from=day_from or None,
+        day_to=request.args.get("day_to") or None,
+    )
+
+@app.route("/api/stats")
+@require_auth
+def api_stats():
+    args = _stats_query_args()
+    try:
+        rows = store.get_score_stats(**args)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    return jsonify({"ok": True, "query": args, "stats": rows})
+
+@app.route("/stats")
+def stats():
+    args = _stats_query_args()
+    try:
+        rows = store.get_score_stats(**args)
+    except ValueError:
+        args["group_by"] = "scenario_id"
+        rows = store.get_score_stats(**args)
+    titles = {}
+    if args["group_by"] == "scenario_id":
+        titles = {s["id"]: s.get("title") or s["id"] for s in store.list_scenarios()}
+    elif args["group_by"] == "shelf_id":
+        titles = {sh["shelf_id"]: sh["shelf_title"] for sh in store.list_shelves()}
+    for r in rows:
+        r["label"] = titles.get(r["key"], r["key"])
+    return render_template("stats.html", stats=rows, query=args)
+# ▲▲▲ 追加ここまで ▲▲▲
+
+# ▼▼▼ 追加：NDJSON エクスポート/インポートAPI ▼▼▼
+@app.route("/api/export")
+@require_auth
+def api_export():
+    """
+    全セッション（transcript / feedback 付き）を NDJSON でストリーミング返却。
+    ?gzip=1 で gzip 圧縮。
+    """
+    from flask import Response, stream_with_context
+    import session_export
+
+    lines = session_export.iter_ndjson_lines(store)
+    if request.args.get("gzip") == "1":
+        return Response(
+            stream_with_context(session_export.iter_gzip_chunks(lines)),
+            mimetype="application/x-ndjson",
+            headers={
+                "Content-Encoding": "gzip",
+                "Content-Disposition": "attachment; filename=sessions.ndjson.gz",
+            },
+        )
+    return Response(
+        stream_with_context(lines),
+        mimetype="application/x-ndjson",
+        headers={"Content-Disposition": "attachment; filename=sessions.ndjson"},
+    )
+
+@app.post("/api/import")
+@require_auth
+def api_import():
+    """NDJSON（Content-Encoding: gzip 可）を一括取り込み"""
+    import gzip
+    import io
+    import session_export
+
+    stream = request.stream
+    if (request.headers.get("Content-Encoding") or "").lower() == "gzip":
+        stream = gzip.GzipFile(fileobj=stream)
+    try:
+        n = store.import_records(session_export.iter_records(io.TextIOWrapper(stream, encoding="utf-8")))
+    except ImportAborted as e:
+        # 失敗より前のバッチは書き込み済みなので、件数と行番号を返して続きから送り直せるようにする
+        return jsonify({"ok": False, "error": f"import error: {e.cause}",
+                        "imported": e.imported, "line": e.line}), 400
+    return jsonify({"ok": True, "imported": n})
+# ▲▲▲ 追加ここまで ▲▲▲
+
+# ============================================================
+# app.db のオンラインバックアップ（db_backup.py）
+#  - DB_BACKUP_DIR を指定すると有効。DB_BACKUP_INTERVAL_SEC > 0 で定期実行
+#  - DB_BACKUP_KEEP 世代を保持。1ステップ DB_BACKUP_PAGES ページ、ステップ間 DB_BACKUP_PAUSE_MS 休む
+#  - ストアのロックは取らない（専用の読み取り接続で WAL のスナップショットからコピー）
+# ============================================================
+DB_BACKUP_DIR = os.environ.get("DB_BACKUP_DIR") or ""
+db_backup_manager = None
+if DB_BACKUP_DIR:
+    from db_backup import BackupManager
+    db_backup_manager = BackupManager(
+        store.db_path,
+        DB_BACKUP_DIR,
+        keep=int(os.environ.get("DB_BACKUP_KEEP") or 7),
+        pages=int(os.environ.get("DB_BACKUP_PAGES") or 64),
+        pause_sec=float(os.environ.get("DB_BACKUP_PAUSE_MS") or 5) / 1000.0,
+        interval_sec=float(os.environ.get("DB_BACKUP_INTERVAL_SEC") or 0),
+    )
+    db_backup_manager.start()
+
+@app.post("/api/db/backup")
+@require_auth
+def api_db_backup():
+    """バックアップをバックグラウンドで開始（進捗は /api/db/backup/stats）"""
+    if not db_backup_manager:
+        return jsonify({"ok": False, "error": "backup is disabled (set DB_BACKUP_DIR)"}), 404
+    if drain.draining:
+        return _draining_response()
+    if not db_backup_manager.trigger():
+        return jsonify({"ok": False, "error": "backup already running"}), 409
+    return jsonify({"ok": True, "started": True}), 202
+
+@app.route("/api/db/backup/stats")
+@require_auth
+def api_db_backup_stats():
+    if not db_backup_manager:
+        return jsonify({"ok": True, "enabled": False})
+    return jsonify({"ok": True, "enabled": True, "stats": db_backup_manager.stats()})
+
+# ============================================================
+# 似た過去セッションの検索（session_vectors.py）
+#  - SESSION_VECTORS_DIR を指定すると有効（次元は SESSION_VECTORS_DIM、既定 256）
+#  - transcript / フィードバックの保存後にバックグラウンドで埋め込みを追記する
+#  - 既存セッションは python session_vectors.py build --db app.db --dir <dir> で登録
+# ============================================================
+SESSION_VECTORS_DIR = os.environ.get("SESSION_VECTORS_DIR") or ""
+session_vectors = None
+if SESSION_VECTORS_DIR:
+    from session_vectors import SessionVectorIndex, DEFAULT_DIM as _SESSION_VECTORS_DEFAULT_DIM
+    session_vectors = SessionVectorIndex(
+        SESSION_VECTORS_DIR, dim=int(os.environ.get("SESSION_VECTORS_DIM") or _SESSION_VECTORS_DEFAULT_DIM))
+
+def _index_session_vector(session_id):
+    with drain.job("vectors", session_id):
+        _, log, feedback_data = store.get_session_bundle(session_id)
+        if log:
+            session_vectors.add_session(session_id, log, feedback_data)
+
+def _schedule_session_vector(session_id):
+    if session_vectors is None:
+        return
+    if drain.draining:
+        drain.defer("vectors", session_id)  # 索引はドレインで閉じるので次の起動で追記する
+    else:
+        socketio.start_background_task(_index_session_vector, session_id)
+
+@app.route("/api/session/<session_id>/similar")
+@require_auth
+def api_similar_sessions(session_id):
+    if session_vectors is None:
+        return jsonify({"ok": False, "error": "session vectors are disabled (set SESSION_VECTORS_DIR)"}), 404
+    if drain.draining:
+        return _draining_response()  # 索引はドレインの最後に閉じる
+    if not store.get_session(session_id):
+        return jsonify({"ok": False, "error": "session not found"}), 404
+    try:
+        k = max(1, min(int(request.args.get("k", 10)), 100))
+    except ValueError:
+        k = 10
+    if session_id not in session_vectors:
+        _index_session_vector(session_id)
+    items = []
+    for sid, score in session_vectors.similar(session_id, k):
+        meta = store.get_session(sid)
+        if not meta:
+            continue  # 削除済み
+        fb = store.get_feedback(sid)
+        items.append({
+            "session_id": sid,
+            "score": round(score, 4),
+            "scenario_id": meta.scenario_id,
+            "title": meta.title,
+            "created_at": _format_created_at(meta.created_at),
+            "feedback_score": fb.get("score") if isinstance(fb, dict) else None,
+        })
+    return jsonify({"ok": True, "session_id": session_id, "items": items})
+
+@app.route("/api/session-vectors/stats")
+@require_auth
+def api_session_vectors_stats():
+    if session_vectors is None:
+        return jsonify({"ok": True, "enabled": False})
+    return jsonify({"ok": True, "enabled": True, "stats": session_vectors.stats()})
+
+def _relay_turn(state, role, text):
+    """LEGACY経路：確定発話を逐次分析に渡す（接続時に session_id が指定されている場合のみ）"""
+    session_id = state.get("session_id")
+    if not rolling_analyzer or not session_id:
+        return
+    meta = store.get_session(session_id)
+    if meta:
+        rolling_analyzer.append_turns(session_id, meta, [{"role": role, "text": text, "ts": int(time.time() * 1000)}])
+
+# ============================================================
+# Realtime 受信イベントの処理（type ごとのハンドラを登録して dict 引きで振り分け）
+#  - handler(ws, state, sid, data) は単体でも呼べる
+#  - type ごとの件数・処理時間は /api/realtime/events/stats
+# ============================================================
+_JAPANESE_RE = re.compile(r'[\u3040-\u30FF\u4E00-\u9FFF]')
+# delta ごと（毎秒数十件）のデバッグ出力は REALTIME_VERBOSE_LOG=1 のときだけ
+REALTIME_VERBOSE_LOG = os.environ.get("REALTIME_VERBOSE_LOG", "0") == "1"
+
+def is_valid_japanese(text):
+    return bool(_JAPANESE_RE.search(text or ""))
+
+def _on_unknown_event(ws, state, sid, message_data):
+    msg_type = message_data.get("type")
+    print(f"メッセージ受信：{msg_type}")
+    socketio.emit('status_message', {'message': f"メッセージ受信：{msg_type}"}, room=sid)
+
+realtime_events = EventDispatcher(
+    default=_on_unknown_event,
+    timed=os.environ.get("REALTIME_EVENT_TIMING", "1") == "1",
+)
+
+@realtime_events.on("error")
+def _on_error_event(ws, state, sid, message_data):
+    print("メッセージ受信：error")
+    print("エラー内容:", message_data)
+    socketio.emit('status_message', {'message': f"AIサーバーエラー: {message_data}"}, room=sid)
+
+@realtime_events.on("response.done")
+def _on_response_done(ws, state, sid, message_data):
+    print("メッセージ受信：response.done")
+    socketio.emit('status_message', {'message': 'AIの応答が完了しました。'}, room=sid)
+
+@realtime_events.on("response.text.final")
+def _on_response_text_final(ws, state, sid, message_data):
+    final_text = message_data.get("text")
+    print(f"AIの応答（text.final）: {final_text}")
+    # text.final ではAI応答をemitしない
+
+@realtime_events.on("response.content_part.done")
+def _on_content_part_done(ws, state, sid, message_data):
+    content = message_data.get("content") or message_data.get("part")
+    if isinstance(content, dict):
+        text_or_transcript = content.get("text") or content.get("transcript") or ""
+    else:
+        text_or_transcript = str(content)
+    print(f"AIの応答（content_part.done）: {text_or_transcript}")
+    if text_or_transcript:
+        state["ai_transcription_buffer"] += text_or_transcript
+        # AI吹き出しを即時emit
+        socketio.emit('ai_message', {'message': text_or_transcript}, room=sid)
+
+@realtime_events.on("audio")
+def _on_audio(ws, state, sid, message_data):
+    transcript = message_data.get("transcript")
+    if transcript:
+        print(f"AIの応答（audio）: {transcript}")
+    # audio ではAI応答をemitしない
+
+@realtime_events.on("response.audio_transcript.delta")
+def _on_audio_transcript_delta(ws, state, sid, message_data):
+    delta = message_data.get("delta") or ""
+    state["ai_transcription_buffer"] += delta
+    if REALTIME_VERBOSE_LOG:
+        print(f"AIの応答（audio_transcript.delta）: {delta}")
+    # --- ストリーミング応答: delta受信ごとに段階的に送信 ---
+    if delta.strip():
+        socketio.emit('ai_message', {'message': state["ai_transcription_buffer"], 'turn': state["current_turn"], 'stream': True}, room=sid)
+        socketio.emit('status_message', {'message': 'AI応答(部分)ストリーミング送信'}, room=sid)
+
+@realtime_events.on("response.audio_transcript.done")
+def _on_audio_transcript_done(ws, state, sid, message_data):
+    final_ai_text = state["ai_transcription_buffer"]
+    state["ai_transcription_buffer"] = ""
+    print("メッセージ受信：response.audio_transcript.done")
+    # --- 各AI応答ごとにturnを進めて独立した吹き出しを確保 ---
+    state["current_turn"] += 1
+    if final_ai_text and final_ai_text.strip():
+        socketio.emit('ai_message', {'message': final_ai_text, 'turn': state["current_turn"]}, room=sid)
+        state["last_ai_message"] = final_ai_text
+        _relay_turn(state, "assistant", final_ai_text)
+        socketio.emit('status_message', {'message': 'AIの音声文字起こしが完了しました。'}, room=sid)
+    else:
+        socketio.emit('ai_message', {'message': '（無応答）', 'turn': state["current_turn"]}, room=sid)
+        print("final_ai_textが空のためダミーai_messageをemitしました")
+
+@realtime_events.on("user.transcription")
+def _on_user_transcription(ws, state, sid, message_data):
+    transcription = message_data.get("transcription")
+    print(f"ユーザーの発言(途中): {transcription}")
+
+@realtime_events.on("input_audio_buffer.committed")
+def _on_input_audio_committed(ws, state, sid, message_data):
+    transcription = message_data.get("transcription")
+    print(f"ユーザーの発言（committed中間）: {transcription}")
+    if transcription and len(transcription) > 2:
+        state["current_turn"] += 1
+        socketio.emit('user_message', {'message': transcription, 'turn': state["current_turn"], 'interim': True}, room=sid)
+
+@realtime_events.on("conversation.item.input_audio_transcription.completed")
+def _on_input_transcription_completed(ws, state, sid, message_data):
+    print("#################################")
+    print(message_data)
+    transcript = message_data.get("transcript")
+    if transcript and len(transcript) > 2 and is_valid_japanese(transcript):
+        state["current_turn"] += 1
+        socketio.emit('user_message', {'message': transcript, 'turn': state["current_turn"]}, room=sid)
+        _relay_turn(state, "user", transcript)
+        system_prompt = "あなたは親切で有能なアシスタントです。応答は簡潔に。"
+        instructions = f"{system_prompt}\n{transcript}"
+        response_create = {
+            "type": "response.create",
+            "response": {
+                "modalities": ["text","audio"],
+                "instructions": instructions
+            }
+        }
+        ws.send(json_codec.dumps(response_create))
+    else:
+        print(f"transcript無効: {transcript}")
+        print("response.create をユーザー発話に応じて送信しました。")
+
+@realtime_events.on("conversation.item.created")
+def _on_item_created(ws, state, sid, message_data):
+    print("#################################")
+    print(message_data)
+    # user_message emit を削除
+
+@realtime_events.on("response.audio.delta")
+def _on_audio_delta(ws, state, sid, message_data):
+    delta = message_data.get("delta")
+    if delta:
+        try:
+            audio_data = base64.b64decode(delta)
+            if REALTIME_VERBOSE_LOG:
+                print("audio delta head (hex):", binascii.hexlify(audio_data[:16]))
+            # PCMをバッファにappendのみ
+            state["audio_pcm_buffer"] += audio_data
+        except Exception as e:
+            print("audio delta decode error:", e)
+
+@realtime_events.on("response.audio.done")
+def _on_audio_done(ws, state, sid, message_data):
+    # バッファにたまったPCMをWAV化してemit
+    pcm_bytes = state["audio_pcm_buffer"]
+    if pcm_bytes:
+        try:
+            transport = _audio_transport(state)
+            pcm_bytes = bytes(pcm_bytes)
+            wav_bytes = pcm_to_wav(pcm_bytes) if transport.output == "wav" else None
+            # binary なら bytes のままバイナリ添付、base64 なら従来どおり文字列
+            socketio.emit('audio_data', transport.encode_out(pcm_bytes, wav_bytes), room=sid)
+        except Exception as e:
+            print("audio done decode error:", e)
+    # バッファクリア
+    state["audio_pcm_buffer"] = bytearray()
+
+@realtime_events.on("response.created")
+def _on_response_created(ws, state, sid, message_data):
+    print("メッセージ受信：response.created")
+    # --- 🔧 新規AI応答開始時にバッファ初期化 ---
+    state["ai_transcription_buffer"] = ""
+    state["last_ai_message"] = ""
+    print("AI応答バッファを初期化しました。")
+    socketio.emit('status_message', {'message': "メッセージ受信：response.created"}, room=sid)
+
 def on_message(ws, message, sid):
     try:
         state = client_states.get(sid)
         if not state:
             print(f"状態が見つかりません: {sid}")
             return
-        message_data = json.loads(message)
-        msg_type = message_data.get("type")
-
-        if msg_type == "error":
-            print("メッセージ受信：error")
-            print("エラー内容:", message_data)
-            socketio.emit('status_message', {'message': f"AIサーバーエラー: {message_data}"}, room=sid)
-
-        elif msg_type == "response.done":
-            print("メッセージ受信：response.done")
-            socketio.emit('status_message', {'message': 'AIの応答が完了しました。'}, room=sid)
-
-        elif msg_type == "response.text.final":
-            final_text = message_data.get("text")
-            print(f"AIの応答（text.final）: {final_text}")
-            # text.final ではAI応答をemitしない
-
-        elif msg_type == "response.content_part.done":
-            content = message_data.get("content") or message_data.get("part")
-            if isinstance(content, dict):
-                text_or_transcript = content.get("text") or content.get("transcript") or ""
-            else:
-                text_or_transcript = str(content)
-            print(f"AIの応答（content_part.done）: {text_or_transcript}")
-            if text_or_transcript:
-                state["ai_transcription_buffer"] += text_or_transcript
-                # AI吹き出しを即時emit
-                socketio.emit('ai_message', {'message': text_or_transcript}, room=sid)
-
-        elif msg_type == "audio":
-            transcript = message_data.get("transcript")
-            if transcript:
-                print(f"AIの応答（audio）: {transcript}")
-            # audio ではAI応答をemitしない
-
-        elif msg_type == "response.audio_transcript.delta":
-            delta = message_data.get("delta") or ""
-            state["ai_transcription_buffer"] += delta
-            print(f"AIの応答（audio_transcript.delta）: {delta}")
-            # --- ストリーミング応答: delta受信ごとに段階的に送信 ---
-            if delta.strip():
-                socketio.emit('ai_message', {'message': state["ai_transcription_buffer"], 'turn': state["current_turn"], 'stream': True}, room=sid)
-                socketio.emit('status_message', {'message': 'AI応答(部分)ストリーミング送信'}, room=sid)
-
-        elif msg_type == "response.audio_transcript.done":
-            # emitは下の162行目側でのみ行う（ここではバッファクリアのみ）
-            transcript = state["ai_transcription_buffer"]
-            state["ai_transcription_buffer"] = ""
-            print(f"AIの応答（audio_transcript.done）: {transcript}")
-            # emitしない
-
-        elif msg_type == "user.transcription":
-            transcription = message_data.get("transcription")
-            print(f"ユーザーの発言(途中): {transcription}")
-
-        elif msg_type == "input_audio_buffer.committed":
-            transcription = message_data.get("transcription")
-            print(f"ユーザーの発言（committed中間）: {transcription}")
-            if transcription and len(transcription) > 2:
-                state["current_turn"] += 1
-                socketio.emit('user_message', {'message': transcription, 'turn': state["current_turn"], 'interim': True}, room=sid)
-
-        elif msg_type == "conversation.item.input_audio_transcription.completed":
-            print("#################################")
-            print(message_data)
-            transcript = message_data.get("transcript")
-            import re
-            def is_valid_japanese(text):
-                return bool(re.search(r'[\u3040-\u30FF\u4E00-\u9FFF]', text or ""))
-            if transcript and len(transcript) > 2 and is_valid_japanese(transcript):
-                state["current_turn"] += 1
-                socketio.emit('user_message', {'message': transcript, 'turn': state["current_turn"]}, room=sid)
-                system_prompt = "あなたは親切で有能なアシスタントです。応答は簡潔に。"
-                instructions = f"{system_prompt}\n{transcript}"
-                response_create = {
-                    "type": "response.create",
-                    "response": {
-                        "modalities": ["text","audio"],
-                        "instructions": instructions
-                    }
-                }
-                ws.send(json.dumps(response_create))
-            else:
-                print(f"transcript無効: {transcript}")
-                print("response.create をユーザー発話に応じて送信しました。")
-
-        elif msg_type == "conversation.item.created":
-            print("#################################")
-            print(message_data)
-            # user_message emit を削除
-
-        elif msg_type == "response.audio.delta":
-            delta = message_data.get("delta")
-            if delta:
-                try:
-                    import binascii
-                    audio_data = base64.b64decode(delta)
-                    print("audio delta head (hex):", binascii.hexlify(audio_data[:16]))
-                    # PCMをバッファにappendのみ
-                    state["audio_pcm_buffer"] += audio_data
-                except Exception as e:
-                    print("audio delta decode error:", e)
-
-        elif msg_type == "response.audio_transcript.done":
-            final_ai_text = state["ai_transcription_buffer"]
-            state["ai_transcription_buffer"] = ""
-            print("メッセージ受信：response.audio_transcript.done")
-            # --- 各AI応答ごとにturnを進めて独立した吹き出しを確保 ---
-            state["current_turn"] += 1
-            if final_ai_text and final_ai_text.strip():
-                socketio.emit('ai_message', {'message': final_ai_text, 'turn': state["current_turn"]}, room=sid)
-                state["last_ai_message"] = final_ai_text
-                socketio.emit('status_message', {'message': 'AIの音声文字起こしが完了しました。'}, room=sid)
-            else:
-                socketio.emit('ai_message', {'message': '（無応答）', 'turn': state["current_turn"]}, room=sid)
-                print("final_ai_textが空のためダミーai_messageをemitしました")
-
-        elif msg_type == "response.audio.done":
-            # バッファにたまったPCMをWAV化してemit
-            pcm_bytes = state["audio_pcm_buffer"]
-            if pcm_bytes:
-                try:
-                    def pcm_to_wav(pcm_bytes, sample_rate=24000, channels=1):
-                        import io
-                        import wave
-                        with io.BytesIO() as wav_buffer:
-                            with wave.open(wav_buffer, "wb") as wav_file:
-                                wav_file.setnchannels(channels)
-                                wav_file.setsampwidth(2)  # 16bit
-                                wav_file.setframerate(sample_rate)
-                                wav_file.writeframes(pcm_bytes)
-                            return wav_buffer.getvalue()
-                    wav_bytes = pcm_to_wav(pcm_bytes)
-                    wav_b64 = base64.b64encode(wav_bytes).decode('ascii')
-                    socketio.emit('audio_data', {'audio': wav_b64}, room=sid)
-                except Exception as e:
-                    print("audio done decode error:", e)
-            # バッファクリア
-            state["audio_pcm_buffer"] = bytearray()
-        elif msg_type == "response.created":
-            print("メッセージ受信：response.created")
-            # --- 🔧 新規AI応答開始時にバッファ初期化 ---
-            state["ai_transcription_buffer"] = ""
-            state["last_ai_message"] = ""
-            print("AI応答バッファを初期化しました。")
-            socketio.emit('status_message', {'message': "メッセージ受信：response.created"}, room=sid)
-        else:
-            print(f"メッセージ受信：{msg_type}")
-            socketio.emit('status_message', {'message': f"メッセージ受信：{msg_type}"}, room=sid)
+        rec = state.get("recorder")
+        if rec is not None:
+            rec.record(message)
+        message_data = json_codec.loads(message)
+        realtime_events.dispatch(message_data.get("type"), ws, state, sid, message_data)
     except Exception as e:
         print(f"メッセージ処理エラー: {e}")
         socketio.emit('status_message', {'message': f"メッセージ処理エラー: {e}"}, room=sid)
 
+@app.route("/api/realtime/events/stats")
+@require_auth
+def api_realtime_event_stats():
+    return jsonify({"ok": True, "handlers": realtime_events.types(), "events": realtime_events.stats()})
+
 def on_error(ws, error, sid):
     print(f"WebSocket エラー: {error}")
     socketio.emit('status_message', {'message': f"WebSocket エラー: {error}"}, room=sid)
@@ -836,6 +1200,7 @@ def on_close(ws, close_status_code, close_msg, sid):
     if state:
         with state["ws_lock"]:
             state["ws_connection"] = None
+        _close_recorder(state)
 
 def on_open(ws, sid):
     print("Azure OpenAIサーバーに接続しました。")
@@ -857,7 +1222,7 @@ def on_open(ws, sid):
             },
         }
     }
-    ws.send(json.dumps(session_update))
+    ws.send(json_codec.dumps(session_update))
     print("セッションアップデートメッセージを送信しました。")
     socketio.emit('status_message', {'message': "セッションアップデートメッセージを送信しました。"}, room=sid)
     # response.create は「start_interview」イベント受信時のみ送信するように変更
@@ -876,6 +1241,7 @@ def on_open(ws, sid):
     socketio.emit('status_message', {'message': "AI初手発話は on_open では行いません。"}, room=sid)
 
 def start_websocket(sid):
+    import websocket  # LEGACY経路でのみ使用
     state = client_states.get(sid)
     if not state:
         print(f"状態が見つかりません: {sid}")
@@ -890,23 +1256,47 @@ def start_websocket(sid):
         if state["ws_connection"] is not None:
             print("既にWebSocket接続が存在します。新しい接続を開始しません。")
             return
-        state["ws_connection"] = websocket.WebSocketApp(
-            ws_url,
-            header=headers,
-            on_message=lambda ws, msg: on_message(ws, msg, sid),
-            on_error=lambda ws, err: on_error(ws, err, sid),
-            on_close=lambda ws, code, msg: on_close(ws, code, msg, sid),
-            on_open=lambda ws: on_open(ws, sid)
-        )
-    state["ws_connection"].run_forever()
+        try:
+            slot = admission.acquire("realtime")
+        except AdmissionRejected as e:
+            print(f"OpenAI への接続を見送りました: {e}")
+            socketio.emit('status_message', {'message': f"サーバーが混み合っています。{e.retry_after_header}秒後に再接続してください。"}, room=sid)
+            return
+        try:
+            if REALTIME_RECORD_DIR:
+                from realtime_replay import RealtimeRecorder
+                state["recorder"] = RealtimeRecorder.for_connection(
+                    REALTIME_RECORD_DIR, state.get("session_id") or sid, REALTIME_RECORD_AUDIO,
+                    {"session_id": state.get("session_id"), "url": ws_url})
+            state["ws_connection"] = websocket.WebSocketApp(
+                ws_url,
+                header=headers,
+                on_message=lambda ws, msg: on_message(ws, msg, sid),
+                on_error=lambda ws, err: on_error(ws, err, sid),
+                on_close=lambda ws, code, msg: on_close(ws, code, msg, sid),
+                on_open=lambda ws: on_open(ws, sid)
+            )
+        except Exception:
+            admission.release(slot)
+            raise
+    try:
+        state["ws_connection"].run_forever()
+    finally:
+        admission.release(slot)
 
 @socketio.on('connect')
 def handle_connect():
+    if drain.draining:
+        return False  # 新しいセッションは他のインスタンスへ（クライアントは再接続する）
     sid = request.sid
     print(f'クライアントが接続しました: {sid}')
     socketio.emit('status_message', {'message': "クライアントが接続しました。"}, room=sid)
     init_client_state(sid)
     state = client_states[sid]
+    state["session_id"] = request.args.get("session_id")  # 逐次分析の対象（任意）
+    if state["session_id"]:
+        # 別プロセス（先行生成・バッチ等）からも session 単位で届くように
+        join_room(session_room(state["session_id"]))
     with state["audio_worker_lock"]:
         if not state["audio_worker_started"]:
             # 音声再生ワーカーは現状未使用
@@ -926,10 +1316,6 @@ def handle_disconnect():
 # ============================================================
 # ✅ JWTトークン発行エンドポイントの追加
 # ============================================================
-import time
-import jwt
-from flask import jsonify
-
 JWT_SECRET = os.environ.get("JWT_SECRET_KEY", "local-dev-secret")
 JWT_EXP_SECONDS = 300  # トークン有効期限5分
 
@@ -937,6 +1323,7 @@ JWT_EXP_SECONDS = 300  # トークン有効期限5分
 @require_auth
 def issue_jwt_token():
     """Realtime API に直接接続するための一時JWTを発行"""
+    import jwt
     payload = {
         "aud": "openai-realtime",
         "iat": int(time.time()),
@@ -962,12 +1349,86 @@ def realtime_sdp_proxy():
             "Content-Type": "application/sdp",
             "OpenAI-Beta": "realtime=v1"
         }
-        url = "https://api.openai.com/v1/realtime?model=gpt-realtime"
-        res = requests.post(url, headers=headers, data=sdp_offer)
+        base_url = (os.environ.get("OPENAI_BASE_URL") or fg.DEFAULT_BASE_URL).rstrip("/")
+        url = f"{base_url}/realtime?model=gpt-realtime"
+        with admission.slot("sdp"):
+            res = requests.post(url, headers=headers, data=sdp_offer)
+        if res.status_code == 429:
+            admission.penalize(fg._parse_retry_after(res.headers))
         return res.text, res.status_code, {"Content-Type": "application/sdp"}
+    except AdmissionRejected as e:
+        return _admission_rejected_response(e)
     except Exception as e:
         print("SDP Proxy error:", e)
         return str(e), 500
+# ============================================================
+# マイク音声の前処理（フレーム化・無音カット）
+#  - AUDIO_VAD=0 で無効（従来どおり 1000 bytes 未満を捨てて転送）
+#  - 閾値などは AUDIO_VAD_* / シナリオの "audio_vad" で設定（audio_vad.py）
+# ============================================================
+AUDIO_VAD = os.environ.get("AUDIO_VAD", "1") == "1"
+audio_vad_totals = {"sessions": 0, "bytes_in": 0, "bytes_out": 0, "bytes_saved": 0, "chunks_out": 0, "latency_ms_max": 0.0}
+
+def _audio_preprocessor(state):
+    if not AUDIO_VAD:
+        return None
+    pre = state.get("audio_vad")
+    if pre is None:
+        from audio_vad import AudioPreprocessor, config_for_scenario
+        meta = store.get_session(state["session_id"]) if state.get("session_id") else None
+        scenario = store.find_scenario(meta.scenario_id) if meta else None
+        pre = state["audio_vad"] = AudioPreprocessor(config_for_scenario(scenario))
+    return pre
+
+def _send_audio_append(ws, pcm_bytes):
+    ws.send(json_codec.dumps({
+        "type": "input_audio_buffer.append",
+        "audio": base64.b64encode(pcm_bytes).decode("ascii")
+    }))
+
+def _collect_audio_vad_stats(state):
+    tr = state.get("audio_transport") if state else None
+    if tr is not None:
+        print(f"audio transport stats: {json.dumps(tr.stats(), ensure_ascii=False)}")
+    pre = state.get("audio_vad") if state else None
+    if pre is None:
+        return
+    st = pre.stats()
+    audio_vad_totals["sessions"] += 1
+    for k in ("bytes_in", "bytes_out", "bytes_saved", "chunks_out"):
+        audio_vad_totals[k] += st[k]
+    audio_vad_totals["latency_ms_max"] = max(audio_vad_totals["latency_ms_max"], st["latency_ms_max"])
+    print(f"audio vad stats: {json.dumps(st, ensure_ascii=False)}")
+
+@app.route("/api/audio/vad/stats")
+@require_auth
+def api_audio_vad_stats():
+    live = [s["audio_vad"].stats() for s in list(client_states.values()) if s.get("audio_vad") is not None]
+    return jsonify({"ok": True, "enabled": AUDIO_VAD, "totals": audio_vad_totals, "live": live})
+
+# ============================================================
+# ブラウザ⇔サーバーの音声形式（base64 / binary）の交渉
+#  - AUDIO_BINARY_TRANSPORT=0 で binary を許可しない（常に base64）
+# ============================================================
+AUDIO_BINARY_TRANSPORT = os.environ.get("AUDIO_BINARY_TRANSPORT", "1") == "1"
+
+def _audio_transport(state):
+    tr = state.get("audio_transport")
+    if tr is None:
+        tr = state["audio_transport"] = AudioTransport(allow_binary=AUDIO_BINARY_TRANSPORT)
+    return tr
+
+@socketio.on('audio_transport')
+def handle_audio_transport(data):
+    """audio_data の形式を交渉する（戻り値は ack としてクライアントに返る）"""
+    sid = request.sid
+    state = client_states.get(sid)
+    if not state:
+        return {"ok": False, "error": "state not found"}
+    result = _audio_transport(state).negotiate(data)
+    print(f"[audio_transport] {sid}: {result}")
+    return result
+
 # クライアントから音声データを受信し、OpenAI WebSocketに転送
 @socketio.on('audio_data')
 def handle_audio_data(data):
@@ -985,21 +1446,21 @@ def handle_audio_data(data):
         print(f"WebSocket接続が存在しません: {sid}")
         return
     try:
-        audio_b64 = data.get("audio")
-        if not audio_b64:
+        audio_bytes = _audio_transport(state).decode_in(data)
+        if not audio_bytes:
             print("audioデータが空です")
             return
-        import base64 as b64
-        audio_bytes = b64.b64decode(audio_b64)
+        pre = _audio_preprocessor(state)
+        if pre is not None:
+            # 小さいチャンクもフレームにまとめ、長い無音は捨ててから転送
+            for chunk in pre.push(audio_bytes):
+                _send_audio_append(ws, chunk)
+            return
         if len(audio_bytes) < 1000:
             print(f"audioデータが短すぎるため送信スキップ（{len(audio_bytes)} bytes）")
             socketio.emit('status_message', {'message': f"短小チャンクスキップ: {len(audio_bytes)} bytes"}, room=sid)
             return
-        input_audio = {
-            "type": "input_audio_buffer.append",
-            "audio": audio_b64
-        }
-        ws.send(json.dumps(input_audio))
+        _send_audio_append(ws, audio_bytes)
         socketio.emit('status_message', {'message': f"音声チャンク送信: {len(audio_bytes)} bytes"}, room=sid)
     except Exception as e:
         print(f"音声データ送信エラー: {e}")
@@ -1022,8 +1483,12 @@ def handle_audio_commit():
         print(f"WebSocket接続が存在しません: {sid}")
         return
     try:
+        pre = state.get("audio_vad")
+        if pre is not None:
+            for chunk in pre.flush():
+                _send_audio_append(ws, chunk)
         commit_msg = {"type": "input_audio_buffer.commit"}
-        ws.send(json.dumps(commit_msg))
+        ws.send(json_codec.dumps(commit_msg))
         print("[audio_commit] input_audio_buffer.commitを送信しました")
         socketio.emit('status_message', {'message': "commit送信完了"}, room=sid)
     except Exception as e:
@@ -1037,6 +1502,9 @@ def handle_start_process():
     if not ENABLE_LEGACY_OPENAI_WS:
         socketio.emit('status_message', {'message': "LEGACY経路は無効です（ENABLE_LEGACY_OPENAI_WS=1で有効化）"}, room=sid)
         return
+    if drain.draining:
+        socketio.emit('status_message', {'message': "サーバーを再起動します。しばらくしてから再接続してください。"}, room=sid)
+        return
     print(f"[start_process] クライアント {sid} から受信")
     # クライアント状態初期化（なければ）
     if sid not in client_states:
@@ -1063,12 +1531,343 @@ def handle_start_process():
             }
         }
         try:
-            ws.send(json.dumps(response_create))
+            ws.send(json_codec.dumps(response_create))
             print("[start_process] response.createを送信しました")
             socketio.emit('status_message', {'message': "AI初手発話を送信しました。"}, room=sid)
         except Exception as e:
             print("[start_process] response.create送信エラー:", e)
             socketio.emit('status_message', {'message': f"AI初手発話送信エラー: {e}"}, room=sid)
 
+# ============================================================
+# オンデマンドのプロファイリング（profiling.py）
+#  - PROFILING=1 で /api/debug/* を有効化（認証必須）。開始するまでサンプラーも tracemalloc も動かない
+#  - APP_PIN 未設定（認証なしで誰でも通る）のときは PROFILING=1 でも有効にせず、403 を返す
+#  - CPU: route（パス）か event（Socket.IO のイベント名）を指定すると、その処理中のサンプルだけ数える
+#  - PROFILING_MAX_SEC: CPU サンプリングの最長秒数
+# ============================================================
+PROFILING = os.environ.get("PROFILING", "0") == "1"
+profiler = None
+
+def _relay_buffer_sizes():
+    out = {"clients": 0, "relays_open": 0, "audio_pcm_bytes": 0, "audio_queue_items": 0, "transcription_chars": 0}
+    for state in list(client_states.values()):
+        out["clients"] += 1
+        out["relays_open"] += 1 if state.get("ws_connection") else 0
+        out["audio_pcm_bytes"] += len(state.get("audio_pcm_buffer") or b"")
+        q = state.get("audio_receive_queue")
+        out["audio_queue_items"] += q.qsize() if q is not None else 0
+        out["transcription_chars"] += (len(state.get("user_transcription_buffer") or "")
+                                       + len(state.get("ai_transcription_buffer") or ""))
+    return out
+
+if PROFILING and not _auth_enabled():
+    print("PROFILING=1 は APP_PIN が未設定のため無効にしました（/api/debug/* は認証必須）")
+elif PROFILING:
+    from profiling import Profiler, ProfilerBusy, deep_sizeof
+    profiler = Profiler(max_seconds=float(os.environ.get("PROFILING_MAX_SEC") or 60))
+    profiler.register_probe("client_states", lambda: {"clients": len(client_states), **deep_sizeof(client_states)})
+    profiler.register_probe("relay_buffers", _relay_buffer_sizes)
+    profiler.register_probe("store", lambda: {"cache": store.cache_stats(), "executor": store.executor_stats()})
+
+def _profiling_disabled():
+    if PROFILING:
+        return jsonify({"ok": False, "error": "profiling requires authentication (set APP_PIN)"}), 403
+    return jsonify({"ok": False, "error": "profiling is disabled (set PROFILING=1)"}), 404
+
+def _profile_target(payload):
+    """route / event の指定 → (表示名, 対象の関数)。見つからなければ ValueError"""
+    if payload.get("route"):
+        from werkzeug.exceptions import HTTPException
+        method = (payload.get("method") or "GET").upper()
+        try:
+            endpoint, _ = app.url_map.bind("localhost").match(payload["route"], method=method)
+        except HTTPException:
+            raise ValueError(f"route not found: {method} {payload['route']}")
+        return f"route:{method} {payload['route']}", [app.view_functions[endpoint]]
+    if payload.get("event"):
+        namespace = payload.get("namespace") or "/"
+        handler = socketio.server.handlers.get(namespace, {}).get(payload["event"])
+        if handler is None:
+            raise ValueError(f"event not found: {namespace} {payload['event']}")
+        return f"event:{namespace} {payload['event']}", [handler]
+    return None, []
+
+@app.post("/api/debug/profile/cpu")
+@require_auth
+def api_debug_profile_cpu_start():
+    """CPU サンプリングを開始（202）。結果は GET /api/debug/profile/cpu/<id>（?format=collapsed）"""
+    if profiler is None:
+        return _profiling_disabled()
+    payload = request.get_json(silent=True) or {}
+    try:
+        target, functions = _profile_target(payload)
+        summary = profiler.start_cpu(float(payload.get("seconds") or 10), float(payload.get("interval_ms") or 5),
+                                     target=target, functions=functions)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except ProfilerBusy as e:
+        return jsonify({"ok": False, "error": str(e)}), 409
+    return jsonify({"ok": True, "profile": summary}), 202
+
+@app.route("/api/debug/profile/cpu")
+@require_auth
+def api_debug_profile_cpu_list():
+    if profiler is None:
+        return _profiling_disabled()
+    return jsonify({"ok": True, "profiles": profiler.cpu_jobs()})
+
+@app.route("/api/debug/profile/cpu/<int:profile_id>")
+@require_auth
+def api_debug_profile_cpu_result(profile_id):
+    if profiler is None:
+        return _profiling_disabled()
+    job = profiler.cpu_job(profile_id)
+    if job is None:
+        return jsonify({"ok": False, "error": "profile not found"}), 404
+    if request.args.get("format") == "collapsed":
+        return app.response_class(job.collapsed(), mimetype="text/plain")
+    return jsonify({"ok": True, "profile": job.summary(top=int(request.args.get("top") or 20))})
+
+@app.post("/api/debug/memory/tracemalloc")
+@require_auth
+def api_debug_tracemalloc():
+    """{"action": "start", "frames": 10} / {"action": "stop"}"""
+    if profiler is None:
+        return _profiling_disabled()
+    payload = request.get_json(silent=True) or {}
+    action = payload.get("action") or "start"
+    if action == "start":
+        return jsonify({"ok": True, "tracemalloc": profiler.tracemalloc_start(int(payload.get("frames") or 10))})
+    if action == "stop":
+        return jsonify({"ok": True, "tracemalloc": profiler.tracemalloc_stop()})
+    return jsonify({"ok": False, "error": "action must be start or stop"}), 400
+
+@app.post("/api/debug/memory/snapshot")
+@require_auth
+def api_debug_memory_snapshot():
+    if profiler is None:
+        return _profiling_disabled()
+    payload = request.get_json(silent=True) or {}
+    try:
+        snap = profiler.snapshot(payload.get("name"), top=int(payload.get("top") or 20))
+    except RuntimeError as e:
+        return jsonify({"ok": False, "error": str(e)}), 409
+    return jsonify({"ok": True, "snapshot": snap})
+
+@app.route("/api/debug/memory/diff")
+@require_auth
+def api_debug_memory_diff():
+    """?base=<name>&current=<name>（current 省略時は今のスナップショットと比較）"""
+    if profiler is None:
+        return _profiling_disabled()
+    base = request.args.get("base")
+    if not base:
+        return jsonify({"ok": False, "error": "base is required"}), 400
+    try:
+        diff = profiler.diff(base, request.args.get("current"), top=int(request.args.get("top") or 20))
+    except KeyError as e:
+        return jsonify({"ok": False, "error": f"snapshot not found: {e.args[0]}"}), 404
+    except RuntimeError as e:
+        return jsonify({"ok": False, "error": str(e)}), 409
+    return jsonify({"ok": True, "diff": diff})
+
+@app.route("/api/debug/memory")
+@require_auth
+def api_debug_memory():
+    if profiler is None:
+        return _profiling_disabled()
+    return jsonify({"ok": True, "memory": profiler.memory()})
+
+@app.route("/api/debug/threads")
+@require_auth
+def api_debug_threads():
+    """OS スレッドと greenlet のスタック（?greenlets=0 でスレッドだけ）"""
+    if profiler is None:
+        return _profiling_disabled()
+    out = {"ok": True, "concurrency": socketio.async_mode, "threads": profiler.dump_threads()}
+    if request.args.get("greenlets", "1") == "1":
+        out["greenlets"] = profiler.dump_greenlets(int(request.args.get("limit") or 500))
+    return jsonify(out)
+
+# ============================================================
+# グレースフルドレイン（drain.py）：再起動・入れ替えの前に新規受付を止め、進行中の処理を期限内に片付ける
+#  - 開始: POST /api/drain（?wait=1 で完了まで待って報告を返す）か、直接起動時の SIGTERM（DRAIN_ON_SIGTERM=0 で無効）
+#    ドレインは再起動まで戻せないので、POST /api/drain は APP_PIN 未設定（認証なし）なら 403（SIGTERM は使える）
+#  - ドレイン中: Socket.IO の新規接続・フィードバック生成・ターン追加・バックアップは断る（503 + Retry-After）。
+#    /healthz も 503 を返すので、ロードバランサーはこのインスタンスに新しいリクエストを振らなくなる
+#  - DRAIN_DEADLINE_SEC 以内に: フィードバック生成の完了待ち → 上流（OpenAI）接続のクローズ → 書き込みの反映
+#  - 期限までに終わらなかったフィードバック生成・埋め込みは DRAIN_CHECKPOINT に書き出し、次の起動で再開する
+#    （再開は resume_drain_checkpoint()。直接起動では自動で呼ぶ。gunicorn では post_worker_init などの
+#     サーバーフックから呼ぶ。取り出しはファイルの rename で行うので、複数ワーカーから呼んでも1回だけ）
+# ============================================================
+from drain import DrainController, take_checkpoint, wait_until
+
+DRAIN_CHECKPOINT = os.environ.get("DRAIN_CHECKPOINT") or "drain_checkpoint.json"
+drain = DrainController(deadline_sec=float(os.environ.get("DRAIN_DEADLINE_SEC") or 25),
+                        checkpoint_path=DRAIN_CHECKPOINT)
+
+def _draining_response():
+    retry_after = str(max(1, int(drain.remaining())))
+    resp = jsonify({"ok": False, "error": "server is draining", "retry_after": retry_after})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = retry_after
+    return resp
+
+def _drain_feedback(deadline):
+    """先行生成・明示的な生成・逐次分析の完了を待つ（終わらなかった生成は checkpoint に回る）"""
+    def _idle():
+        return (drain.in_flight("feedback") == 0
+                and not (rolling_analyzer and rolling_analyzer.stats()["running"]))
+    finished = wait_until(_idle, deadline)
+    return {"finished": finished, "unfinished": drain.in_flight("feedback")}
+
+def _drain_upstream(deadline):
+    """LEGACY 経路の OpenAI WebSocket を close フレーム付きで閉じ、接続中のクライアントに知らせる"""
+    relays = 0
+    for sid, state in list(client_states.items()):
+        socketio.emit('status_message', {'message': "サーバーを再起動します。しばらくしてから再接続してください。"}, room=sid)
+        ws = state.get("ws_connection")
+        if ws is None:
+            continue
+        relays += 1
+        timeout = max(0.1, min(3.0, deadline - time.monotonic()))
+        socketio.start_background_task(ws.close, status=1001, timeout=timeout)  # 1001: going away
+    closed = wait_until(lambda: not any(s.get("ws_connection") for s in list(client_states.values())), deadline)
+    return {"clients": len(client_states), "relays": relays, "closed": closed,
+            "realtime_in_flight": admission.stats()["classes"]["realtime"]["in_flight"]}
+
+def _drain_writes(deadline):
+    """実行中の DB 処理と埋め込みの追記を待ち、WAL を本体に書き戻す"""
+    out = {}
+    if db_backup_manager:
+        db_backup_manager.stop()
+        out["backup_finished"] = wait_until(lambda: not db_backup_manager.stats()["progress"].get("running"), deadline)
+    out["vectors_finished"] = wait_until(lambda: drain.in_flight("vectors") == 0, deadline)
+    if session_vectors is not None:
+        session_vectors.close()
+    out["db_finished"] = wait_until(lambda: store.executor_stats()["pending"] == 0, deadline)
+    out["wal"] = store.checkpoint_wal()
+    return out
+
+drain.add_phase("feedback", _drain_feedback)
+drain.add_phase("upstream", _drain_upstream, reserve_sec=3)
+drain.add_phase("writes", _drain_writes, reserve_sec=3)
+
+def _resume_checkpoint(items):
+    """前回のドレインで終わらなかった生成・埋め込みをやり直す（もう結果がある分は飛ばす）"""
+    for session_id in items.get("feedback") or []:
+        fb = store.get_feedback(session_id)
+        if fb is not None and not (isinstance(fb, dict) and fb.get("provisional")):
+            continue
+        result = _pregenerate_feedback(session_id)
+        if result.get("error"):
+            print(f"drain checkpoint: feedback not resumed: {session_id}: {result['error']}")
+        elif store.save_feedback(session_id, result):
+            _on_feedback_saved(session_id)
+    if session_vectors is not None:
+        for session_id in items.get("vectors") or []:
+            if session_id not in session_vectors:
+                _index_session_vector(session_id)
+
+def resume_drain_checkpoint():
+    """サーバーの起動時に呼ぶ（import しただけでは checkpoint を取り出さない）"""
+    items = take_checkpoint(DRAIN_CHECKPOINT)
+    if items:
+        print(f"drain checkpoint: resuming {dict((k, len(v)) for k, v in items.items())}")
+        socketio.start_background_task(_resume_checkpoint, items)
+    return items
+
+def _drain_and_exit(reason):
+    drain.run(reason)
+    sys.stdout.flush()
+    os._exit(0)
+
+def _install_drain_signal():
+    """SIGTERM でドレインしてから終了する（ドレイン中にもう一度届いたら即終了）"""
+    import signal
+    received = []
+
+    def _on_sigterm(signum, frame):
+        if received:
+            print("drain: second SIGTERM, exiting now")
+            os._exit(128 + signum)
+        received.append(signum)
+        drain.begin("SIGTERM")  # POST /api/drain で始まっていれば、その完了を待ってから終了する
+        socketio.start_background_task(_drain_and_exit, "SIGTERM")
+
+    signal.signal(signal.SIGTERM, _on_sigterm)
+
+@app.route("/healthz")
+def healthz():
+    """ロードバランサーのヘルスチェック用（認証なし。ドレイン中は 503）"""
+    if drain.draining:
+        return _draining_response()
+    return jsonify({"ok": True})
+
+@app.post("/api/drain")
+@require_auth
+def api_drain():
+    if not _auth_enabled():
+        return jsonify({"ok": False, "error": "drain API requires authentication (set APP_PIN)"}), 403
+    if request.args.get("wait") == "1":
+        return jsonify({"ok": True, "report": drain.run("api")})
+    if drain.begin("api"):  # 受付はこの時点で止め、フェーズはバックグラウンドで進める
+        socketio.start_background_task(drain.run, "api")
+    return jsonify({"ok": True, "stats": drain.stats()}), 202
+
+@app.route("/api/drain/stats")
+@require_auth
+def api_drain_stats():
+    return jsonify({"ok": True, "stats": drain.stats()})
+
+# ============================================================
+# 起動処理：テンプレートの事前コンパイルと起動時間レポート
+# ============================================================
+def _precompile_templates():
+    """全テンプレートを起動時にコンパイルして jinja のキャッシュに載せる"""
+    n = 0
+    for name in app.jinja_env.list_templates(extensions=["html"]):
+        try:
+            app.jinja_env.get_template(name)
+            n += 1
+        except Exception as e:
+            print(f"テンプレートのコンパイルに失敗: {name}: {e}")
+    return n
+
+_precompiled_templates = _precompile_templates()
+_boot_mark("templates")
+
+if SCENARIO_RECOMMEND:
+    socketio.start_background_task(_get_scenario_index)
+
+STARTUP_REPORT = {
+    "total_ms": round((time.perf_counter() - _BOOT_T0) * 1000, 1),
+    "phases_ms": {},
+    "templates": _precompiled_templates,
+    "legacy_ws": ENABLE_LEGACY_OPENAI_WS,
+    "concurrency": socketio.async_mode,
+    "db_executor": store.executor_stats()["mode"],
+}
+_prev = _BOOT_T0
+for _name, _t in _BOOT_PHASES:
+    STARTUP_REPORT["phases_ms"][_name] = round((_t - _prev) * 1000, 1)
+    _prev = _t
+print(f"startup: {json.dumps(STARTUP_REPORT, ensure_ascii=False)}")
+
+@app.route("/api/delivery/stats")
+@require_auth
+def api_delivery_stats():
+    return jsonify({"ok": True, "assets": static_assets.stats(),
+                    "compression": response_compressor.stats() if response_compressor else None})
+
+@app.route("/api/startup")
+@require_auth
+def api_startup():
+    return jsonify(STARTUP_REPORT)
+
 if __name__ == "__main__":
-    socketio.run(app, host='0.0.0.0', port=5000)
\ No newline at end of file
+    if os.environ.get("DRAIN_ON_SIGTERM", "1") == "1":
+        _install_drain_signal()
+    resume_drain_checkpoint()
+    socketio.run(app, host='0.0.0.0', port=int(os.environ.get("PORT") or 5000),
+                 **concurrency.run_options(socketio.async_mode))
\ No newline at end of file
@@ -0,0 +1,126 @@
+# transcript_compactor.py
+"""
+フィードバック用プロンプトに入れる会話ログを、トークン予算内に収める。
+
+- トークン数はオフラインの概算（日本語など非ASCIIは1文字≒1トークン、ASCIIは4文字≒1トークン）
+- 冒頭 head_turns ターンと、末尾から予算が許す限りのターンを原文で残す
+- 間のターンは「中略」マーカーと、ユーザー発言の冒頭だけを抜き出した要約行に置き換える
+  （要約行も予算を超えない分だけ）
+"""
+from __future__ import annotations
+from typing import Optional, Dict, Any, List, Tuple
+import os
+
+DEFAULT_TOKEN_BUDGET = 6000
+DEFAULT_HEAD_TURNS = 4
+MIDDLE_SNIPPET_CHARS = 40
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    tokenizer を使わない概算。実トークン数よりやや多めに出る。
+    """
+    if not text:
+        return 0
+    ascii_chars = 0
+    other = 0
+    for ch in text:
+        if ord(ch) < 128:
+            ascii_chars += 1
+        else:
+            other += 1
+    return other + (ascii_chars + 3) // 4
+
+
+def token_budget_from_env() -> int:
+    try:
+        return int(os.environ.get("FEEDBACK_PROMPT_TOKEN_BUDGET") or DEFAULT_TOKEN_BUDGET)
+    except Exception:
+        return DEFAULT_TOKEN_BUDGET
+
+
+def _snippet(line: str, n: int = MIDDLE_SNIPPET_CHARS) -> str:
+    # "ユーザー: 本文" の本文側の最初の文だけ
+    role, sep, body = line.partition(": ")
+    if not sep:
+        role, body = "", line
+    for end in ("。", "？", "?", "！", "!", "\n"):
+        i = body.find(end)
+        if 0 <= i < n:
+            body = body[: i + 1]
+            break
+    if len(body) > n:
+        body = body[:n] + "…"
+    return f"- {role}: {body}" if role else f"- {body}"
+
+
+def compact_lines(lines: List[str], budget: Optional[int] = None,
+                  head_turns: int = DEFAULT_HEAD_TURNS) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    lines: "ユーザー: ..." / "AI: ..." 形式の1ターン1行
+    return: (予算内に収めた行, metrics)
+    """
+    budget = token_budget_from_env() if budget is None else int(budget)
+    costs = [estimate_tokens(x) + 1 for x in lines]  # +1 は改行分
+    total = sum(costs)
+    metrics: Dict[str, Any] = {
+        "budget_tokens": budget,
+        "turns_in": len(lines),
+        "tokens_in": total,
+        "turns_kept": len(lines),
+        "turns_summarized": 0,
+        "turns_dropped": 0,
+        "tokens_out": total,
+        "compacted": False,
+    }
+    if total <= budget or not lines:
+        return list(lines), metrics
+
+    # 冒頭（文脈・最初の返答）を確保。冒頭だけで予算超過なら冒頭も削る
+    head_n = min(head_turns, len(lines))
+    used = 0
+    head: List[str] = []
+    for i in range(head_n):
+        if used + costs[i] > budget // 2:
+            break
+        head.append(lines[i])
+        used += costs[i]
+    head_end = len(head)
+
+    # 末尾から詰める（中略マーカー分を先に確保）
+    marker_reserve = 16
+    tail_start = len(lines)
+    for i in range(len(lines) - 1, head_end - 1, -1):
+        if used + costs[i] + marker_reserve > budget:
+            break
+        used += costs[i]
+        tail_start = i
+    tail = lines[tail_start:]
+
+    # 中間はユーザー発言の冒頭だけを、残り予算の範囲で
+    middle = lines[head_end:tail_start]
+    summary: List[str] = []
+    for line in middle:
+        if not line.startswith("ユーザー: "):
+            continue
+        s = _snippet(line)
+        c = estimate_tokens(s) + 1
+        if used + c + marker_reserve > budget:
+            break
+        summary.append(s)
+        used += c
+
+    out = list(head)
+    if middle:
+        out.append(f"（中略：{len(middle)}ターン。主なユーザー発言の冒頭）" if summary else f"（中略：{len(middle)}ターン）")
+        out.extend(summary)
+    out.extend(tail)
+
+    metrics.update({
+        "turns_kept": len(head) + len(tail),
+        "turns_summarized": len(summary),
+        "turns_dropped": len(middle) - len(summary),
+        "tokens_out": sum(estimate_tokens(x) + 1 for x in out),
+        "compacted": True,
+    })
+    return out, metrics
@@ -0,0 +1,252 @@
+# upstream_admission.py
+"""
+OpenAI への呼び出し（SDP中継・フィードバック生成・LEGACY realtime 接続など）を、
+プロセス全体で1か所から入場制御する。
+
+- 優先度クラスごとの同時実行数と待ち行列の上限（例: sdp > feedback > background）
+- 全体の同時実行数と、トークンバケットによる送信レート（rpm / burst）
+- 待ち行列は優先度順（同じ優先度は到着順）。上位クラスが待っている間は下位クラスを通さない
+- 待ち行列が満杯 / 待ち時間の上限超過は AdmissionRejected（retry_after 秒つき）で即座に断る
+- 上流から 429 を受けたら penalize(retry_after) で全体を一時停止する
+- クラスごとの待ち時間（p50/p95/max）・通過数・拒否数を stats() で返す
+
+  admission = AdmissionController.from_env()
+  with admission.slot("sdp"):
+      ...  # OpenAI を呼ぶ
+"""
+from __future__ import annotations
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List
+import itertools
+import math
+import os
+import threading
+import time
+
+
+class AdmissionRejected(Exception):
+    """待ち行列が満杯、または待ち時間の上限を超えた（retry_after 秒後に再試行）"""
+    def __init__(self, cls: str, reason: str, retry_after: float):
+        super().__init__(f"{cls}: {reason}")
+        self.cls = cls
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, int(math.ceil(self.retry_after))))
+
+
+@dataclass(frozen=True)
+class AdmissionClass:
+    name: str
+    priority: int             # 小さいほど優先
+    max_concurrent: int
+    max_queue: int            # 0 なら待たずに断る
+    max_wait_sec: float
+    counts_global: bool = True  # 全体の同時実行数に数えるか（長時間つなぎっぱなしの realtime は数えない）
+
+
+DEFAULT_CLASSES = (
+    AdmissionClass("sdp", 0, 8, 32, 10.0),
+    AdmissionClass("realtime", 0, 50, 0, 0.0, counts_global=False),
+    AdmissionClass("feedback", 1, 4, 16, 30.0),
+    AdmissionClass("background", 2, 2, 8, 5.0),
+)
+
+
+class TokenBucket:
+    """rate_per_sec <= 0 なら無制限"""
+    def __init__(self, rate_per_sec: float, burst: float):
+        self.rate = float(rate_per_sec)
+        self.capacity = max(1.0, float(burst))
+        self._tokens = self.capacity
+        self._at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.rate > 0:
+            self._tokens = min(self.capacity, self._tokens + (now - self._at) * self.rate)
+        self._at = now
+
+    def try_take(self, now: Optional[float] = None) -> float:
+        """取れたら 0、取れなければ次のトークンまでの秒数"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return 0.0
+        return (1.0 - self._tokens) / self.rate
+
+
+class _Waiter:
+    __slots__ = ("cls", "key")
+
+    def __init__(self, cls: AdmissionClass, seq: int):
+        self.cls = cls
+        self.key = (cls.priority, seq)
+
+
+class _ClassStats:
+    __slots__ = ("admitted", "rejected_full", "rejected_timeout", "in_flight", "queued", "waits")
+
+    def __init__(self):
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.in_flight = 0
+        self.queued = 0
+        self.waits: deque = deque(maxlen=1000)  # 直近の待ち時間（秒）
+
+
+class AdmissionController:
+    def __init__(self, classes=DEFAULT_CLASSES, max_concurrent: int = 16, rpm: float = 0, burst: float = 10):
+        self.classes: Dict[str, AdmissionClass] = {c.name: c for c in classes}
+        self.max_concurrent = max(1, int(max_concurrent))
+        self._bucket = TokenBucket(rpm / 60.0 if rpm else 0.0, burst)
+        self._cond = threading.Condition(threading.Lock())
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._global_in_flight = 0
+        self._paused_until = 0.0
+        self._penalties = 0
+        self._stats: Dict[str, _ClassStats] = {name: _ClassStats() for name in self.classes}
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """
+        UPSTREAM_MAX_CONCURRENT / UPSTREAM_RPM / UPSTREAM_BURST と、
+        クラスごとの UPSTREAM_<CLASS>_CONCURRENCY / _QUEUE / _WAIT_SEC で上書きできる
+        """
+        def _env(name, default, conv):
+            v = os.environ.get(name)
+            return conv(v) if v not in (None, "") else default
+
+        classes = []
+        for c in DEFAULT_CLASSES:
+            p = f"UPSTREAM_{c.name.upper()}_"
+            classes.append(AdmissionClass(
+                c.name, c.priority,
+                _env(p + "CONCURRENCY", c.max_concurrent, int),
+                _env(p + "QUEUE", c.max_queue, int),
+                _env(p + "WAIT_SEC", c.max_wait_sec, float),
+                c.counts_global,
+            ))
+        return cls(classes,
+                   max_concurrent=_env("UPSTREAM_MAX_CONCURRENT", 16, int),
+                   rpm=_env("UPSTREAM_RPM", 0.0, float),
+                   burst=_env("UPSTREAM_BURST", 10.0, float))
+
+    # ---- 判定（self._cond 内で呼ぶ） ----
+    def _has_capacity(self, c: AdmissionClass) -> bool:
+        if self._stats[c.name].in_flight >= c.max_concurrent:
+            return False
+        return not c.counts_global or self._global_in_flight < self.max_concurrent
+
+    def _is_next(self, w: _Waiter) -> bool:
+        # 先に並んでいる上位（同順位なら先着）の待ちが通れる状態なら譲る
+        for o in self._waiters:
+            if o is not w and o.key < w.key and self._has_capacity(o.cls):
+                return False
+        return True
+
+    def _retry_after(self, c: AdmissionClass, now: float) -> float:
+        if self._paused_until > now:
+            return self._paused_until - now
+        return max(1.0, c.max_wait_sec / 2)
+
+    # ---- 入退場 ----
+    def acquire(self, cls: str) -> AdmissionClass:
+        c = self.classes[cls]
+        st = self._stats[cls]
+        started = time.monotonic()
+        deadline = started + c.max_wait_sec
+        with self._cond:
+            w = _Waiter(c, next(self._seq))
+            # 待たずに通れるか（上位の待ちが無く、枠とトークンがある）
+            if not (self._paused_until <= started and self._has_capacity(c) and self._is_next(w)
+                    and self._bucket.try_take(started) == 0.0):
+                if st.queued >= c.max_queue:
+                    st.rejected_full += 1
+                    raise AdmissionRejected(cls, "queue full", self._retry_after(c, started))
+                self._waiters.append(w)
+                st.queued += 1
+                try:
+                    while True:
+                        now = time.monotonic()
+                        if now >= deadline:
+                            st.rejected_timeout += 1
+                            raise AdmissionRejected(cls, "wait timeout", self._retry_after(c, now))
+                        wait = deadline - now
+                        if self._paused_until > now:
+                            wait = min(wait, self._paused_until - now)
+                        elif self._has_capacity(c) and self._is_next(w):
+                            need = self._bucket.try_take(now)
+                            if need == 0.0:
+                                break
+                            wait = min(wait, need)
+                        self._cond.wait(wait)
+                finally:
+                    self._waiters.remove(w)
+                    st.queued -= 1
+                    # 自分が抜けたことで次の待ちが通れるかもしれない
+                    self._cond.notify_all()
+            st.in_flight += 1
+            st.admitted += 1
+            if c.counts_global:
+                self._global_in_flight += 1
+            st.waits.append(time.monotonic() - started)
+        return c
+
+    def release(self, c: AdmissionClass) -> None:
+        with self._cond:
+            self._stats[c.name].in_flight -= 1
+            if c.counts_global:
+                self._global_in_flight -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, cls: str):
+        c = self.acquire(cls)
+        try:
+            yield c
+        finally:
+            self.release(c)
+
+    def penalize(self, retry_after: Optional[float]) -> None:
+        """上流の 429 を受けたら呼ぶ（Retry-After が無ければ 1 秒）"""
+        sec = retry_after if retry_after and retry_after > 0 else 1.0
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + sec)
+            self._penalties += 1
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            now = time.monotonic()
+            out: Dict[str, Any] = {
+                "global_in_flight": self._global_in_flight,
+                "max_concurrent": self.max_concurrent,
+                "paused_sec": round(max(0.0, self._paused_until - now), 3),
+                "penalties": self._penalties,
+                "classes": {},
+            }
+            for name, st in self._stats.items():
+                c = self.classes[name]
+                waits = sorted(st.waits)
+                out["classes"][name] = {
+                    "priority": c.priority,
+                    "max_concurrent": c.max_concurrent,
+                    "in_flight": st.in_flight,
+                    "queued": st.queued,
+                    "admitted": st.admitted,
+                    "rejected_full": st.rejected_full,
+                    "rejected_timeout": st.rejected_timeout,
+                    "wait_ms_p50": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                    "wait_ms_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+                    "wait_ms_max": round(waits[-1] * 1000, 1) if waits else 0.0,
+                }
+        return out